@@ -26,6 +26,7 @@ showMask   - show mask of the referred object given ref
 
 import itertools
 import json
+import os
 import os.path as osp
 import pickle
 import sys
@@ -39,6 +40,33 @@ from matplotlib.patches import Polygon, Rectangle
 from pycocotools import mask
 
 
+# the members of the ref-level and the annotation-level index, persisted in separate files
+REF_INDEX_MEMBERS = ["Refs", "Imgs", "Cats", "Sents", "imgToRefs", "annToRef", "catToRefs", "sentToRef",
+                     "sentToTokens"]
+ANN_INDEX_MEMBERS = ["Anns", "imgToAnns", "refToAnn"]
+
+
+def _indexAnns(annotations):
+    Anns, imgToAnns = {}, {}
+    for ann in annotations:
+        Anns[ann["id"]] = ann
+        imgToAnns.setdefault(ann["image_id"], []).append(ann)
+    return {"Anns": Anns, "imgToAnns": imgToAnns}
+
+
+class _LazyData(dict):
+    # the data dict, which loads the annotations on the first access
+    def __init__(self, load_annotations, *args):
+        super().__init__(*args)
+        self._load_annotations = load_annotations
+
+    def __missing__(self, key):
+        if key != "annotations":
+            raise KeyError(key)
+        self._load_annotations()
+        return dict.__getitem__(self, key)
+
+
 class REFER:
     def __init__(self, data_root, dataset="refcoco", splitBy="unc"):
         # provide data_root folder which contains refclef, refcoco, refcoco+ and refcocog
@@ -62,21 +90,82 @@ class REFER:
 
         ref_file = osp.join(self.DATA_DIR, "refs(" + splitBy + ").p")
         print("ref_file: ", ref_file)
-        self.data = {}
-        self.data["dataset"] = dataset
-        self.data["refs"] = pickle.load(open(ref_file, "rb"))
-
-        # load annotations from data/dataset/instances.json
-        instances_file = osp.join(self.DATA_DIR, "instances.json")
-        instances = json.load(open(instances_file, "rb"))
-        self.data["images"] = instances["images"]
-        self.data["annotations"] = instances["annotations"]
-        self.data["categories"] = instances["categories"]
-
-        # create index
-        self.createIndex()
+        self.instances_file = osp.join(self.DATA_DIR, "instances.json")
+        # the built index is persisted next to the refs, and rebuilt when the refs or the instances are changed
+        self.index_file = osp.join(self.DATA_DIR, "index(" + splitBy + ").p")
+        self.anns_index_file = osp.join(self.DATA_DIR, "index(" + splitBy + ").anns.p")
+        self.signature = [
+            (os.stat(file).st_size, os.stat(file).st_mtime_ns) for file in (ref_file, self.instances_file)
+        ]
+
+        if self.loadIndex():
+            print("index loaded from %s" % self.index_file)
+        else:
+            self.data = {}
+            self.data["dataset"] = dataset
+            self.data["refs"] = pickle.load(open(ref_file, "rb"))
+
+            # load annotations from data/dataset/instances.json
+            instances = json.load(open(self.instances_file, "rb"))
+            self.data["images"] = instances["images"]
+            self.data["annotations"] = instances["annotations"]
+            self.data["categories"] = instances["categories"]
+
+            # create index
+            self.createIndex()
+            self.saveIndex()
         print("DONE (t=%.2fs)" % (time.time() - tic))
 
+    def loadIndex(self):
+        # load the ref-level index, the annotation-level index (Anns, imgToAnns, refToAnn and data["annotations"])
+        # is only loaded when it is accessed, as the segmentations are much larger and not needed to iterate the refs
+        if not osp.exists(self.index_file):
+            return False
+        with open(self.index_file, "rb") as f:
+            index = pickle.load(f)
+        if index["signature"] != self.signature:
+            return False
+        self.data = _LazyData(self._loadAnnsIndex, index.pop("data"))
+        for member in REF_INDEX_MEMBERS:
+            setattr(self, member, index[member])
+        return True
+
+    def _loadAnnsIndex(self):
+        index = None
+        if osp.exists(self.anns_index_file):
+            with open(self.anns_index_file, "rb") as f:
+                index = pickle.load(f)
+        if index is None or index["signature"] != self.signature:
+            print("creating annotation index...")
+            annotations = json.load(open(self.instances_file, "rb"))["annotations"]
+            index = {"annotations": annotations, **_indexAnns(annotations)}
+            index["refToAnn"] = {ref_id: index["Anns"][ref["ann_id"]] for ref_id, ref in self.Refs.items()}
+        dict.__setitem__(self.data, "annotations", index["annotations"])
+        for member in ANN_INDEX_MEMBERS:
+            self.__dict__[member] = index[member]
+
+    def saveIndex(self):
+        # each part is pickled at once, so the refs shared by the mappings are stored once
+        ref_index = {member: getattr(self, member) for member in REF_INDEX_MEMBERS}
+        ref_index["data"] = {k: v for k, v in self.data.items() if k != "annotations"}
+        anns_index = {member: getattr(self, member) for member in ANN_INDEX_MEMBERS}
+        anns_index["annotations"] = self.data["annotations"]
+        try:
+            for file, index in ((self.anns_index_file, anns_index), (self.index_file, ref_index)):
+                with open(file + ".tmp", "wb") as f:
+                    pickle.dump({"signature": self.signature, **index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(file + ".tmp", file)
+        except OSError:
+            # the data root can be read-only, the index is then built for every run
+            pass
+
+    def __getattr__(self, name):
+        # the annotation-level index is loaded on the first access
+        if name in ANN_INDEX_MEMBERS and "data" in self.__dict__ and isinstance(self.data, _LazyData):
+            self._loadAnnsIndex()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
     def createIndex(self):
         # create sets of mapping
         # 1)  Refs: 	 	{ref_id: ref}
@@ -93,10 +182,9 @@ class REFER:
         # 12) sentToTokens: {sent_id: tokens}
         print("creating index...")
         # fetch info from instances
-        Anns, Imgs, Cats, imgToAnns = {}, {}, {}, {}
-        for ann in self.data["annotations"]:
-            Anns[ann["id"]] = ann
-            imgToAnns[ann["image_id"]] = imgToAnns.get(ann["image_id"], []) + [ann]
+        Imgs, Cats = {}, {}
+        ann_index = _indexAnns(self.data["annotations"])
+        Anns, imgToAnns = ann_index["Anns"], ann_index["imgToAnns"]
         for img in self.data["images"]:
             Imgs[img["id"]] = img
         for cat in self.data["categories"]:
@@ -114,8 +202,8 @@ class REFER:
 
             # add mapping related to ref
             Refs[ref_id] = ref
-            imgToRefs[image_id] = imgToRefs.get(image_id, []) + [ref]
-            catToRefs[category_id] = catToRefs.get(category_id, []) + [ref]
+            imgToRefs.setdefault(image_id, []).append(ref)
+            catToRefs.setdefault(category_id, []).append(ref)
             refToAnn[ref_id] = Anns[ann_id]
             annToRef[ann_id] = ref
 
@@ -0,0 +1,86 @@
+import asyncio
+import re
+import time
+
+import numpy as np
+import argparse
+
+parser = argparse.ArgumentParser(description="Benchmark the prompt size and latency of the context encodings. "
+                                             "The tokens are counted by tiktoken if it is installed (`pip install tiktoken`), otherwise estimated.")
+parser.add_argument("--num_entities", type=int, nargs="+", default=[5, 10, 20, 40])
+parser.add_argument("--relation_threshold", type=float, default=0.5)
+parser.add_argument("--relation_top_k", type=int, default=3)
+parser.add_argument("--repeat", type=int, default=20)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--base_config", type=str, default=None, help="If given, also measure the LLM latency of each mode.")
+parser.add_argument("--query", type=str, default="person on left in red")
+args = parser.parse_args()
+
+from hydra_vl4ai.util.config import Config
+if args.base_config is not None:
+    Config.base_config_path = args.base_config
+
+from naver.context.entity import EntityRegistry
+from naver.context.relation import GEOMETRY_RELATIONS
+from naver.context.store import ContextStore
+from naver.logic.problog import gen_prompt_problog_query
+from naver.logic.prompt_encoding import PROMPT_MODES, encode_context
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text))
+except ImportError:
+    # rough estimation without the tokenizer, one token for each word and each punctuation
+    def count_tokens(text: str) -> int:
+        return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+CATEGORIES = ["person", "car", "dog", "hot dog", "umbrella"]
+
+
+def synthetic_store(num_entities: int, rng: np.random.Generator) -> ContextStore:
+    # random boxes on a 640x480 image, and random geometry relation probabilities for every ordered pair
+    categories = rng.choice(CATEGORIES, num_entities).tolist()
+    top_left = rng.integers(0, [560, 400], size=(num_entities, 2))
+    bboxes = np.concatenate([top_left, top_left + rng.integers(20, 80, size=(num_entities, 2))], axis=1)
+    confidences = rng.uniform(0.3, 1., num_entities)
+    store = ContextStore.from_entities(EntityRegistry().from_arrays(categories, bboxes, confidences))
+    probs = rng.beta(0.5, 0.5, size=(num_entities, num_entities, len(GEOMETRY_RELATIONS)))
+    probs[np.arange(num_entities), np.arange(num_entities)] = np.nan
+    store.set_relation_tensor(GEOMETRY_RELATIONS, probs)
+    return store
+
+
+async def llm_latency(prompt: str) -> float:
+    from hydra_vl4ai.agent.llm import llm
+    start = time.perf_counter()
+    await llm(Config.base_config["llm_code_model"], prompt)
+    return time.perf_counter() - start
+
+
+async def main():
+    rng = np.random.default_rng(args.seed)
+    header = f"{'entities':>8} | {'mode':>8} | {'tokens':>8} | {'encode (ms)':>11}"
+    if args.base_config is not None:
+        header += f" | {'llm (s)':>8}"
+    print(header)
+    print("-" * len(header))
+    for num_entities in args.num_entities:
+        store = synthetic_store(num_entities, rng)
+        for mode in PROMPT_MODES:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                facts = encode_context(store, mode, args.relation_threshold, args.relation_top_k)
+            encode_time = (time.perf_counter() - start) / args.repeat * 1000
+            prompt = gen_prompt_problog_query(facts, args.query, sorted(set(store.entity_categories.tolist())))
+            row = f"{num_entities:>8} | {mode:>8} | {count_tokens(prompt):>8} | {encode_time:>11.3f}"
+            if args.base_config is not None:
+                row += f" | {await llm_latency(prompt):>8.2f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -91,7 +91,7 @@ class ConnectionManager:
         if session_id in self.session_states:
             del self.session_states[session_id]
         if session_id in self.naver_instances:
-            del self.naver_instances[session_id]
+            await self.naver_instances.pop(session_id).close()
         if session_id in self.state_info:
             del self.state_info[session_id]
         logger.info(f"WebSocket disconnected for session: {session_id}")
@@ -405,18 +405,20 @@ def update_state_info(naver: Naver, session_id: str) -> StateInfo:
 
 
 def context_to_dict(context: Context, final_result: Entity | None = None) -> dict:
+    store = context.store
     entities = [{
-        "id": v.id,
-        "category": v.category,
-        "bbox": v.bbox,
-        "bbox_confidence": v.bbox_confidence
-    } for v in context.entities.values()]
+        "id": entity_id,
+        "category": category,
+        "bbox": bbox,
+        "bbox_confidence": bbox_confidence
+    } for entity_id, category, bbox, bbox_confidence in zip(
+        store.ids, store.entity_categories.tolist(), store.bboxes.tolist(), store.confidences.tolist())]
 
     relations = [{
-        "subject_entity_id": v.subject_entity_id,
-        "object_entity_id": v.object_entity_id,
-        "relation_name": v.relation_name,
-    } for v in context.relations]
+        "subject_entity_id": store.ids[subject_index],
+        "object_entity_id": store.ids[object_index],
+        "relation_name": relation_name,
+    } for subject_index, object_index, relation_name in store.relation_groups()]
 
     attributes = [{
         "entity_id": v.entity_id,
@@ -1,36 +1,174 @@
-import tensorneko as N
 import argparse
-import torch
+import ast
+import json
+import sqlite3
+from itertools import islice
+from typing import Iterator
+
+import numpy as np
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--input", type=str, default="result.jsonl")
+parser.add_argument("--input", type=str, default="result.jsonl", help="The result jsonl, or the sqlite result store.")
+parser.add_argument("--slice_by", type=str, nargs="*", default=[], help="The result fields to report the metrics for each value, e.g. split.")
+parser.add_argument("--bootstrap", type=int, default=1000, help="The number of bootstrap resamples for the confidence intervals, 0 to disable.")
+parser.add_argument("--chunk_size", type=int, default=100000)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--output", type=str, default=None, help="Save the metrics to this json file.")
 args = parser.parse_args()
 
-ious = []
-accs = []
-err = 0
-success = 0
-for each in N.io.read.json.of_jsonl(args.input):
-    if "iou" not in each:
-        try:
-            iou = N.evaluation.iou_2d(
-                torch.tensor(eval(each["result"])["final_answer"][:4]),
-                torch.tensor([each["ground_truth"]]),
-            )[0, 0].item()
-        except TypeError:
-            err += 1
+IOU_THRESHOLDS = [round(0.5 + 0.05 * i, 2) for i in range(10)]
+PERCENTILES = [50, 90, 95, 99]
+
+
+def read_chunks(path: str, chunk_size: int) -> Iterator[list[dict]]:
+    if path.endswith(".sqlite"):
+        # the table of `naver.utils.result_store.ResultStore`, read directly to avoid importing the agent
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        cursor = conn.execute("SELECT record FROM results ORDER BY idx, rowid")
+        while rows := cursor.fetchmany(chunk_size):
+            yield [loads(record) for (record,) in rows]
+        conn.close()
+        return
+    with open(path, "rb") as f:
+        while lines := list(islice(f, chunk_size)):
+            yield [loads(line) for line in lines if line.strip()]
+
+
+def iou_2d(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    # the IoU of the paired xyxy boxes, in (N,)
+    width = np.clip(np.minimum(boxes_a[:, 2], boxes_b[:, 2]) - np.maximum(boxes_a[:, 0], boxes_b[:, 0]), 0, None)
+    height = np.clip(np.minimum(boxes_a[:, 3], boxes_b[:, 3]) - np.maximum(boxes_a[:, 1], boxes_b[:, 1]), 0, None)
+    intersection = width * height
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a + area_b - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def parse_chunk(results: list[dict]) -> dict[str, np.ndarray]:
+    # the IoU is nan for the failed data
+    ious = np.full(len(results), np.nan)
+    legacy_rows, legacy_boxes, legacy_ground_truths = [], [], []
+    for row, each in enumerate(results):
+        if "iou" in each:
+            if each["iou"] is not None:
+                ious[row] = each["iou"]
             continue
+        # the results of the previous versions store the program output as a python literal string
+        try:
+            final_answer = ast.literal_eval(each["result"])["final_answer"]
         except KeyError:
-            iou = 0
-    else:
-        iou = each["iou"]
-        if iou is None:
-            err += 1
+            ious[row] = 0
             continue
-    success += 1
-    accs.append(1 if iou > 0.5 else 0)
-    ious.append(iou)
+        except (TypeError, ValueError, SyntaxError):
+            continue
+        legacy_rows.append(row)
+        legacy_boxes.append(final_answer[:4])
+        legacy_ground_truths.append(each["ground_truth"][:4])
+    if legacy_rows:
+        ious[legacy_rows] = iou_2d(np.array(legacy_boxes, dtype=np.float64), np.array(legacy_ground_truths, dtype=np.float64))
+
+    def column(key: str) -> np.ndarray:
+        return np.array([np.nan if (value := each.get(key)) is None else value for each in results], dtype=np.float64)
+
+    return {
+        "iou": ious,
+        "wall_time": column("wall_time"),
+        "llm_latency": column("llm_latency"),
+        "gpu_time": column("gpu_time"),
+        "cost": column("cost"),
+        **{f"slice:{key}": np.array([str(each.get(key)) for each in results], dtype=object) for key in args.slice_by},
+    }
+
+
+def bootstrap_ci(ious: np.ndarray, rng: np.random.Generator) -> dict[str, list[float]]:
+    # resample the histogram of the IoU instead of the rows, so it is O(resamples x bins) for any number of rows.
+    # each row is binned by the number of thresholds it passes with the same `iou > threshold` as the point
+    # estimates, and by the IoU in 1/1000 for the mean, represented by the mean IoU in the bin.
+    # the 95% intervals of the mean IoU and the accuracies
+    levels = (ious[:, None] > np.array(IOU_THRESHOLDS)).sum(axis=1)
+    bins = np.clip(np.floor(ious * 1000).astype(np.int64), 0, 1000) * (len(IOU_THRESHOLDS) + 1) + levels
+    num_bins = 1001 * (len(IOU_THRESHOLDS) + 1)
+    counts = np.bincount(bins, minlength=num_bins)
+    centers = np.bincount(bins, weights=ious, minlength=num_bins) / np.maximum(counts, 1)
+    resampled = rng.multinomial(len(ious), counts / counts.sum(), size=args.bootstrap)
+    intervals = {"mean_iou": resampled @ centers / len(ious)}
+    resampled_levels = resampled.reshape(args.bootstrap, 1001, len(IOU_THRESHOLDS) + 1).sum(axis=1)
+    for i, threshold in enumerate(IOU_THRESHOLDS):
+        intervals[f"acc@{threshold}"] = resampled_levels[:, i + 1:].sum(axis=1) / len(ious)
+    return {key: np.percentile(values, [2.5, 97.5]).tolist() for key, values in intervals.items()}
+
+
+def compute_metrics(columns: dict[str, np.ndarray], rng: np.random.Generator | None = None) -> dict:
+    failed = np.isnan(columns["iou"])
+    ious = columns["iou"][~failed]
+    metrics = {
+        "count": len(failed),
+        "error_rate": float(failed.mean()) if len(failed) else float("nan"),
+        "mean_iou": float(ious.mean()) if len(ious) else float("nan"),
+    }
+    for threshold in IOU_THRESHOLDS:
+        metrics[f"acc@{threshold}"] = float((ious > threshold).mean()) if len(ious) else float("nan")
+    metrics["acc@0.5:0.95"] = float(np.mean([metrics[f"acc@{threshold}"] for threshold in IOU_THRESHOLDS]))
+
+    for key in ("wall_time", "llm_latency", "gpu_time", "cost"):
+        values = columns[key][~np.isnan(columns[key])]
+        if len(values):
+            metrics[key] = {"mean": float(values.mean()), "total": float(values.sum()),
+                            **{f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}}
+    if rng is not None and args.bootstrap > 0 and len(ious):
+        metrics["ci95"] = bootstrap_ci(ious, rng)
+    return metrics
+
+
+def format_metrics(metrics: dict, indent: str = "") -> str:
+    ci = metrics.get("ci95", {})
+
+    def with_ci(key: str) -> str:
+        return f"{metrics[key]:.4f}" + (f" [{ci[key][0]:.4f}, {ci[key][1]:.4f}]" if key in ci else "")
+
+    lines = [
+        f"{indent}count: {metrics['count']}, error rate: {metrics['error_rate']:.4f}",
+        f"{indent}mean IoU: {with_ci('mean_iou')}",
+        f"{indent}Accuracy: {with_ci('acc@0.5')}",
+        f"{indent}Acc@0.5:0.95: {metrics['acc@0.5:0.95']:.4f} (" +
+        ", ".join(f"{threshold}: {metrics[f'acc@{threshold}']:.4f}" for threshold in IOU_THRESHOLDS) + ")",
+    ]
+    for key in ("wall_time", "llm_latency", "gpu_time", "cost"):
+        if key in metrics:
+            stats = metrics[key]
+            lines.append(f"{indent}{key}: mean {stats['mean']:.4f}, total {stats['total']:.2f}, " +
+                         ", ".join(f"p{p} {stats[f'p{p}']:.4f}" for p in PERCENTILES))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    chunks = [parse_chunk(results) for results in read_chunks(args.input, args.chunk_size)]
+    columns = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]} if chunks else {}
+    if not columns:
+        raise ValueError(f"No result is found in {args.input}")
+
+    rng = np.random.default_rng(args.seed)
+    metrics = compute_metrics(columns, rng)
+    print(format_metrics(metrics))
+
+    metrics["slices"] = {}
+    for key in args.slice_by:
+        metrics["slices"][key] = {}
+        # group the rows by the slice value at once, instead of a full scan for each value
+        slice_values, inverse = np.unique(columns[f"slice:{key}"], return_inverse=True)
+        groups = np.split(np.argsort(inverse, kind="stable"), np.cumsum(np.bincount(inverse))[:-1])
+        for value, rows in zip(slice_values, groups):
+            slice_metrics = compute_metrics({name: values[rows] for name, values in columns.items()}, rng)
+            metrics["slices"][key][value] = slice_metrics
+            print(f"\n[{key} = {value}]\n{format_metrics(slice_metrics, '  ')}")
 
-print(f"mean IoU: {sum(ious) / len(ious)}")
-print(f"Accuracy: {sum(accs) / len(accs)}")
-print(f"Error rate: {err / (success + err)}")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(metrics, f, indent=2)
@@ -1,12 +1,10 @@
 import json
 import numpy as np
-import pandas as pd
 import os
 import cv2
 from torch.utils.data import Dataset
 from rich.progress import track
 from _refer import REFER
-from PIL import Image
 from pycocotools import mask as mask_util
 
 
@@ -15,38 +13,68 @@ class Refcoco(Dataset):
     def __init__(self, data_root: str, split: str = "testA") -> None:
         super().__init__()
         self.data_root = data_root
+        self.split = split
+        split_path = os.path.join(self.data_root, f"{split}.json")
+        # the parsed index is cached next to the split json, and rebuilt when the json is changed
+        cache_path = os.path.join(self.data_root, f"{split}.index.npz")
+        stat = os.stat(split_path)
+        signature = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+        index = None
+        if os.path.exists(cache_path):
+            with np.load(cache_path, allow_pickle=False) as cache:
+                if np.array_equal(cache["signature"], signature):
+                    index = {key: cache[key] for key in cache.files}
+        if index is None:
+            index = self._build_index(split_path)
+            index["signature"] = signature
+            try:
+                tmp_path = cache_path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, **index)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                # the data root can be read-only, the index is then built for every run
+                pass
+
+        self.img_names = index["img_names"]
+        self.sent_ids = index["sent_ids"]
+        self.sub_queries = index["sub_queries"]
+        self.ground_trues = index["ground_trues"]
+
+    @staticmethod
+    def _build_index(split_path: str) -> dict[str, np.ndarray]:
         # open test dataset
-        with open(os.path.join(self.data_root, f"{split}.json")) as refcocotrain:
+        with open(split_path) as refcocotrain:
             ref_coco_train_data = json.load(refcocotrain)
 
-        ref_df = pd.DataFrame(
-            columns=['img_name', 'sent_id', 'sub_query', 'ground_true'])
-
+        img_names, sent_ids, sub_queries, ground_trues = [], [], [], []
         for img_set in track(ref_coco_train_data):
-
-            # load each data
-            img_name = img_set['img_name']
-
-            ground_true = img_set['bbox']
-
             for sub in img_set['sentences']:
-
-                # sub_query (content/question)
-                sub_query = sub['sent']
+                img_names.append('train2014/' + img_set['img_name'])
                 # query_id
-                sent_id = sub['sent_id']
+                sent_ids.append(sub['sent_id'])
+                # sub_query (content/question)
+                sub_queries.append(sub['sent'])
+                ground_trues.append(img_set['bbox'])
+
+        return {
+            "img_names": np.array(img_names, dtype=str),
+            "sent_ids": np.array(sent_ids),
+            "sub_queries": np.array(sub_queries, dtype=str),
+            "ground_trues": np.array(ground_trues, dtype=np.float64).reshape(-1, 4),
+        }
 
-                new_row_ = pd.DataFrame.from_records(
-                    [{'img_name': 'train2014/'+img_name, 'sent_id': sent_id, 'sub_query': sub_query, 'ground_true': ground_true}])
-                ref_df = pd.concat([ref_df, new_row_], ignore_index=True)
-        self.metadata = ref_df
-    
     def __getitem__(self, idx):
-        row = self.metadata.iloc[idx]
-        return os.path.join(self.data_root, row.img_name), row.sent_id, row.sub_query, row.ground_true
-    
+        return (os.path.join(self.data_root, str(self.img_names[idx])), self.sent_ids[idx].item(),
+                str(self.sub_queries[idx]), self.ground_trues[idx].tolist())
+
+    def metadata(self, idx) -> dict:
+        # the fields saved with the result, for the evaluation slices
+        return {"split": self.split}
+
     def __len__(self):
-        return len(self.metadata)
+        return len(self.sent_ids)
 
 
 class RefAdv(Dataset):
@@ -88,6 +116,9 @@ class RefAdv(Dataset):
         most_confused_bbox = self._convert_bbox_to_xyxy(bbox_candidates_map[row['most_confused_bbox_number']])
         return img_path, None, row['most_confused_bbox_GT_desc'], most_confused_bbox
 
+    def metadata(self, idx) -> dict:
+        return {"split": "test"}
+
     @staticmethod
     def _convert_bbox_to_xyxy(bbox):
         x_min, y_min, width, height = bbox
@@ -107,20 +138,78 @@ class Refer(Dataset):
         self.image_root = "images/mscoco/images/train2014" if dataset != "refclef" else "images/saiapr_tc-12"
 
         self.refer_api = REFER(data_root, dataset, split_type)
+        self.split = split
         self.refs = {k: v for k, v in self.refer_api.Refs.items() if v["split"] == split}
         self.refs_ids = sorted(list(self.refs.keys()))
         self.label_type = label_type
 
+        if label_type == "bbox":
+            # the boxes of the split are derived from the annotations once and cached next to the REFER index
+            cache_path = os.path.join(self.refer_api.DATA_DIR, f"boxes({split_type}_{split}).npz")
+            self.boxes = self._load_boxes(cache_path)
+
+    def _load_boxes(self, cache_path: str) -> np.ndarray:
+        signature = np.array(self.refer_api.signature, dtype=np.int64).reshape(-1)
+        ref_ids = np.array(self.refs_ids, dtype=np.int64)
+        if os.path.exists(cache_path):
+            with np.load(cache_path, allow_pickle=False) as cache:
+                if np.array_equal(cache["signature"], signature) and np.array_equal(cache["ref_ids"], ref_ids):
+                    return cache["boxes"]
+
+        boxes = self._compute_boxes()
+        try:
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, signature=signature, ref_ids=ref_ids, boxes=boxes)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # the data root can be read-only, the boxes are then computed for every run
+            pass
+        return boxes
+
+    def _compute_boxes(self) -> np.ndarray:
+        # the same boxes as `cv2.boundingRect` of the rasterized masks, without rasterizing them: the polygons
+        # filled by `cv2.fillPoly` cover the pixels from the min to the max of the int32 vertices, clipped to the image
+        boxes = np.zeros((len(self.refs_ids), 4), dtype=np.int64)
+        sizes = np.zeros((len(self.refs_ids), 2), dtype=np.int64)
+        polygon_items, polygon_points = [], []
+        for i, ref_id in enumerate(self.refs_ids):
+            annotation = self.refer_api.refToAnn[ref_id]
+            image = self.refer_api.Imgs[self.refer_api.Refs[ref_id]["image_id"]]
+            sizes[i] = image["width"], image["height"]
+            if type(annotation["segmentation"][0]) is list:
+                points = np.concatenate([np.array(seg).reshape((-1, 2)) for seg in annotation["segmentation"]])
+                polygon_items.append(i)
+                polygon_points.append(points.astype(np.int32))
+            else:
+                # RLE used for refclef, the box of the first mask as in the mask mode
+                x, y, w, h = mask_util.toBbox(annotation["segmentation"])[0]
+                boxes[i] = x, y, x + w, y + h
+
+        if len(polygon_items) > 0:
+            points = np.concatenate(polygon_points)
+            starts = np.cumsum([0] + [len(p) for p in polygon_points[:-1]])
+            items = np.array(polygon_items)
+            mins = np.minimum.reduceat(points, starts)
+            maxs = np.maximum.reduceat(points, starts) + 1
+            lower = np.clip(mins, 0, sizes[items])
+            upper = np.clip(maxs, 0, sizes[items])
+            empty = np.any(upper <= lower, axis=1)
+            boxes[items] = np.where(empty[:, None], 0, np.concatenate([lower, upper], axis=1))
+        return boxes
+
     def __getitem__(self, index: int):
         ref_id = self.refs_ids[index]
-        annotation = self.refer_api.refToAnn[ref_id]
         ref = self.refer_api.Refs[ref_id]
+        image = self.refer_api.Imgs[ref["image_id"]]
+
+        file = os.path.join(self.data_root, self.image_root, image["file_name"])
 
-        file = os.path.join(self.data_root, self.image_root, self.refer_api.Imgs[ref["image_id"]]["file_name"])
+        if self.label_type == "bbox":
+            return file, ref["sentences"][0]["sent_id"], ref["sentences"][0]["sent"], self.boxes[index].tolist()
 
-        w, h = Image.open(file).size
-        
-        mask = np.zeros((h, w), dtype=np.uint8)
+        annotation = self.refer_api.refToAnn[ref_id]
+        mask = np.zeros((image["height"], image["width"]), dtype=np.uint8)
 
         if type(annotation["segmentation"][0]) is list:
             for seg in annotation["segmentation"]:
@@ -134,12 +223,25 @@ class Refer(Dataset):
             # (H, W, 1) -> (H, W)
             mask = mask[:, :, 0]
 
-        if self.label_type == "mask":
-            return file, ref["sentences"][0]["sent_id"], ref["sentences"][0]["sent"], mask > 0
-        elif self.label_type == "bbox":
-            x, y, w, h = cv2.boundingRect(mask)
-            bbox = [x, y, x + w, y + h]
-            return file, ref["sentences"][0]["sent_id"], ref["sentences"][0]["sent"], bbox
-    
+        return file, ref["sentences"][0]["sent_id"], ref["sentences"][0]["sent"], mask > 0
+
+    def metadata(self, index: int) -> dict:
+        ref = self.refer_api.Refs[self.refs_ids[index]]
+        return {"split": self.split, "category": self.refer_api.Cats[ref["category_id"]]}
+
     def __len__(self):
         return len(self.refs_ids)
+
+
+def build_dataset(name: str, data_root: str) -> Dataset:
+    match name:
+        case "refcoco":
+            return Refcoco(data_root, split="testA")
+        case "refcoco+":
+            return Refcoco(data_root, split="testA")
+        case "refcocog":
+            return Refer(data_root, "refcocog", "test", "bbox")
+        case "refadv":
+            return RefAdv(data_root)
+        case _:
+            raise ValueError("Invalid dataset")
@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+from pathlib import Path
+
+# only the standalone result store is imported, the agent needs the hydra config
+from naver.utils.result_store import ResultStore
+
+import argparse
+
+parser = argparse.ArgumentParser(
+    description="Run main.py on the dataset shards in parallel processes, and merge the shard results. "
+                "The unknown arguments are passed to main.py, e.g. --data_root, --base_config and --model_config.")
+parser.add_argument("--devices", type=str, nargs="+", default=["0"],
+                    help="The CUDA device set of each worker, e.g. `0,1 2,3` runs 2 workers. "
+                         "The device ids in the model config are relative to the device set.")
+parser.add_argument("--num_shards", type=int, default=None,
+                    help="The number of shards, default to the number of device sets. "
+                         "The shards are assigned to the device sets in round robin.")
+parser.add_argument("--result_folder", type=str, default="./result")
+parser.add_argument("--merge_only", action="store_true", help="Only merge the existing shard results.")
+args, main_args = parser.parse_known_args()
+
+SHARD_PATTERN = re.compile(r"result\.(?P<run>.+)\.shard(?P<shard>\d+)of(?P<num_shards>\d+)\.(?P<format>sqlite|jsonl)")
+
+
+def launch(num_shards: int) -> bool:
+    Path(args.result_folder).mkdir(parents=True, exist_ok=True)
+    workers = []
+    for shard_id in range(num_shards):
+        devices = args.devices[shard_id % len(args.devices)]
+        env = {**os.environ, "CUDA_VISIBLE_DEVICES": devices}
+        command = [sys.executable, "main.py", *main_args, "--result_folder", args.result_folder,
+                   "--shard_id", str(shard_id), "--num_shards", str(num_shards)]
+        log_path = Path(args.result_folder) / f"log.shard{shard_id}of{num_shards}.txt"
+        print(f"Shard {shard_id}: CUDA_VISIBLE_DEVICES={devices}, log {log_path}")
+        # each worker resumes its own shard result, so the launcher can be run again after a crash
+        log_file = open(log_path, "a")
+        workers.append((shard_id, subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT), log_file))
+
+    try:
+        return_codes = [(shard_id, worker.wait()) for shard_id, worker, _ in workers]
+    except KeyboardInterrupt:
+        for _, worker, _ in workers:
+            worker.send_signal(signal.SIGINT)
+        for _, worker, _ in workers:
+            worker.wait()
+        raise
+    finally:
+        for _, _, log_file in workers:
+            log_file.close()
+
+    failed = [shard_id for shard_id, return_code in return_codes if return_code != 0]
+    if failed:
+        print(f"Shards {failed} failed, run the launcher again to resume them.")
+    return len(failed) == 0
+
+
+def read_results(path: Path) -> list[tuple[int | None, dict]]:
+    # the dataset indices and the results of a shard
+    if path.suffix == ".sqlite":
+        with ResultStore(path) as store:
+            return list(store.items())
+    results = []
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append((None, json.loads(line)))
+            except json.JSONDecodeError:
+                # the truncated last line of a crashed worker
+                continue
+    return results
+
+
+def merge() -> None:
+    # group the shard results by the run, e.g. result.naver_refcoco.shard0of4.sqlite. the store of a shard is
+    # preferred, the jsonl is only for the shards written by the previous versions
+    runs: dict[tuple[str, int], dict[int, Path]] = {}
+    for path in sorted(Path(args.result_folder).glob("result.*.shard*of*.*")):
+        if (match := SHARD_PATTERN.fullmatch(path.name)) is not None:
+            shards = runs.setdefault((match["run"], int(match["num_shards"])), {})
+            if match["format"] == "sqlite" or int(match["shard"]) not in shards:
+                shards[int(match["shard"])] = path
+
+    for (run, num_shards), shards in runs.items():
+        if len(shards) < num_shards:
+            print(f"Only {len(shards)}/{num_shards} shards of {run} are found.")
+        # deduplicate by datum_id, a successful result is preferred over a failed one
+        merged: dict = {}
+        for path in shards.values():
+            for index, result in read_results(path):
+                previous = merged.get(result["datum_id"])
+                if previous is None or previous[1].get("result") is None:
+                    merged[result["datum_id"]] = (index, result)
+
+        store_path = Path(args.result_folder) / f"result.{run}.sqlite"
+        save_path = Path(args.result_folder) / f"result.{run}.jsonl"
+        with ResultStore(store_path, batch_size=1000) as store:
+            for index, result in merged.values():
+                store.add(result, index=index)
+            store.export_jsonl(save_path)
+        print(f"Merged {len(merged)} results of {len(shards)} shards to {store_path} and {save_path}")
+
+
+if __name__ == "__main__":
+    if not args.merge_only:
+        launch(args.num_shards or len(args.devices))
+    merge()
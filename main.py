@@ -1,6 +1,7 @@
 import asyncio
 import json
-import os
+import time
+import zlib
 import tensorneko as N
 import torch
 from pathlib import Path
@@ -14,6 +15,13 @@ parser.add_argument("--base_config", type=str, required=True)
 parser.add_argument("--model_config", type=str, required=True)
 parser.add_argument("--result_folder", type=str, default="./result")
 parser.add_argument("--debug", action="store_true")
+parser.add_argument("--max_concurrent_tasks", type=int, default=None, help="The number of agents in flight, default to `max_concurrent_tasks` in the base config.")
+parser.add_argument("--result_batch_size", type=int, default=8, help="The number of results committed in one transaction.")
+parser.add_argument("--prefetch_images", type=int, default=4, help="The number of images decoded ahead of the running queries.")
+parser.add_argument("--prefetch_workers", type=int, default=4, help="The number of threads decoding the images.")
+parser.add_argument("--shard_id", type=int, default=0, help="The shard of the dataset run by this process.")
+parser.add_argument("--num_shards", type=int, default=1, help="The number of shards, see `launch.py`.")
+parser.add_argument("--profile", action="store_true", help="Export the Chrome trace and the latency summary of states and tools.")
 args = parser.parse_args()
 
 from hydra_vl4ai.util.config import Config
@@ -25,86 +33,163 @@ from hydra_vl4ai.execution.toolbox import Toolbox
 from hydra_vl4ai.util.console import logger
 from hydra_vl4ai.agent.llm import Cost
 import exp_datasets
-from naver import Naver
+from naver import Naver, ImageSession, SessionPrefetcher
+from naver.utils.llm_memo import get_llm_memo
+from naver.utils.profiling import profiler
+from naver.utils.result_store import ResultStore
+
+
+async def process(image: str | ImageSession, datum_id, query: str, ground_truth, metadata: dict | None = None) -> dict:
+    naver = None
+    start = time.perf_counter()
+    try:
+        naver = Naver(image, query)
+        result_entity = await naver.run()
+
+        match Config.base_config["task"]:
+            case "grounding":
+                result = result_entity.bbox
+
+                # Calculate IoU for evaluation
+                iou = N.evaluation.iou_2d(
+                    torch.tensor([result]),
+                    torch.tensor([ground_truth]),
+                )[0, 0].item()
+
+                logger.info(f"Query: {query}, Result: {result}, Ground Truth: {ground_truth}, IoU: {iou}")
+                logger.info(f"Query Usage: {naver.usage}")
+                logger.info(f"Cost: {Cost.cost:.5f}, Input Tokens: {Cost.input_tokens}, Output Tokens: {Cost.output_tokens}"
+                            + (f", {llm_memo.stats}" if (llm_memo := get_llm_memo()) is not None else ""))
+
+                result_data = {
+                    "datum_id": datum_id,
+                    "query": query,
+                    "ground_truth": ground_truth,
+                    "result": result,
+                    "iou": iou
+                }
+
+            case _:
+                raise NotImplementedError(f"Task {Config.base_config['task']} is not implemented.")
+
+    except Exception as e:
+        # if the error occurs, we skip saving the result, but will be computed as a "runtime failure" in evaluation.
+        logger.error(f"Error processing {datum_id}: {e}")
+        import traceback
+        traceback.print_exc()
+        result_data = {
+            "datum_id": datum_id,
+            "query": query,
+            "ground_truth": ground_truth,
+            "result": None,
+            "iou": None
+        }
+
+    # the dataset fields of the datum, e.g. split and category, for the evaluation slices
+    result_data.update(metadata or {})
+    # the usage of this query only, even if other queries are running concurrently
+    if naver is not None:
+        result_data.update(naver.usage.to_dict())
+    result_data["wall_time"] = time.perf_counter() - start
+    return result_data
+
+
+def in_shard(image_path: str) -> bool:
+    # shard by the image, so the queries of the same image share the image session in one process.
+    # crc32 is stable across processes and runs, unlike the builtin `hash`
+    return zlib.crc32(str(image_path).encode()) % args.num_shards == args.shard_id
+
+
+class Progress:
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.done = 0
+        self.start = time.perf_counter()
+
+    def update(self) -> None:
+        self.done += 1
+        elapsed = time.perf_counter() - self.start
+        throughput = self.done / elapsed
+        eta = (self.total - self.done) / throughput
+        logger.info(f"Progress: {self.done}/{self.total}, {throughput * 60:.1f} data/min, "
+                    f"elapsed {elapsed / 60:.1f} min, ETA {eta / 60:.1f} min")
 
 
 async def main():
     Toolbox.init(["naver.tool"])
 
-    match Config.base_config["dataset"]:
-        case "refcoco":
-            dataset = exp_datasets.Refcoco(args.data_root, split="testA")
-        case "refcoco+":
-            dataset = exp_datasets.Refcoco(args.data_root, split="testA")
-        case "refcocog":
-            dataset = exp_datasets.Refer(args.data_root, "refcocog", "test", "bbox")
-        case "refadv":
-            dataset = exp_datasets.RefAdv(args.data_root)
-        case _:
-            raise ValueError("Invalid dataset")
+    dataset = exp_datasets.build_dataset(Config.base_config["dataset"], args.data_root)
         
     # output path
     Path(args.result_folder).mkdir(parents=True, exist_ok=True)
-    save_path = Path(args.result_folder) / f"result.naver_{Config.base_config['dataset']}.jsonl"
-    print(f"Saving results to {save_path}")
+    run_name = f"naver_{Config.base_config['dataset']}" + (f".shard{args.shard_id}of{args.num_shards}" if args.num_shards > 1 else "")
+    save_path = Path(args.result_folder) / f"result.{run_name}.jsonl"
+    store_path = Path(args.result_folder) / f"result.{run_name}.sqlite"
+    print(f"Saving results to {store_path}, exported to {save_path} at the end")
+    if args.profile:
+        profiler.enable()
         
-    # resume if the file exists
-    completed = []
-    if os.path.exists(save_path):
-        prev_results = N.io.read.json.of_jsonl(str(save_path))
-        if prev_results is not None:
-            completed = [result["datum_id"] for result in prev_results]
-        
-    for i, (image_path, datum_id, query, ground_truth) in enumerate(dataset):
-        if datum_id in completed:
-            logger.info(f"Skipping {i+1}/{len(dataset)}")
-            continue
-            
+    # resume if the store exists, the results of the previous jsonl-only runs are imported once
+    is_new_store = not store_path.exists()
+    store = ResultStore(store_path, batch_size=args.result_batch_size)
+    if is_new_store and save_path.exists():
+        logger.info(f"Imported {store.import_jsonl(save_path)} results from {save_path}")
+    completed = store.completed()
+
+    # the data to run, grouped by image in the order of the first query, so the per-image caches stay hot
+    pending = [(i, *dataset[i]) for i in range(len(dataset))]
+    pending = [datum for datum in pending if datum[2] not in completed and in_shard(datum[1])]
+    image_orders = {image_path: order for order, image_path in enumerate(dict.fromkeys(datum[1] for datum in pending))}
+    pending.sort(key=lambda datum: image_orders[datum[1]])
+    logger.info(f"Shard {args.shard_id}/{args.num_shards}: {len(pending)} data to run, {len(completed)} resumed")
+
+    # the queries of the same image share the image-level artifacts, and the next images are decoded in background
+    prefetcher = SessionPrefetcher([datum[1] for datum in pending], args.prefetch_images, args.prefetch_workers)
+
+    async def run_datum(i: int, image_path: str, datum_id, query: str, ground_truth) -> tuple[int, dict]:
         logger.info(f"Processing {i+1}/{len(dataset)}")
-        
         try:
-            result_entity = await Naver(image_path, query).run()
-
-            match Config.base_config["task"]:
-                case "grounding":
-                    result = result_entity.bbox
-                    
-                    # Calculate IoU for evaluation
-                    iou = N.evaluation.iou_2d(
-                        torch.tensor([result]),
-                        torch.tensor([ground_truth]),
-                    )[0, 0].item()
-                    
-                    logger.info(f"Query: {query}, Result: {result}, Ground Truth: {ground_truth}, IoU: {iou}")
-                    logger.info(f"Cost: {Cost.cost:.5f}, Input Tokens: {Cost.input_tokens}, Output Tokens: {Cost.output_tokens}")
-
-                    result_data = {
-                        "datum_id": datum_id,
-                        "query": query,
-                        "ground_truth": ground_truth,
-                        "result": result,
-                        "iou": iou
-                    }
-                    
-                case _:
-                    raise NotImplementedError(f"Task {Config.base_config['task']} is not implemented.")
-
-        except Exception as e:
-            # if the error occurs, we skip saving the result, but will be computed as a "runtime failure" in evaluation.
-            logger.error(f"Error processing {datum_id}: {e}")
-            import traceback
-            traceback.print_exc()
-            result_data = {
-                "datum_id": datum_id,
-                "query": query,
-                "ground_truth": ground_truth,
-                "result": None,
-                "iou": None
-            }
-
-        with open(save_path, "a") as f:
-            f.write(json.dumps(result_data) + "\n")
-            f.flush()
+            try:
+                image = await prefetcher.acquire(image_path)
+            except Exception:
+                # the agent loads the image again and records the error as a failed result
+                image = image_path
+            return i, await process(image, datum_id, query, ground_truth, dataset.metadata(i))
+        finally:
+            prefetcher.release(image_path)
+
+    # keep N agents in flight, most of the wall time of an agent is waiting for the LLM
+    max_concurrent_tasks = args.max_concurrent_tasks or Config.base_config.get("max_concurrent_tasks", 1)
+    progress = Progress(len(pending))
+    in_flight: set[asyncio.Task] = set()
+    data = iter(pending)
+    try:
+        while True:
+            while len(in_flight) < max_concurrent_tasks and (datum := next(data, None)) is not None:
+                in_flight.add(asyncio.create_task(run_datum(*datum)))
+            if len(in_flight) == 0:
+                break
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                i, result_data = task.result()
+                store.add(result_data, index=i)
+                progress.update()
+    finally:
+        for task in in_flight:
+            task.cancel()
+        store.close()
+        prefetcher.close()
+
+    # the jsonl in the dataset order, for `evaluate.py` and `launch.py`
+    with ResultStore(store_path) as store:
+        store.export_jsonl(save_path)
+
+    if args.profile:
+        trace_path = Path(args.result_folder) / f"trace.{run_name}.json"
+        profiler.export_chrome_trace(trace_path)
+        with open(Path(args.result_folder) / f"profile.{run_name}.json", "w") as f:
+            json.dump(profiler.summary(), f, indent=2)
+        logger.info(f"Chrome trace is saved to {trace_path}, latency summary:\n{profiler.format_summary()}")
                 
 if __name__ == "__main__":
     asyncio.run(main())
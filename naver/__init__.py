@@ -1,9 +1,16 @@
-from .agent import Naver
-
 try:
     from ._version import __version__
 except ImportError:
     # Fallback for development installs without setuptools-scm
     __version__ = "0.1.0+dev"
 
-__all__ = ["Naver", "__version__"]
+__all__ = ["Naver", "ImageSession", "SessionPrefetcher", "__version__"]
+
+
+def __getattr__(name: str):
+    # the agent is imported lazily, since it reads the hydra config at import time. so the standalone utilities,
+    # e.g. `naver.utils.result_store` used by `launch.py`, can be imported without a config
+    if name in ("Naver", "ImageSession", "SessionPrefetcher"):
+        from . import agent
+        return getattr(agent, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,3 +1,4 @@
 from .automaton import Naver
+from .session import ImageSession, SessionPrefetcher
 
-__all__ = ["Naver"]
+__all__ = ["Naver", "ImageSession", "SessionPrefetcher"]
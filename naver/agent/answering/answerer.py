@@ -1,3 +1,4 @@
+import asyncio
 from typing import Literal
 import numpy as np
 import torch
@@ -41,7 +42,7 @@ Your answer:"""
 
 class Answerer:
 
-    def __init__(self, image: Image.Image, query: str, state_memory_bank: NaverStateMemoryBank) -> None:
+    def __init__(self, image: Image.Image | np.ndarray, query: str, state_memory_bank: NaverStateMemoryBank) -> None:
         self.image = np.asarray(image)
         self.state_memory_bank = state_memory_bank
         self.query = query
@@ -64,6 +65,10 @@ class Answerer:
                 raise ValueError(f"Invalid VLM model {vlm_model} for answering.")
 
     async def _step_one_result(self, result: Entity, threshold=0.5, context_statement: str | None = None) -> tuple[LogicAnsweringReturn, Entity | None]:
+        # the SAM and VLM calls block, so they run in a thread and the other agents on the event loop keep running
+        return await asyncio.to_thread(self._answer_one_result, result, threshold, context_statement)
+
+    def _answer_one_result(self, result: Entity, threshold: float, context_statement: str | None) -> tuple[LogicAnsweringReturn, Entity | None]:
         if result.mask is None:
             result.mask = Toolbox["sam"].forward(self.image, result.bbox, False)
         mask_a = result.mask
@@ -77,6 +82,9 @@ class Answerer:
         return LogicAnsweringReturn.NO, None
 
     async def _step_two_results(self, fallback_result: Entity, logic_result: Entity, context_statement: str | None = None) -> tuple[LogicAnsweringReturn, Entity | None, str]:
+        return await asyncio.to_thread(self._answer_two_results, fallback_result, logic_result, context_statement)
+
+    def _answer_two_results(self, fallback_result: Entity, logic_result: Entity, context_statement: str | None) -> tuple[LogicAnsweringReturn, Entity | None, str]:
         if fallback_result.mask is None:
             fallback_result.mask = Toolbox["sam"].forward(self.image, fallback_result.bbox, False)
 
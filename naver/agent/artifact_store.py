@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from hydra_vl4ai.util.config import Config
+from hydra_vl4ai.util.console import logger
+
+
+class ArtifactStore:
+    """The image-level perception artifacts precomputed offline by `precompute.py`, one npz file for each image.
+
+    The images are keyed by the hash of the file content, so the store is valid for any data root. Each file holds
+    any of the depth map, the SAM image embedding, the caption, and the raw detections of several categories.
+    """
+
+    def __init__(self, root: str | Path) -> None:
+        self.root = Path(root)
+
+    @staticmethod
+    def key(image_path: str) -> str:
+        with open(image_path, "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.npz"
+
+    def __contains__(self, key: str) -> bool:
+        return self.path(key).exists()
+
+    def load(self, key: str) -> dict | None:
+        path = self.path(key)
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            data = {name: data[name] for name in data.files}
+
+        artifacts = {}
+        if "depth" in data:
+            artifacts["depth"] = data["depth"].astype(np.float32)
+        if "sam_features" in data:
+            artifacts["sam_embedding"] = {
+                "features": data["sam_features"],
+                "original_size": data["sam_original_size"],
+                "input_size": data["sam_input_size"],
+            }
+        if "caption" in data:
+            artifacts["caption"] = str(data["caption"])
+        if "detection_categories" in data:
+            # the coordinates of all categories are concatenated, split by the counts
+            splits = np.cumsum(data["detection_counts"])[:-1]
+            for category, threshold, coordinates in zip(data["detection_categories"], data["detection_thresholds"],
+                                                        np.split(data["detection_coordinates"], splits)):
+                artifacts[("detections", str(category), round(float(threshold), 6))] = coordinates
+        return artifacts
+
+    def save(self, key: str, artifacts: dict) -> None:
+        # the float arrays are stored in float16 to halve the size, which is enough for the depth and the embedding
+        data = {}
+        if "depth" in artifacts:
+            data["depth"] = np.asarray(artifacts["depth"], dtype=np.float16)
+        if "sam_embedding" in artifacts:
+            embedding = artifacts["sam_embedding"]
+            data["sam_features"] = np.asarray(embedding["features"], dtype=np.float16)
+            data["sam_original_size"] = np.asarray(embedding["original_size"], dtype=np.int64)
+            data["sam_input_size"] = np.asarray(embedding["input_size"], dtype=np.int64)
+        if "caption" in artifacts:
+            data["caption"] = np.array(artifacts["caption"], dtype=str)
+        detections = [(key[1], key[2], coordinates) for key, coordinates in artifacts.items()
+                      if isinstance(key, tuple) and key[0] == "detections"]
+        if len(detections) > 0:
+            data["detection_categories"] = np.array([category for category, _, _ in detections], dtype=str)
+            data["detection_thresholds"] = np.array([threshold for _, threshold, _ in detections], dtype=np.float64)
+            data["detection_counts"] = np.array([len(coordinates) for _, _, coordinates in detections], dtype=np.int64)
+            data["detection_coordinates"] = np.concatenate(
+                [np.asarray(coordinates, dtype=np.float32).reshape(-1, 5) for _, _, coordinates in detections])
+
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **data)
+        os.replace(tmp_path, path)
+
+
+_store: ArtifactStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore | None:
+    # the store is enabled by setting `perception_artifact_path` in the base config
+    global _store
+    path = Config.base_config.get("perception_artifact_path")
+    if path is None:
+        return None
+    with _store_lock:
+        if _store is None or _store.root != Path(path):
+            _store = ArtifactStore(path)
+            logger.debug(f"Perception artifact store is enabled at {path}")
+    return _store
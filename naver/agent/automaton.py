@@ -1,8 +1,11 @@
-from PIL import Image
+import asyncio
 
 from hydra_vl4ai.util.console import logger
 
 from .smb import NaverStateMemoryBank
+from .session import ImageSession
+from ..utils.accounting import Usage, track_usage
+from ..utils.profiling import profile_span, trace_track
 from ..context.entity import Entity
 from .perception import Perceptioner
 from .logic_generation import LogicGenerator
@@ -13,23 +16,32 @@ from .states import PerceptionReturn, LogicGenerationReturn, LogicReasoningRetur
 
 class Naver:
 
-    def __init__(self, image_path: str, query: str):
-        self.image_path = image_path
-        self.image = Image.open(image_path)
+    def __init__(self, image_path: str | ImageSession, query: str):
+        # the queries of the same image can share one session, sequentially or concurrently,
+        # so the image-level artifacts (depth, SAM embedding, caption and detections) are computed once
+        self.session = image_path if isinstance(image_path, ImageSession) else ImageSession(image_path)
+        self.image_path = self.session.image_path
+        self.image = self.session.image
         self.query = query
         self.state: State = States.Perception()  # init as perception state
         self.state_memory_bank = NaverStateMemoryBank()
         self.fallback_result: Entity | None = None
 
         # init components
-        self.perceptioner = Perceptioner(self.image, query, self.state_memory_bank)
+        self.perceptioner = Perceptioner(self.image, query, self.state_memory_bank, self.session)
         self.logic_generator = LogicGenerator(self.query, self.state_memory_bank)
         self.logic_reasoner = LogicReasoner(self.state_memory_bank)
-        self.answerer = Answerer(self.image, self.query, self.state_memory_bank)
+        self.answerer = Answerer(self.session.image_array, self.query, self.state_memory_bank)
         self.current_iter = 0  # the count for the self-corrections
+        self.usage = Usage()
+        self.pending_logic_queries: list[str] = []  # the candidate logic queries with targets, used as fallbacks
 
     async def step(self) -> tuple[Entity | None, str]:
-        # run one step in the Deterministic Finite-State Automaton (DFA)
+        # run one step in the Deterministic Finite-State Automaton (DFA), each step is a span in the profiler
+        with profile_span(_state_name(self.state), "state", iteration=self.current_iter):
+            return await self._step()
+
+    async def _step(self) -> tuple[Entity | None, str]:
         if self.current_iter > 5:
             logger.debug(f"[Iter {self.current_iter}] Exceed maximum iteration. Return fallback result.")
             return self.fallback_result or Entity(0, self.query, [0, 0, 0, 0], 0.), "Only Fallback"
@@ -43,7 +55,8 @@ class Naver:
                     case PerceptionReturn.MULTI_OBJECTS:
                         self.state = States.LogicGeneration()
                     case PerceptionReturn.SINGLE_OBJECT | PerceptionReturn.NO_OBJECT:
-                        self.fallback_result, perception_fallback_return = self.perceptioner.fallback_step()
+                        # the blocking model calls run in threads, so the other agents on the event loop keep running
+                        self.fallback_result, perception_fallback_return = await asyncio.to_thread(self.perceptioner.fallback_step)
                         match perception_fallback_return:
                             case PerceptionReturn.NO_OBJECT:
                                 self.state = States.Answering(None, None, 0)
@@ -61,16 +74,28 @@ class Naver:
                 logic_generation_return, logic_query = await self.logic_generator.step(feedback)
                 match logic_generation_return:
                     case LogicGenerationReturn.SUCCESS:
+                        candidates = self.logic_generator.candidates
+                        # the fallbacks only come from the candidates of this generation
+                        self.pending_logic_queries = []
+                        if len(candidates) > 1:
+                            # evaluate all candidates at once, the first one with targets is used and the others are kept
+                            candidates = await self.logic_reasoner.evaluate_candidates(candidates) or candidates[:1]
+                            logic_query, self.pending_logic_queries = candidates[0], candidates[1:]
                         self.state = States.LogicReasoning(logic_query, 0)
 
             # ------------ Logic Reasoning State ------------
             case States.LogicReasoning(logic_query, skip_top):
                 logger.debug(f"[Iter {self.current_iter}] Logic Reasoning state with target query: {logic_query}")
-                logic_reasoning_return, logic_result = self.logic_reasoner.step(logic_query, skip_top)
-                self.fallback_result, perception_fallback_return = self.perceptioner.fallback_step()
+                # the reasoning and the fallback detection are independent, so they run in parallel threads
+                (logic_reasoning_return, logic_result), (self.fallback_result, perception_fallback_return) = await asyncio.gather(
+                    asyncio.to_thread(self.logic_reasoner.step, logic_query, skip_top),
+                    asyncio.to_thread(self.perceptioner.fallback_step))
                 match logic_reasoning_return:
                     case LogicReasoningReturn.SUCCESS:
                         self.state = States.Answering(logic_result, logic_query, skip_top)
+                    case LogicReasoningReturn.EXCEED_TARGETS | LogicReasoningReturn.NO_TARGETS if len(self.pending_logic_queries) > 0:
+                        # use the next candidate without another LLM round trip
+                        self.state = States.LogicReasoning(self.pending_logic_queries.pop(0), 0)
                     case LogicReasoningReturn.EXCEED_TARGETS | LogicReasoningReturn.NO_TARGETS:
                         self.current_iter += 1
                         self.state = States.LogicGeneration("This code cannot find any target. Please correct it and provide a new code.")
@@ -107,9 +132,22 @@ class Naver:
         return None, ""
 
     async def run(self) -> Entity:
-        # run the DFA until the result is found
-        while True:
-            result_entity, _ = await self.step()
-            if result_entity is not None:
-                break
+        # run the DFA until the result is found, the cost and time of all LLM and tool calls are recorded in `usage`
+        with track_usage() as self.usage, trace_track(self.query):
+            try:
+                while True:
+                    result_entity, _ = await self.step()
+                    if result_entity is not None:
+                        break
+            finally:
+                await self.close()
         return result_entity
+
+    async def close(self) -> None:
+        # release the background work of the agent, for the callers driving `step` directly
+        await self.logic_generator.close()
+
+
+def _state_name(state: State) -> str:
+    # e.g. _LogicGenerationState -> LogicGeneration
+    return type(state).__name__.strip("_").removesuffix("State")
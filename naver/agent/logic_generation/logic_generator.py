@@ -1,6 +1,14 @@
+import asyncio
+from typing import AsyncIterator
+
+from hydra_vl4ai.util.config import Config
+from hydra_vl4ai.util.console import logger
+
 from ..smb import NaverStateMemoryBank
 from ..states import LogicGenerationReturn
-from ...logic.problog import ProbLogModel
+from ...context.relation import GEOMETRY_RELATIONS
+from ...logic.problog import ProbLogModel, extract_problog_codes
+from ...logic.problog_stream import ProbLogStreamParser
 
 
 class LogicGenerator:
@@ -9,6 +17,10 @@ class LogicGenerator:
         self.state_memory_bank = state_memory_bank
         self.query = query
         self.previous_response = None
+        # all candidate target rules of the last generation, the first one is returned by `step`
+        self.candidates: list[str] = []
+        # the rest of the streamed response, which is still received after the code is returned
+        self._stream_rest: asyncio.Task | None = None
 
     @property
     def _context(self):
@@ -16,15 +28,87 @@ class LogicGenerator:
 
     async def step(self, overwrite_feedback: str | None = None) -> tuple[LogicGenerationReturn, str]:
         assert self._context is not None
+        if Config.base_config.get("logic_stream_generation", False):
+            return await self._step_stream(overwrite_feedback)
+
         previous_response = self.previous_response if overwrite_feedback is not None else None
         response, _ = await self.problog_model.generate(
             self._context, self.query, self._context.entity_categories, overwrite_feedback=overwrite_feedback, previous_response=previous_response)
         self.previous_response = response
         # target_rule = json.loads(response)["output"]
-        # match the code within the response ```problog ... ```
+        self.candidates = extract_problog_codes(response)
+
+        return LogicGenerationReturn.SUCCESS, self.candidates[0]
+
+    async def _step_stream(self, overwrite_feedback: str | None = None) -> tuple[LogicGenerationReturn, str]:
+        # the feedback needs the full previous response
+        if self._stream_rest is not None:
+            await self._stream_rest
+            self._stream_rest = None
+        previous_response = self.previous_response if overwrite_feedback is not None else None
+        stream = self.problog_model.generate_stream(
+            self._context, self.query, self._context.entity_categories, overwrite_feedback=overwrite_feedback, previous_response=previous_response)
+
+        # the requested attributes and relations are generated while the LLM is still decoding the code
+        parser = ProbLogStreamParser()
+        precompute_queue: asyncio.Queue[tuple[str, str] | None] = asyncio.Queue()
+        precompute_worker = asyncio.create_task(self._precompute(precompute_queue))
         try:
-            target_rule_problog = response.split("```problog")[1].split("```")[0].strip()
-        except IndexError:
-            target_rule_problog = response
+            async for delta in stream:
+                for event, value in parser.feed(delta):
+                    if event in ("attribute", "relation"):
+                        precompute_queue.put_nowait((event, value))
+                # the reasoning starts as soon as enough candidate codes are closed
+                if len(parser.codes) >= self.problog_model.num_candidates:
+                    break
+        except BaseException:
+            # release the LLM stream, which holds the API concurrency slot
+            await stream.aclose()
+            raise
+        finally:
+            precompute_queue.put_nowait(None)
+            await precompute_worker
+
+        self.previous_response = parser.text
+        if len(parser.codes) >= self.problog_model.num_candidates:
+            # keep receiving the rest of the response in background, for the cost and the feedback
+            self._stream_rest = asyncio.create_task(self._receive_rest(stream, parser))
+        else:
+            await stream.aclose()
+        self.candidates = parser.codes if len(parser.codes) > 0 else extract_problog_codes(parser.text)
+
+        return LogicGenerationReturn.SUCCESS, self.candidates[0]
 
-        return LogicGenerationReturn.SUCCESS, target_rule_problog
+    async def _precompute(self, queue: asyncio.Queue) -> None:
+        while (item := await queue.get()) is not None:
+            event, name = item
+            try:
+                match event:
+                    case "attribute":
+                        await asyncio.to_thread(self._context.generate_attribute, name)
+                    case "relation" if name not in GEOMETRY_RELATIONS:
+                        await asyncio.to_thread(self._context.generate_relations, [name])
+            except Exception as e:
+                # the logic reasoning will generate it again
+                logger.debug(f"Precompute {event} {name} failed: {e}")
+
+    async def close(self) -> None:
+        # stop receiving the rest of the streamed response, so it does not outlive the run. the task closes the stream
+        if self._stream_rest is not None:
+            self._stream_rest.cancel()
+            try:
+                await self._stream_rest
+            except asyncio.CancelledError:
+                pass
+            self._stream_rest = None
+
+    async def _receive_rest(self, stream: AsyncIterator[str], parser: ProbLogStreamParser) -> None:
+        try:
+            async for delta in stream:
+                parser.text += delta
+        except Exception as e:
+            logger.debug(f"Receiving the rest of the streamed response failed: {e}")
+        finally:
+            # also when cancelled by `close`, so the stream releases the API concurrency slot at once
+            await stream.aclose()
+        self.previous_response = parser.text
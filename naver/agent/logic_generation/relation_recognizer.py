@@ -10,19 +10,21 @@ from ...context.attribute import Attribute
 
 
 class GeometryAnalyzer:
-    def __init__(self, image_pil: Image.Image) -> None:
-        self.image_pil = image_pil
-        self.symbolic_relation_recognizer = SymbolicRelationEstimator(np.array(self.image_pil))
+    def __init__(self, image: Image.Image | np.ndarray, depth: np.ndarray | None = None) -> None:
+        self.symbolic_relation_recognizer = SymbolicRelationEstimator(np.asarray(image), depth)
 
     def __call__(self, entity_a: Entity, entity_b: Entity) -> tuple[Relation, Relation]:
         a_to_b, b_to_a = self.symbolic_relation_recognizer.generate_bidirectional_geometry_relations(entity_a, entity_b)
         return Relation(entity_a.id, entity_b.id, a_to_b), Relation(entity_b.id, entity_a.id, b_to_a)
 
+    def relation_tensor(self, entities: list[Entity]) -> np.ndarray:
+        # the geometry relations of all entity pairs at once, in (N, N, len(GEOMETRY_RELATIONS))
+        return self.symbolic_relation_recognizer.generate_geometry_relation_tensor(entities)
+
 
 class UniversalRelationAnalyzer:
-    def __init__(self, image_pil: Image.Image) -> None:
-        self.image_pil = image_pil
-        self.vlm_relation_recognizer = VlmRelationEstimator(np.array(self.image_pil))
+    def __init__(self, image: Image.Image | np.ndarray) -> None:
+        self.vlm_relation_recognizer = VlmRelationEstimator(np.asarray(image))
 
     def __call__(self, entity_a: Entity, entity_b: Entity, relation_names: list[str]) -> tuple[Relation, Relation]:
         a_to_b, b_to_a = self.vlm_relation_recognizer.generate_bidirectional_relations(entity_a, entity_b, relation_names)
@@ -30,8 +32,8 @@ class UniversalRelationAnalyzer:
 
 
 class AttributeRecognizer:
-    def __init__(self, image_pil: Image.Image) -> None:
-        self.image = np.array(image_pil)
+    def __init__(self, image: Image.Image | np.ndarray) -> None:
+        self.image = np.asarray(image)
 
     def __call__(self, entity: Entity, attribute_name: str) -> Attribute:
         # crop the image
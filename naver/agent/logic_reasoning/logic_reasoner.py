@@ -1,7 +1,8 @@
-import re
+import asyncio
+
 from hydra_vl4ai.util.console import logger
 
-from .problog2scallop import translate_problog_rule_to_scallop
+from .problog2scallop import parse_problog_program, translate_problog_program_to_scallop
 from ..smb import NaverStateMemoryBank
 from ..states import LogicReasoningReturn
 from ...context import Entity, Attribute
@@ -14,6 +15,7 @@ class LogicReasoner:
     def __init__(self, state_memory_bank: NaverStateMemoryBank) -> None:
         self.scallop_model = ScallopModel()
         self.state_memory_bank = state_memory_bank
+        self._targets_cache: dict[tuple[str, str], dict[str, float]] = {}
 
     @property
     def _context(self):
@@ -21,41 +23,83 @@ class LogicReasoner:
 
     def step(self, logic_query: str, skip_top: int = 0) -> tuple[LogicReasoningReturn, Entity | None]:
         assert self._context is not None
+        try:
+            self._perceive(logic_query)
+            targets = self._execute(logic_query)
+        except ValueError as e:
+            # the invalid code goes back to the logic generation for a new one
+            logger.debug(f"Invalid logic query: {e}")
+            return LogicReasoningReturn.NO_TARGETS, None
+        logger.debug(f"Targets: {targets}")
+        return self._select(targets, skip_top)
 
-        # convert all "relation" to "relation_" in scallop query to avoid conflict with built-in name
-        logic_query = logic_query.replace("relation(", "relation_(")
+    async def evaluate_candidates(self, logic_queries: list[str]) -> list[str]:
+        """Evaluate the candidate logic queries in parallel, and return the ones with targets in the original order."""
+        assert self._context is not None
+        # the context perception modifies the context, so it is done for all candidates before the execution
+        parsed_queries = []
+        for logic_query in logic_queries:
+            try:
+                self._perceive(logic_query)
+                parsed_queries.append(logic_query)
+            except ValueError as e:
+                logger.debug(f"Invalid candidate logic query: {e}")
+        logic_queries = parsed_queries
+        results = await asyncio.gather(*[asyncio.to_thread(self._execute, logic_query) for logic_query in logic_queries],
+                                       return_exceptions=True)
+        valid_queries = []
+        for logic_query, targets in zip(logic_queries, results):
+            if isinstance(targets, BaseException):
+                logger.debug(f"Candidate logic query failed: {targets}")
+            elif len(targets) > 0:
+                valid_queries.append(logic_query)
+        logger.debug(f"Candidates with targets: {len(valid_queries)}/{len(results)}")
+        return valid_queries
+
+    def _perceive(self, logic_query: str) -> None:
+        # parse the whole logic query once. the parsing and translation are memoized by the query text,
+        # so the retries with the same query (e.g. skip_top > 0) don't parse it again.
+        program = parse_problog_program(logic_query)
 
         # in this block, we perceive the requested context from the logic query.
         # note in the paper, we put this step in the "Logic Generation" state.
         # but for simpler implementation, we put this step here.
         # if the attribute is requested
-        attribute_names = re.findall(r'attribute\s*\(\s*.+?\s*,\s*"([^"]+)"\s*\)', logic_query)
-        for attribute_name in set(attribute_names):
+        attribute_names = program.string_arguments("attribute", 1)
+        for attribute_name in attribute_names:
             self._context.generate_attribute(attribute_name)
 
         # if the non-geometry relation is requested, we need to generate the universal/generic relations
-        relation_names = set(re.findall(r'relation_\s*\(\s*.+?\s*,\s*"([^"]+)"\s*\)', logic_query))
+        relation_names = program.string_arguments("relation", 2)
         non_geometry_relation_names = relation_names - set(GEOMETRY_RELATIONS)
         if len(non_geometry_relation_names) > 0:
             self._context.generate_relations(list(non_geometry_relation_names))
 
+    def _execute(self, logic_query: str) -> dict[str, float]:
         # entity and relation in scallop langauge
         context_facts = self.scallop_model.context_to_scallop(self._context)
         # target query in scallop langauge
-        logic_query = "\n".join([translate_problog_rule_to_scallop(row) for row in logic_query.split("\n") if row.strip() != ""])
+        # the "relation" is renamed to "relation_" in scallop to avoid conflict with built-in name.
+        logic_query = translate_problog_program_to_scallop(logic_query)
 
         # if the query is extremely long, the Logic inference will be too slow, so we skip it and give a retry.
         # for main stream datasets (e.g. RefCOCO), most query is less than this limit.
         if len(logic_query) > 200:
-            return LogicReasoningReturn.NO_TARGETS, None
+            return {}
 
-        # merge the attribute declaration to the code
-        code = f"{context_facts}\n{logic_query}\n" + "\n".join(map(Attribute.to_scallop_rel, self._context.attributes))
+        # merge the attribute declaration to the facts
+        context_facts = f"{context_facts}\n" + "\n".join(Attribute.to_scallop_rels(self._context.store))
 
-        # execute the logic model code
-        targets = self.scallop_model.execute(code)
-        logger.debug(f"Targets: {targets}")
+        # execute the logic model code, the candidates evaluated in advance and the retries with
+        # larger skip_top have the same code, so the targets are reused. the candidates of the same facts
+        # reuse the facts run by the logic model, if `scallop_facts_cache_size` is set.
+        key = (context_facts, logic_query)
+        targets = self._targets_cache.get(key)
+        if targets is None:
+            targets = self._targets_cache[key] = self.scallop_model.execute_with_facts(context_facts, logic_query)
+        return targets
 
+    def _select(self, targets: dict[str, float], skip_top: int) -> tuple[LogicReasoningReturn, Entity | None]:
         if len(targets) == 0:
             return LogicReasoningReturn.NO_TARGETS, None
 
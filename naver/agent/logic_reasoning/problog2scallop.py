@@ -1,98 +1,330 @@
+from __future__ import annotations
+
 import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Union
 
+# scallop "relation" is a built-in name, so the predicate is renamed when rendering to scallop.
+SCALLOP_PREDICATE_RENAMES = {"relation": "relation_"}
 
-def translate_problog_rule_to_scallop(problog_rule):
-
-    # Function to split the body into predicates, respecting parentheses
-    def split_predicates(body):
-        predicates = []
-        current_pred = ''
-        level = 0  # Parentheses nesting level
-        in_string = False
-        i = 0
-        while i < len(body):
-            char = body[i]
-            if char == '"':
-                in_string = not in_string
-                current_pred += char
-            elif char == '(' and not in_string:
-                level += 1
-                current_pred += char
-            elif char == ')' and not in_string:
-                level -= 1
-                current_pred += char
-            elif char == ',' and level == 0 and not in_string:
-                predicates.append(current_pred.strip())
-                current_pred = ''
-            else:
-                current_pred += char
-            i += 1
-        if current_pred.strip():
-            predicates.append(current_pred.strip())
-        return predicates
-
-    # Remove any leading or trailing whitespace
-    problog_rule = problog_rule.strip()
-
-    # Split the rule into head and body
-    if ':-' in problog_rule:
-        head, body = problog_rule.split(':-')
-        head = head.strip()
-        body = body.strip().rstrip('.')
-    else:
-        raise ValueError("Invalid Problog rule format")
+# problog comparison operator -> scallop comparison operator
+_COMPARISON_OPERATORS = {
+    "<": "<",
+    ">": ">",
+    "=<": "<=",
+    ">=": ">=",
+    "=": "==",
+    "==": "==",
+    "\\=": "!=",
+    "\\==": "!=",
+    "=:=": "==",
+    "=\\=": "!=",
+    # the arithmetic evaluation, e.g. Y is X + 1
+    "is": "==",
+}
+
+_ARITHMETIC_OPERATORS = ("+", "-", "*", "/")
+
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<WS>\s+|%[^\n]*)
+  | (?P<STRING>"(?:[^"\\]|\\.)*")
+  | (?P<QUOTED>'(?:[^'\\]|\\.)*')
+  | (?P<NUMBER>\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+  | (?P<NAME>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<OP>:-|::|\\\+|\\==|=:=|=\\=|\\=|==|=<|>=|<|>|=|[-+*/(),.;])
+""", re.VERBOSE)
+
+
+@dataclass(frozen=True)
+class Token:
+    kind: str
+    text: str
+    pos: int
+
+
+@dataclass(frozen=True)
+class Atom:
+    name: str
+    args: tuple[str, ...]
+
+    def to_scallop(self) -> str:
+        name = SCALLOP_PREDICATE_RENAMES.get(self.name, self.name)
+        return f"{name}({', '.join(self.args)})"
+
+    def to_problog(self) -> str:
+        return f"{self.name}({', '.join(self.args)})" if self.args else self.name
+
+
+@dataclass(frozen=True)
+class Comparison:
+    left: str
+    op: str
+    right: str
+
+    def to_scallop(self) -> str:
+        return f"{self.left} {_COMPARISON_OPERATORS[self.op]} {self.right}"
+
+    def to_problog(self) -> str:
+        return f"{self.left} {self.op} {self.right}"
+
+
+@dataclass(frozen=True)
+class Not:
+    item: Body
+
+    def to_scallop(self) -> str:
+        return f"~{_wrap(self.item, 'scallop')}"
+
+    def to_problog(self) -> str:
+        return f"\\+ {_wrap(self.item, 'problog')}"
+
+
+@dataclass(frozen=True)
+class And:
+    items: tuple[Body, ...]
+
+    def to_scallop(self) -> str:
+        return " and ".join(_wrap(item, "scallop") for item in self.items)
+
+    def to_problog(self) -> str:
+        return ", ".join(_wrap(item, "problog") for item in self.items)
+
+
+@dataclass(frozen=True)
+class Or:
+    items: tuple[Body, ...]
+
+    def to_scallop(self) -> str:
+        return " or ".join(_wrap(item, "scallop") for item in self.items)
+
+    def to_problog(self) -> str:
+        return "; ".join(_wrap(item, "problog") for item in self.items)
+
+
+Body = Union[Atom, Comparison, Not, And, Or]
+
+
+def _wrap(item: Body, target: str) -> str:
+    text = item.to_scallop() if target == "scallop" else item.to_problog()
+    return f"({text})" if isinstance(item, (And, Or)) else text
+
+
+@dataclass(frozen=True)
+class Clause:
+    head: Atom
+    body: Body | None = None
+    prob: str | None = None
+
+    @property
+    def is_directive(self) -> bool:
+        # e.g. query(target(ID)). is handled by the logic model, not part of the rules
+        return self.body is None and self.head.name in ("query", "evidence")
 
-    # Extract head predicate and variables
-    head_match = re.match(r'(\w+)\((.*)\)', head)
-    if head_match:
-        head_pred = head_match.group(1)
-        head_vars = head_match.group(2).strip()
-    else:
-        raise ValueError("Invalid head in Problog rule")
-
-    # Use the split_predicates function to correctly split the body
-    predicates = split_predicates(body)
-
-    scallop_rule = f'rel {head_pred}({head_vars}) = '
-    conditions = []
-    for pred in predicates:
-        pred_match = re.match(r'(\w+)\((.*)\)', pred)
-        if pred_match:
-            pred_name = pred_match.group(1)
-            pred_args = pred_match.group(2)
-            # Process arguments
-            arg_str = pred_args.strip()
-            # Handle commas inside strings or nested parentheses
-            args = []
-            arg = ''
-            level = 0
-            in_string = False
-            j = 0
-            while j < len(arg_str):
-                c = arg_str[j]
-                if c == '"':
-                    in_string = not in_string
-                    arg += c
-                elif c == '(' and not in_string:
-                    level += 1
-                    arg += c
-                elif c == ')' and not in_string:
-                    level -= 1
-                    arg += c
-                elif c == ',' and level == 0 and not in_string:
-                    args.append(arg.strip())
-                    arg = ''
-                else:
-                    arg += c
-                j += 1
-            if arg.strip():
-                args.append(arg.strip())
-            # Replace Problog anonymous variables (_) with Scallop's _
-            args = [a if a != '_' else '_' for a in args]
-            pred_args_str = ', '.join(args)
-            conditions.append(f'{pred_name}({pred_args_str})')
-        else:
-            raise ValueError(f"Invalid predicate in Problog rule: {pred}")
-
-    scallop_rule += ' and '.join(conditions)
-    return scallop_rule
+    def to_scallop(self) -> str:
+        prob = f"{self.prob}::" if self.prob is not None else ""
+        if self.body is None:
+            return f"rel {prob}{self.head.to_scallop()}"
+        return f"rel {prob}{self.head.to_scallop()} = {self.body.to_scallop()}"
+
+    def to_problog(self) -> str:
+        prob = f"{self.prob}::" if self.prob is not None else ""
+        if self.body is None:
+            return f"{prob}{self.head.to_problog()}."
+        return f"{prob}{self.head.to_problog()} :- {self.body.to_problog()}."
+
+
+@dataclass(frozen=True)
+class Program:
+    clauses: tuple[Clause, ...]
+
+    def to_scallop(self) -> str:
+        return "\n".join(clause.to_scallop() for clause in self.clauses if not clause.is_directive)
+
+    def to_problog(self) -> str:
+        return "\n".join(clause.to_problog() for clause in self.clauses)
+
+    def atoms(self) -> list[Atom]:
+        result = []
+        stack: list[Body] = [clause.body for clause in self.clauses if clause.body is not None]
+        while stack:
+            item = stack.pop()
+            match item:
+                case Atom():
+                    result.append(item)
+                case Not(inner):
+                    stack.append(inner)
+                case And(items) | Or(items):
+                    stack.extend(items)
+        return result
+
+    def string_arguments(self, predicate: str, position: int) -> set[str]:
+        # the string constants used at the given argument position of a body predicate
+        # e.g. string_arguments("attribute", 1) -> {"red"} for attribute(ID, "red")
+        return {
+            atom.args[position][1:-1] for atom in self.atoms()
+            if atom.name == predicate and len(atom.args) > position and atom.args[position].startswith('"')
+        }
+
+
+def tokenize(text: str) -> list[Token]:
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN_PATTERN.match(text, pos)
+        if match is None:
+            raise ValueError(f"Invalid character {text[pos]!r} at position {pos} in Problog program")
+        kind = match.lastgroup
+        assert kind is not None
+        if kind == "QUOTED":
+            # the single-quoted atoms, e.g. 'dog', are the string constants of the context facts
+            value = re.sub(r"\\(.)", r"\1", match.group()[1:-1]).replace("\\", "\\\\").replace('"', '\\"')
+            tokens.append(Token("STRING", f'"{value}"', pos))
+        elif kind != "WS":
+            tokens.append(Token(kind, match.group(), pos))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser of the ProbLog subset generated by the logic generator."""
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.tokens = tokenize(text)
+        self.index = 0
+
+    def _peek(self) -> Token | None:
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def _accept(self, text: str) -> bool:
+        token = self._peek()
+        if token is not None and token.kind == "OP" and token.text == text:
+            self.index += 1
+            return True
+        return False
+
+    def _expect(self, text: str) -> None:
+        if not self._accept(text):
+            token = self._peek()
+            found = "end of program" if token is None else f"{token.text!r} at position {token.pos}"
+            raise ValueError(f"Invalid Problog program: expected {text!r} but found {found}")
+
+    def _next(self, *kinds: str) -> Token:
+        token = self._peek()
+        if token is None or token.kind not in kinds:
+            found = "end of program" if token is None else f"{token.text!r} at position {token.pos}"
+            raise ValueError(f"Invalid Problog program: expected {' or '.join(kinds)} but found {found}")
+        self.index += 1
+        return token
+
+    def parse_program(self) -> Program:
+        clauses = []
+        while self._peek() is not None:
+            clauses.append(self._parse_clause())
+        return Program(tuple(clauses))
+
+    def _parse_clause(self) -> Clause:
+        prob = None
+        if self._peek() is not None and self._peek().kind == "NUMBER":
+            prob = self._next("NUMBER").text
+            self._expect("::")
+        head = self._parse_atom()
+        body = self._parse_disjunction() if self._accept(":-") else None
+        # the LLM output sometimes misses the full stop at the end of a line
+        if not self._accept(".") and not self._at_line_start():
+            self._expect(".")
+        return Clause(head, body, prob)
+
+    def _at_line_start(self) -> bool:
+        token = self._peek()
+        if token is None:
+            return True
+        previous = self.tokens[self.index - 1]
+        return "\n" in self.text[previous.pos + len(previous.text):token.pos]
+
+    def _parse_disjunction(self) -> Body:
+        items = [self._parse_conjunction()]
+        while self._accept(";"):
+            items.append(self._parse_conjunction())
+        return items[0] if len(items) == 1 else Or(tuple(items))
+
+    def _parse_conjunction(self) -> Body:
+        items = [self._parse_literal()]
+        while self._accept(","):
+            items.append(self._parse_literal())
+        return items[0] if len(items) == 1 else And(tuple(items))
+
+    def _parse_literal(self) -> Body:
+        if self._accept("\\+"):
+            return Not(self._parse_literal())
+        if self._accept("("):
+            body = self._parse_disjunction()
+            self._expect(")")
+            return body
+        token = self._peek()
+        following = self.tokens[self.index + 1] if self.index + 1 < len(self.tokens) else None
+        if token is not None and token.kind == "NAME" and not token.text[0].isupper() and token.text[0] != "_" \
+                and (following is None or following.text not in (*_COMPARISON_OPERATORS, *_ARITHMETIC_OPERATORS)):
+            return self._parse_atom()
+        left = self._parse_expression()
+        op = self._next("OP", "NAME")
+        if op.text not in _COMPARISON_OPERATORS:
+            raise ValueError(f"Invalid Problog program: unsupported operator {op.text!r} at position {op.pos}")
+        right = self._parse_expression()
+        return Comparison(left, op.text, right)
+
+    def _parse_expression(self) -> str:
+        # the arithmetic expression of a comparison, e.g. X + 1
+        parts = [self._parse_operand()]
+        while (token := self._peek()) is not None and token.kind == "OP" and token.text in _ARITHMETIC_OPERATORS:
+            self.index += 1
+            parts += [token.text, self._parse_operand()]
+        return " ".join(parts)
+
+    def _parse_operand(self) -> str:
+        if self._accept("-"):
+            return f"-{self._parse_operand()}"
+        if self._accept("("):
+            expression = self._parse_expression()
+            self._expect(")")
+            return f"({expression})"
+        return self._next("NAME", "STRING", "NUMBER").text
+
+    def _parse_atom(self) -> Atom:
+        name = self._next("NAME").text
+        args = []
+        if self._accept("("):
+            if not self._accept(")"):
+                args.append(self._parse_term())
+                while self._accept(","):
+                    args.append(self._parse_term())
+                self._expect(")")
+        return Atom(name, tuple(args))
+
+    def _parse_term(self) -> str:
+        if self._accept("-"):
+            return f"-{self._next('NUMBER').text}"
+        token = self._next("NAME", "STRING", "NUMBER")
+        # nested compound term, e.g. query(target(ID))
+        if token.kind == "NAME" and self._peek() is not None and self._peek().text == "(":
+            self.index -= 1
+            return self._parse_atom().to_problog()
+        return token.text
+
+
+@lru_cache(maxsize=1024)
+def parse_problog_program(problog_program: str) -> Program:
+    return _Parser(problog_program).parse_program()
+
+
+@lru_cache(maxsize=1024)
+def translate_problog_program_to_scallop(problog_program: str) -> str:
+    return parse_problog_program(problog_program).to_scallop()
+
+
+def translate_problog_rule_to_scallop(problog_rule: str) -> str:
+    program = parse_problog_program(problog_rule.strip())
+    if len(program.clauses) != 1 or program.clauses[0].body is None:
+        raise ValueError("Invalid Problog rule format")
+    return program.to_scallop()
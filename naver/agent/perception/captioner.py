@@ -1,19 +1,31 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 from hydra_vl4ai.execution.image_patch import ImagePatch
 from hydra_vl4ai.util.config import Config
 
 
 from ..smb import NaverStateMemoryBank
 
+if TYPE_CHECKING:
+    from ..session import ImageSession
+
 
 class Captioner:
     """The Captioner in perception state."""
 
-    def __init__(self, image_patch: ImagePatch, state_memory_bank: NaverStateMemoryBank) -> None:
+    def __init__(self, image_patch: ImagePatch, state_memory_bank: NaverStateMemoryBank, session: ImageSession | None = None) -> None:
         self.image_patch = image_patch
         self.state_memory_bank = state_memory_bank
+        self.session = session
         self._caption = None
 
     def __call__(self):
+        if self._caption is None and self.session is not None:
+            # the caption is shared by all queries of the image
+            self._caption = self.session.caption(self.image_patch)
+            self.state_memory_bank.caption = self._caption
         if self._caption is None:
             self._caption = self.image_patch.forward(
                 Config.base_config["vlm_caption_model"], 
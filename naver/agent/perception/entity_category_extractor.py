@@ -1,10 +1,10 @@
 import json
 from typing import AsyncGenerator
 
-from hydra_vl4ai.agent.llm import llm_with_message
 from hydra_vl4ai.util.config import Config
 
 from .captioner import Captioner
+from ...utils.llm_memo import llm_with_message
 
 
 _system_prompt = """You're an AI assistant designed to find detailed information from image.
@@ -1,12 +1,28 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 from hydra_vl4ai.execution.image_patch import ImagePatch
 
+from ...utils.config_overlay import config_overlay
+
+if TYPE_CHECKING:
+    from ..session import ImageSession
+
 
 class EntityDetector:
     """The Entity Detector in perception state."""
 
-    def __init__(self, image_patch: ImagePatch):
+    def __init__(self, image_patch: ImagePatch, session: ImageSession | None = None):
         self.image_patch = image_patch
+        self.session = session
 
-    def __call__(self, interested_entities: list[str]) -> dict[str, list[ImagePatch]]:
-        interested_entities_patch = self.image_patch.find(interested_entities)
+    def __call__(self, interested_entities: list[str], box_threshold: float | None = None) -> dict[str, list[ImagePatch]]:
+        if self.session is not None:
+            # the detections are shared by all queries of the image
+            return self.session.detect(self.image_patch, interested_entities, box_threshold)
+        # the threshold only applies to this call, so it is safe for the concurrent agents
+        overrides = {"florence2_threshold": box_threshold} if box_threshold is not None else {}
+        with config_overlay(**overrides):
+            interested_entities_patch = self.image_patch.find(interested_entities)
         return interested_entities_patch
@@ -2,8 +2,8 @@ from __future__ import annotations
 
 from PIL import Image
 import numpy as np
-import torchvision.transforms.functional as T
 from hydra_vl4ai.execution.image_patch import ImagePatch
+from hydra_vl4ai.execution.toolbox import Toolbox
 from hydra_vl4ai.util.config import Config
 from hydra_vl4ai.util.console import logger
 
@@ -12,42 +12,73 @@ from ...context import Context, Entity
 from ...context.relation import SymbolicRelationEstimator, VlmRelationEstimator
 from ..logic_generation.relation_recognizer import GeometryAnalyzer, UniversalRelationAnalyzer, AttributeRecognizer
 from ..smb import NaverStateMemoryBank
+from ..session import ImageSession
 
 from .captioner import Captioner
 from .entity_category_extractor import EntityCategoryExtractor
 from .entity_detector import EntityDetector
+from .task_graph import TaskGraph
 
 
 class Perceptioner:
     """The pipeline in perception state."""
 
-    def __init__(self, image: Image.Image, query: str, state_memory_bank: NaverStateMemoryBank) -> None:
+    def __init__(self, image: Image.Image, query: str, state_memory_bank: NaverStateMemoryBank,
+                 session: ImageSession | None = None) -> None:
         self.image_pil = image
-        self.image_patch = ImagePatch(image, state_memory_bank=state_memory_bank)
+        # the decoded tensor of the session is used directly, instead of converting the image for each query
+        self.image_patch = ImagePatch(session.image_tensor if session is not None else image, state_memory_bank=state_memory_bank)
         self.state_memory_bank = state_memory_bank
         self.query = query
 
         # Captioner (image -> caption, when needed)
-        self.captioner = Captioner(self.image_patch, state_memory_bank)
+        self.captioner = Captioner(self.image_patch, state_memory_bank, session)
 
         # Entity Category Extractor (query -> categories)
         self.entity_category_extractor = EntityCategoryExtractor(query, self.captioner)
 
         # Entity Detector (image + categories -> entities)
-        self.entity_detector = EntityDetector(self.image_patch)
+        self.entity_detector = EntityDetector(self.image_patch, session)
 
-    def _init_context(self, interested_entities_patch: dict[str, list[ImagePatch]]):
-        geometry_analyzer = GeometryAnalyzer(self.image_pil)
-        universal_relation_analyzer = UniversalRelationAnalyzer(self.image_pil)
-        attribute_recognizer = AttributeRecognizer(self.image_pil)
+        # the perception sub-steps as a dependency graph, the image-only nodes (depth and SAM image embedding)
+        # run while the LLM is extracting the categories, and are reused by the later steps.
+        self.session = session
+        self.image = session.image_array if session is not None else np.array(image)
+        self._feedback: str | None = None
+        self.graph = TaskGraph()
+        self.graph.add("depth", self._estimate_depth)
+        self.graph.add("sam_embedding", self._embed_image)
+        self.graph.add("categories", self._extract_categories)
+        self.graph.add("detections", self.entity_detector, ("categories",))
+        self.graph.add("context", self._init_context, ("detections", "depth", "sam_embedding"))
 
-        context = Context(np.array(T.to_pil_image(self.image_patch.cropped_image)), 
+    def _estimate_depth(self) -> np.ndarray:
+        if self.session is not None:
+            return self.session.depth()
+        return Toolbox[Config.base_config["depth_model"]].forward(self.image)
+
+    def _embed_image(self) -> None:
+        # the embedding is cached in the SAM model, and reused by the masks of all entities
+        if self.session is not None:
+            return self.session.embed_image()
+        Toolbox["sam"].set_image(self.image)
+
+    async def _extract_categories(self) -> list[str]:
+        return await self.entity_category_extractor(self._feedback)
+
+    def _init_context(self, interested_entities_patch: dict[str, list[ImagePatch]], depth: np.ndarray | None = None, sam_embedding: None = None):
+        geometry_analyzer = GeometryAnalyzer(self.image, depth)
+        universal_relation_analyzer = UniversalRelationAnalyzer(self.image)
+        attribute_recognizer = AttributeRecognizer(self.image)
+
+        context = Context(self.image, 
                           geometry_analyzer, 
                           universal_relation_analyzer, 
                           attribute_recognizer)
 
         self.state_memory_bank.context = context
         context.init_entities(interested_entities_patch)
+        logger.debug(f"Entity Pruning: {context.pruning_report}")
         logger.debug(f"Context Entities: {context.entities}")
         if len(context.entities) > 1:
             context.generate_geometry_relations()
@@ -60,13 +91,15 @@ class Perceptioner:
             return PerceptionReturn.FAIL
 
     async def step(self, overwrite_feedback: str | None = None) -> PerceptionReturn:
-        categories = await self.entity_category_extractor(overwrite_feedback)
-        entities = self.entity_detector(categories)
+        # the categories depend on the feedback, so they and the nodes after them are computed again
+        self._feedback = overwrite_feedback
+        self.graph.invalidate("categories")
+        self.graph.start("depth")
+        self.graph.start("sam_embedding")
         # note the generation of geometry-based relations are handled here for simplicity.
         # this will build the entities and the geometry-based relations as the logic context.
         # this can enrich the prior knowledge for Logic Query Generator.
-        return_value = self._init_context(entities)
-        return return_value
+        return await self.graph.get("context")
 
     def fallback_step(self) -> tuple[Entity | None, PerceptionReturn]:
         match Config.base_config["task"]:
@@ -77,11 +110,8 @@ class Perceptioner:
         
     def _fallback_grounding_step(self) -> tuple[Entity | None, PerceptionReturn]:
         # generate based on the grounding method
-        # we temporally set a lower grounding threshold for the fallback
-        prev_threshold = Config.base_config["florence2_threshold"]
-        Config.base_config["florence2_threshold"] = 0.1
-        patches = self.entity_detector([self.query])
-        Config.base_config["florence2_threshold"] = prev_threshold  # reset the threshold
+        # we use a lower grounding threshold for the fallback
+        patches = self.entity_detector([self.query], box_threshold=0.1)
 
         if len(patches) == 0:
             return None, PerceptionReturn.NO_OBJECT
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from ...utils.profiling import profile_span
+
+
+@dataclass
+class _Node:
+    fn: Callable[..., Any]
+    deps: tuple[str, ...]
+    task: asyncio.Task | None = field(default=None)
+
+
+class TaskGraph:
+    """A dependency graph of the perception sub-steps, executed with asyncio tasks.
+
+    Each node is computed at most once and shared by all dependents, the nodes without dependency between
+    them run concurrently. The sync functions run in threads, so the GPU work can overlap the LLM calls.
+    The results are kept until `invalidate`, so the graph can be reused by later steps, e.g. the image-only
+    nodes are not computed again when the perception is retried with feedback.
+    """
+
+    def __init__(self) -> None:
+        self._nodes: dict[str, _Node] = {}
+
+    def add(self, name: str, fn: Callable[..., Any], deps: tuple[str, ...] = ()) -> None:
+        # the results of the dependencies are passed to `fn` as positional arguments, in order
+        for dep in deps:
+            assert dep in self._nodes, f"Unknown dependency {dep} of {name}."
+        self._nodes[name] = _Node(fn, deps)
+
+    def start(self, name: str) -> asyncio.Task:
+        # schedule the node and its dependencies without waiting
+        node = self._nodes[name]
+        if node.task is not None and node.task.done() and (node.task.cancelled() or node.task.exception() is not None):
+            # the failed node is computed again
+            node.task = None
+        if node.task is None:
+            node.task = asyncio.create_task(self._run(name, node), name=name)
+        return node.task
+
+    async def get(self, name: str) -> Any:
+        return await self.start(name)
+
+    async def _run(self, name: str, node: _Node) -> Any:
+        args = await asyncio.gather(*[self.start(dep) for dep in node.deps])
+        with profile_span(name, "perception"):
+            if inspect.iscoroutinefunction(node.fn):
+                return await node.fn(*args)
+            return await asyncio.to_thread(node.fn, *args)
+
+    def invalidate(self, name: str) -> None:
+        # drop the result of the node and all nodes depending on it
+        node = self._nodes[name]
+        if node.task is not None and not node.task.done():
+            node.task.cancel()
+        node.task = None
+        for other_name, other in self._nodes.items():
+            if name in other.deps:
+                self.invalidate(other_name)
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import numpy as np
+import torch
+import torchvision.transforms.functional as T
+from PIL import Image
+from segment_anything import SamPredictor
+
+from hydra_vl4ai.execution.image_patch import ImagePatch
+from hydra_vl4ai.execution.toolbox import Toolbox
+from hydra_vl4ai.util.config import Config
+
+from ..utils.config_overlay import config_overlay, get_config
+from .artifact_store import get_artifact_store
+
+
+CAPTION_PROMPT = "Please describe the image in detail."
+
+
+def detect_coordinates(image_patch: ImagePatch, category: str) -> np.ndarray:
+    # the raw detections (left, lower, right, upper, confidence) of `ImagePatch.find`, with the same models and prompts
+    if category in ["object", "objects"]:
+        return np.asarray(image_patch.forward("maskrcnn", image_patch.cropped_image)[0])
+    prompt = "people" if category == "person" else category
+    return np.asarray(image_patch.forward(Config.base_config["grounding_model"], image_patch.cropped_image, prompt))
+
+
+def patches_from_coordinates(image_patch: ImagePatch, category: str, coordinates: np.ndarray) -> list[ImagePatch]:
+    # the patches built by `ImagePatch.find` from the raw detections, with the same feedback in the state memory
+    # bank of the image patch, so the memoized and stored detections give the same state as running the detector
+    state_memory_bank = image_patch.state_memory_bank
+    if len(coordinates) == 0:
+        state_memory_bank.find_cant_found_add_feedback(category)
+        return []
+    threshold = Config.base_config["ratio_box_area_to_image_area"]
+    if threshold > 0:
+        areas = (coordinates[:, 2] - coordinates[:, 0]) * (coordinates[:, 3] - coordinates[:, 1])
+        coordinates = coordinates[areas / (image_patch.width * image_patch.height) > threshold]
+    state_memory_bank.find_general_add_feedback(coordinates, category, image_patch.image_name)
+    patches = [image_patch.crop(*coordinate[:4], image_name=f"{category}_{i + 1}_in_{image_patch.image_name}",
+                                confidence=float(coordinate[4]))
+               for i, coordinate in enumerate(coordinates)]
+    height = image_patch.original_image.shape[1]
+    for i, patch in enumerate(patches):
+        state_memory_bank.find_bounding_box_add_feedback(
+            category, i + 1, image_patch.image_name, str([patch.left, height - patch.upper, patch.right, height - patch.lower]))
+    return patches
+
+
+class ImageSession:
+    """The decoded image and the memoized image-level artifacts, shared by all queries of the same image.
+
+    The depth map, the SAM image embedding, the caption and the detections of each category are computed once
+    and reused by every `Naver` created with this session, no matter the queries run sequentially or concurrently.
+    If the artifact store is enabled, the artifacts precomputed offline are used instead of running the models.
+    """
+
+    def __init__(self, image: str | Image.Image) -> None:
+        if isinstance(image, Image.Image):
+            self.image_path = getattr(image, "filename", None)
+            self.image = image
+        else:
+            self.image_path = image
+            self.image = Image.open(image)
+        self.image.load()
+        # the decoded buffers shared by the components, they are not modified in place
+        self.image_array = np.array(self.image)
+        self.image_tensor: torch.Tensor = T.to_tensor(self.image_array)
+        self._artifacts: dict[Any, Any] = {}
+        self._locks: dict[Any, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stored = self._load_stored()
+
+    def _load_stored(self) -> dict[Any, Any]:
+        store = get_artifact_store()
+        if store is None or self.image_path is None:
+            return {}
+        return store.load(store.key(self.image_path)) or {}
+
+    def _memoize(self, key: Any, fn: Callable[[], Any]) -> Any:
+        # compute the artifact once, the concurrent callers of the same key wait for the first one
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._artifacts:
+                self._artifacts[key] = fn()
+            return self._artifacts[key]
+
+    def depth(self) -> np.ndarray:
+        if "depth" in self._stored:
+            return self._stored["depth"]
+        return self._memoize("depth", lambda: Toolbox[Config.base_config["depth_model"]].forward(self.image_array))
+
+    def embed_image(self) -> None:
+        # the predictor with the image embedding is kept by the session, and attached to the image array,
+        # so the masks of all queries prompted on `image_array` reuse it
+        def embed() -> SamPredictor:
+            sam = Toolbox["sam"]
+            if "sam_embedding" in self._stored:
+                predictor = sam.predictor_from_embedding(self._stored["sam_embedding"])
+            else:
+                predictor = sam.new_predictor(self.image_array)
+            sam.attach(self.image_array, predictor)
+            return predictor
+        self._memoize("sam_embedding", embed)
+
+    def caption(self, image_patch: ImagePatch) -> str:
+        if "caption" in self._stored:
+            return self._stored["caption"]
+        return self._memoize("caption", lambda: image_patch.forward(
+            Config.base_config["vlm_caption_model"],
+            image_patch.cropped_image,
+            CAPTION_PROMPT
+        ))
+
+    def detect(self, image_patch: ImagePatch, categories: list[str], box_threshold: float | None = None
+               ) -> dict[str, list[ImagePatch]]:
+        # the raw detections are memoized per category and threshold, so the queries sharing a category detect it
+        # once. the patches are built for each query, so they and the feedback belong to the query's memory bank
+        threshold = box_threshold if box_threshold is not None else get_config("florence2_threshold")
+
+        def detect_one(category: str) -> np.ndarray:
+            coordinates = self._stored.get(("detections", category, round(threshold, 6)))
+            if coordinates is not None:
+                return coordinates
+            with config_overlay(florence2_threshold=threshold):
+                return detect_coordinates(image_patch, category)
+
+        return {category: patches_from_coordinates(
+                    image_patch, category, self._memoize(("detections", category, threshold), lambda c=category: detect_one(c)))
+                for category in categories}
+
+
+class SessionPrefetcher:
+    """Decodes the images of the upcoming queries in a thread pool, while the current queries are running.
+
+    The image paths are given in the run order, one for each query. The images are decoded in the order of their
+    first query, at most `look_ahead` images ahead of the latest requested one, and each session is dropped after
+    the last query of its image is released.
+    """
+
+    def __init__(self, image_paths: list[str], look_ahead: int = 4, num_workers: int = 4) -> None:
+        self.look_ahead = look_ahead
+        self._order = list(dict.fromkeys(image_paths))
+        self._positions = {image_path: i for i, image_path in enumerate(self._order)}
+        self._remaining = Counter(image_paths)
+        self._sessions: dict[str, asyncio.Future[ImageSession]] = {}
+        self._next = 0
+        self._executor = ThreadPoolExecutor(num_workers, thread_name_prefix="naver_prefetch")
+
+    async def acquire(self, image_path: str) -> ImageSession:
+        loop = asyncio.get_running_loop()
+        last = min(self._positions[image_path] + self.look_ahead, len(self._order) - 1)
+        while self._next <= last:
+            path = self._order[self._next]
+            self._sessions[path] = loop.run_in_executor(self._executor, ImageSession, path)
+            self._next += 1
+        return await self._sessions[image_path]
+
+    def release(self, image_path: str) -> None:
+        self._remaining[image_path] -= 1
+        if self._remaining[image_path] == 0:
+            self._sessions.pop(image_path, None)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,7 @@
 from .context import Context
-from .entity import Entity
+from .entity import Entity, EntityRegistry
 from .relation import Relation
 from .attribute import Attribute
+from .store import ContextStore
 
-__all__ = ["Context", "Entity", "Relation", "Attribute"]
+__all__ = ["Context", "Entity", "EntityRegistry", "Relation", "Attribute", "ContextStore"]
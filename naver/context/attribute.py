@@ -1,4 +1,12 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .store import ContextStore
 
 @dataclass
 class Attribute:
@@ -14,6 +22,18 @@ class Attribute:
     def to_problog_type(cls):
         return r"% attribute(entity_id: str, attribute_name: str)"
 
+    @classmethod
+    def from_store(cls, store: ContextStore) -> list[Attribute]:
+        return [cls(entity_id, attribute_name, prob) for entity_id, attribute_name, prob in _rows(store)]
+
+    @classmethod
+    def to_scallop_rels(cls, store: ContextStore) -> list[str]:
+        return [f"""rel {prob}::attribute("{entity_id}", "{attribute_name}")""" for entity_id, attribute_name, prob in _rows(store)]
+
+    @classmethod
+    def to_problog_rels(cls, store: ContextStore) -> list[str]:
+        return [f"""{prob}::attribute("{entity_id}", "{attribute_name}").""" for entity_id, attribute_name, prob in _rows(store)]
+
     def to_scallop_rel(self):
         return f"""rel {self.prob}::attribute("{self.entity_id}", "{self.attribute_name}")"""
     
@@ -22,3 +42,10 @@ class Attribute:
     
     def to_statement(self):
         return f"""{self.entity_id}: the object has the attribute {self.attribute_name} (confidence: {round(self.prob * 100, 2)}%)."""
+
+
+def _rows(store: ContextStore):
+    e, a = store.attribute_rows()
+    ids = np.array(store.ids, dtype=object)
+    names = np.array(store.attribute_names, dtype=object)
+    return zip(ids[e].tolist(), names[a].tolist(), store.attribute_probs[e, a].tolist())
@@ -6,10 +6,13 @@ from typing import TYPE_CHECKING
 
 from hydra_vl4ai.execution.image_patch import ImagePatch
 
+from ..utils.config_overlay import get_config
 from ..utils.misc import clean_cache
-from .entity import Entity
-from .relation import Relation
+from .entity import Entity, EntityRegistry, detections_to_arrays
+from .relation import GEOMETRY_RELATIONS, Relation
 from .attribute import Attribute
+from .pruning import PruningReport, prune_entities
+from .store import ContextStore
 
 if TYPE_CHECKING:
     from ..agent.logic_generation.relation_recognizer import GeometryAnalyzer, UniversalRelationAnalyzer, AttributeRecognizer
@@ -24,64 +27,67 @@ class Context:
             attribute_recognizer: AttributeRecognizer
         ) -> None:
         self.image = image
-        self.entities: dict[str, Entity] = {}
-        self.relations: list[Relation] = []
-        self.attributes: list[Attribute] = []
+        # the entities, relations and attributes are stored in columns, the accessors below are the views of it
+        self.store = ContextStore()
+        self._entities: dict[str, Entity] = {}
+        self.entity_registry = EntityRegistry()
+        self.pruning_report = PruningReport()
         self.geometry_analyzer = geometry_analyzer
         self.universal_relation_analyzer = universal_relation_analyzer
         self.attribute_recognizer = attribute_recognizer
 
+    @property
+    def entities(self) -> dict[str, Entity]:
+        return self._entities
+
+    @entities.setter
+    def entities(self, entities: dict[str, Entity]) -> None:
+        self.store = ContextStore.from_entities(list(entities.values()))
+        self._entities = dict(zip(self.store.ids, self.store.entities))
+
+    @property
+    def relations(self) -> list[Relation]:
+        return Relation.from_store(self.store)
+
+    @property
+    def attributes(self) -> list[Attribute]:
+        return Attribute.from_store(self.store)
+
     @property
     def entity_categories(self) -> list[str]:
-        return list(set([entity.category for entity in self.entities.values()]))
+        return [self.store.categories[i] for i in np.unique(self.store.category_ids)]
     
     @property
     def first_entity(self) -> Entity | None:
-        entities = list(self.entities.values())
-        return entities[0] if len(entities) > 0 else None
+        return self.store.entities[0] if len(self.store) > 0 else None
 
     def init_entities(self, find_output: dict[str, list[ImagePatch]]) -> None:
-        interested_entities_valid = [k for k, v in find_output.items() if len(v) > 0]
-        result = []
-        for entity_name in interested_entities_valid:
-            patches = find_output[entity_name]
-            for patch in patches:
-                bbox = patch.to_bbox()
-                result.append(Entity.new(entity_name, bbox[:4], bbox[4], result))
+        categories, bboxes, confidences = detections_to_arrays(find_output)
+        # prune the detections before building the entities, as the relations are O(N^2) of the entities
+        keep, bboxes, self.pruning_report = prune_entities(
+            categories, bboxes, confidences,
+            image_area=self.image.shape[0] * self.image.shape[1],
+            min_area_ratio=get_config("ratio_box_area_to_image_area", 0.),
+            duplicate_iou=get_config("entity_duplicate_iou_threshold", None),
+            nms_iou=get_config("entity_nms_iou_threshold", None),
+            max_per_category=get_config("entity_max_per_category", None),
+        )
+        self.entity_registry = EntityRegistry()
+        result = self.entity_registry.from_arrays([categories[i] for i in keep], bboxes, confidences[keep])
         self.entities = {entity.id: entity for entity in result}
 
     def generate_geometry_relations(self) -> None:
-        # build relations for each entities pair
-        entity_ids = list(self.entities.keys())
-        pairs = []
-        for i in range(len(entity_ids)):
-            for j in range(i + 1, len(entity_ids)):
-                pairs.append((entity_ids[i], entity_ids[j]))
-        with Progress(
-            TextColumn("[bold blue]{task.description}"),
-            BarColumn(),
-            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-            TextColumn("({task.completed}/{task.total})"),
-            TimeElapsedColumn(),
-            TimeRemainingColumn(),
-        ) as progress:
-            task = progress.add_task("Generate Geometry Relations...", total=len(pairs))
-            clean_cache()
-            for entity_a_id, entity_b_id in pairs:
-                entity_a = self.entities[entity_a_id]
-                entity_b = self.entities[entity_b_id]
-                a_to_b, b_to_a = self.geometry_analyzer(entity_a, entity_b)
-                self.relations.append(a_to_b)
-                self.relations.append(b_to_a)
-                progress.update(task, advance=1)
+        # build relations for all entity pairs at once
+        clean_cache()
+        probs = self.geometry_analyzer.relation_tensor(self.store.entities)
+        self.store.set_relation_tensor(GEOMETRY_RELATIONS, probs)
         
     def generate_relations(self, relation_names: list[str]) -> None:
-        # build relations for each entities pair
-        entity_ids = list(self.entities.keys())
-        pairs = []
-        for i in range(len(entity_ids)):
-            for j in range(i + 1, len(entity_ids)):
-                pairs.append((entity_ids[i], entity_ids[j]))
+        # build relations for each entities pair, the relations already generated are skipped
+        relation_names = [name for name in relation_names if not self.store.has_relation(name)]
+        if len(relation_names) == 0:
+            return
+        pairs = [(i, j) for i in range(len(self.store)) for j in range(i + 1, len(self.store))]
         with Progress(
             TextColumn("[bold blue]{task.description}"),
             BarColumn(),
@@ -92,16 +98,18 @@ class Context:
         ) as progress:
             task = progress.add_task("Generate Universal Relations...", total=len(pairs))
             clean_cache()
-            for entity_a_id, entity_b_id in pairs:
-                entity_a = self.entities[entity_a_id]
-                entity_b = self.entities[entity_b_id]
+            self.store.add_relation_names(relation_names)
+            for i, j in pairs:
+                entity_a = self.store.entities[i]
+                entity_b = self.store.entities[j]
                 a_to_b, b_to_a = self.universal_relation_analyzer(entity_a, entity_b, relation_names)
-                self.relations.append(a_to_b)
-                self.relations.append(b_to_a)
+                self.store.set_relation(i, j, a_to_b.relation_name)
+                self.store.set_relation(j, i, b_to_a.relation_name)
                 progress.update(task, advance=1)
         
     def generate_attribute(self, attribute_name: str):
-        entity_ids = list(self.entities.keys())
+        if self.store.has_attribute(attribute_name):
+            return
         with Progress(
             TextColumn("[bold blue]{task.description}"),
             BarColumn(),
@@ -110,8 +118,8 @@ class Context:
             TimeElapsedColumn(),
             TimeRemainingColumn(),
         ) as progress:
-            task = progress.add_task("Generate Attribute...", total=len(entity_ids))
-            for entity_id in entity_ids:
-                entity = self.entities[entity_id]
-                self.attributes.append(self.attribute_recognizer(entity, attribute_name))
+            task = progress.add_task("Generate Attribute...", total=len(self.store))
+            for i, entity in enumerate(self.store.entities):
+                attribute = self.attribute_recognizer(entity, attribute_name)
+                self.store.set_attribute(i, attribute.attribute_name, attribute.prob)
                 progress.update(task, advance=1)
@@ -1,9 +1,15 @@
 from __future__ import annotations
 
+import sys
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
 
 import numpy as np
 
+if TYPE_CHECKING:
+    from hydra_vl4ai.execution.image_patch import ImagePatch
+    from .store import ContextStore
+
 
 @dataclass
 class Entity:
@@ -21,18 +27,6 @@ class Entity:
             self._id = self.category.replace(" ", "_") + "_" + str(self.num)
         return self._id
 
-    @classmethod
-    def new(cls, category: str, bbox: list[int], bbox_confidence: float, all_entities: list[Entity]) -> Entity:
-        current_category_entities = filter(lambda x: x.category == category, all_entities)
-        current_category_entity_id_nums = [*map(lambda x: x.num, current_category_entities)]
-        max_nums = max(current_category_entity_id_nums) if len(current_category_entity_id_nums) > 0 else -1
-        return cls(
-            max_nums + 1,
-            category,
-            bbox,
-            bbox_confidence
-        )
-
     @classmethod
     def to_scallop_type(cls):
         return "type entity(id: String, category: String, x1: i32, y1: i32, x2: i32, y2: i32)"
@@ -41,6 +35,16 @@ class Entity:
     def to_problog_type(cls):
         return r"% entity(ID: str, category: str, x1: int, y1: int, x2: int, y2: int)"
 
+    @classmethod
+    def to_scallop_rels(cls, store: ContextStore) -> list[str]:
+        return [f"""rel {conf}::entity("{entity_id}", "{category}", {x1}, {y1}, {x2}, {y2})"""
+                for entity_id, category, (x1, y1, x2, y2), conf in _columns(store)]
+
+    @classmethod
+    def to_problog_rels(cls, store: ContextStore) -> list[str]:
+        return [f"""{conf}::entity("{entity_id}", "{category}", {x1}, {y1}, {x2}, {y2})."""
+                for entity_id, category, (x1, y1, x2, y2), conf in _columns(store)]
+
     def to_scallop_rel(self):
         x1, y1, x2, y2 = self.bbox
         return f"""rel {self.bbox_confidence}::entity("{self.id}", "{self.category}", {x1}, {y1}, {x2}, {y2})"""
@@ -54,3 +58,47 @@ class Entity:
         # round the bbox confidence to percentage
         bbox_conf = round(self.bbox_confidence * 100, 2)
         return f"""{self.id}: the {self.category} entity is at [{x1}, {y1}, {x2}, {y2}] (confidence: {bbox_conf}%)."""
+
+
+class EntityRegistry:
+    """Assigns the entity numbers with per-category counters, and interns the entity ids."""
+
+    def __init__(self) -> None:
+        self._counters: dict[str, int] = {}
+        self._ids: dict[tuple[str, int], str] = {}
+
+    def entity_id(self, category: str, num: int) -> str:
+        key = (category, num)
+        entity_id = self._ids.get(key)
+        if entity_id is None:
+            entity_id = self._ids[key] = sys.intern(category.replace(" ", "_") + "_" + str(num))
+        return entity_id
+
+    def new(self, category: str, bbox: list[int], bbox_confidence: float) -> Entity:
+        num = self._counters.get(category, 0)
+        self._counters[category] = num + 1
+        return Entity(num, category, bbox, bbox_confidence, _id=self.entity_id(category, num))
+
+    def from_detections(self, find_output: dict[str, list[ImagePatch]]) -> list[Entity]:
+        # build the entities of all detected patches, in the order of the categories and the detections
+        return self.from_arrays(*detections_to_arrays(find_output))
+
+    def from_arrays(self, categories: list[str], bboxes: np.ndarray, confidences: np.ndarray) -> list[Entity]:
+        return [self.new(category, bbox, bbox_confidence)
+                for category, bbox, bbox_confidence in zip(categories, bboxes.tolist(), confidences.tolist())]
+
+
+def detections_to_arrays(find_output: dict[str, list[ImagePatch]]) -> tuple[list[str], np.ndarray, np.ndarray]:
+    # the categories, (N, 4) bboxes and (N,) confidences of all detected patches
+    categories = []
+    bboxes = []
+    for category, patches in find_output.items():
+        for patch in patches:
+            categories.append(category)
+            bboxes.append(patch.to_bbox())
+    bboxes = np.array(bboxes, dtype=np.float64).reshape(-1, 5)
+    return categories, bboxes[:, :4].astype(np.int64), bboxes[:, 4]
+
+
+def _columns(store: ContextStore):
+    return zip(store.ids, store.entity_categories.tolist(), store.bboxes.tolist(), store.confidences.tolist())
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class PruningReport:
+    total: int = 0
+    tiny: int = 0
+    duplicates: int = 0
+    suppressed: int = 0
+    capped: int = 0
+
+    @property
+    def pruned(self) -> int:
+        return self.tiny + self.duplicates + self.suppressed + self.capped
+
+    @property
+    def kept(self) -> int:
+        return self.total - self.pruned
+
+    def __str__(self) -> str:
+        return (f"kept {self.kept}/{self.total} entities (tiny: {self.tiny}, duplicates: {self.duplicates}, "
+                f"nms: {self.suppressed}, capped: {self.capped})")
+
+
+def pairwise_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    # boxes are (N, 4) and (M, 4) in [x1, y1, x2, y2], returns (N, M)
+    boxes_a = boxes_a.astype(np.float64)
+    boxes_b = boxes_b.astype(np.float64)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=-1)
+    area_a = np.prod(np.clip(boxes_a[:, 2:] - boxes_a[:, :2], 0, None), axis=-1)
+    area_b = np.prod(np.clip(boxes_b[:, 2:] - boxes_b[:, :2], 0, None), axis=-1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(union > 0, intersection / union, 0.)
+
+
+def prune_entities(
+    categories: list[str],
+    bboxes: np.ndarray,
+    confidences: np.ndarray,
+    image_area: float,
+    min_area_ratio: float = 0.,
+    duplicate_iou: float | None = None,
+    nms_iou: float | None = None,
+    max_per_category: int | None = None,
+) -> tuple[np.ndarray, np.ndarray, PruningReport]:
+    """Prune the detected boxes before building the entities, to bound the cost of the pairwise relations.
+
+    The steps are applied in order:
+    1. drop the boxes smaller than `min_area_ratio` of the image.
+    2. merge the boxes of the same category with IoU above `duplicate_iou` into the most confident one.
+    3. cross-category NMS, suppress the boxes overlapping a more confident box with IoU above `nms_iou`.
+    4. keep at most `max_per_category` most confident boxes for each category.
+
+    Returns the indices of the kept boxes (in the original order), their (possibly merged) boxes and the report.
+    """
+    bboxes = np.asarray(bboxes).reshape(-1, 4)
+    confidences = np.asarray(confidences, dtype=np.float64)
+    categories_arr = np.array(categories, dtype=object)
+    report = PruningReport(total=len(bboxes))
+    keep = np.arange(len(bboxes))
+    merged_bboxes = bboxes.copy()
+
+    # 1. tiny boxes
+    if min_area_ratio > 0 and len(keep) > 0:
+        areas = np.prod(np.clip(bboxes[:, 2:] - bboxes[:, :2], 0, None), axis=-1)
+        valid = areas / image_area > min_area_ratio
+        report.tiny = int((~valid).sum())
+        keep = keep[valid]
+
+    # 2. near-duplicates in the same category
+    if duplicate_iou is not None and len(keep) > 1:
+        iou = pairwise_iou(bboxes[keep], bboxes[keep])
+        same_category = categories_arr[keep][:, None] == categories_arr[keep][None, :]
+        duplicated = (iou > duplicate_iou) & same_category
+        # a zero-area box has no IoU with itself, but is always in its own group
+        np.fill_diagonal(duplicated, True)
+        order = np.argsort(-confidences[keep], kind="stable")
+        merged = np.zeros(len(keep), dtype=bool)
+        survivors = []
+        for i in order:
+            if merged[i]:
+                continue
+            group = np.flatnonzero(duplicated[i] & ~merged)
+            merged[group] = True
+            weights = confidences[keep[group]]
+            weights = weights / weights.sum() if weights.sum() > 0 else np.full(len(group), 1 / len(group))
+            merged_bboxes[keep[i]] = np.round(weights @ bboxes[keep[group]]).astype(bboxes.dtype)
+            survivors.append(i)
+        report.duplicates = len(keep) - len(survivors)
+        keep = keep[np.sort(survivors)]
+
+    # 3. cross-category NMS
+    if nms_iou is not None and len(keep) > 1:
+        iou = pairwise_iou(merged_bboxes[keep], merged_bboxes[keep])
+        order = np.argsort(-confidences[keep], kind="stable")
+        rank = np.empty(len(keep), dtype=np.int64)
+        rank[order] = np.arange(len(keep))
+        suppressed = np.zeros(len(keep), dtype=bool)
+        for i in order:
+            if suppressed[i]:
+                continue
+            suppressed |= (iou[i] > nms_iou) & (rank > rank[i])
+        report.suppressed = int(suppressed.sum())
+        keep = keep[~suppressed]
+
+    # 4. cap the number of entities per category
+    if max_per_category is not None and len(keep) > 0:
+        order = keep[np.argsort(-confidences[keep], kind="stable")]
+        counts: dict[str, int] = {}
+        capped = []
+        for i in order:
+            counts[categories[i]] = counts.get(categories[i], 0) + 1
+            if counts[categories[i]] <= max_per_category:
+                capped.append(i)
+        report.capped = len(keep) - len(capped)
+        keep = np.sort(np.array(capped, dtype=np.int64))
+
+    return keep, merged_bboxes[keep], report
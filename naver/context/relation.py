@@ -1,7 +1,7 @@
 from __future__ import annotations
 import abc
 from dataclasses import dataclass
-from typing import TypedDict
+from typing import TYPE_CHECKING, TypedDict
 
 import numpy as np
 import tensorneko as N
@@ -14,6 +14,9 @@ from ..utils.misc import clean_cache
 from ..utils.som import apply_som_for_two
 from .entity import Entity
 
+if TYPE_CHECKING:
+    from .store import ContextStore
+
 GEOMETRY_RELATIONS = [
     "is",
     "next to",
@@ -43,6 +46,20 @@ class Relation:
     def to_problog_type(cls):
         return r"% relation(subject: str, object: str, relation_name: str)"
 
+    @classmethod
+    def from_store(cls, store: ContextStore) -> list[Relation]:
+        return [cls(store.ids[s], store.ids[o], relation_name) for s, o, relation_name in store.relation_groups()]
+
+    @classmethod
+    def to_scallop_rels(cls, store: ContextStore) -> list[str]:
+        return [f"""rel {prob}::relation_("{subject_id}", "{object_id}", "{rel}")"""
+                for subject_id, object_id, rel, prob in _rows(store)]
+
+    @classmethod
+    def to_problog_rels(cls, store: ContextStore) -> list[str]:
+        return [f"""{prob}::relation("{subject_id}", "{object_id}", "{rel}")."""
+                for subject_id, object_id, rel, prob in _rows(store)]
+
     def to_scallop_rel(self):
         scallop_rels = [
             f"""rel {prob}::relation_("{self.subject_entity_id}", "{self.object_entity_id}", "{rel}")"""
@@ -66,6 +83,13 @@ class Relation:
         return "\n".join(statements)
 
 
+def _rows(store: ContextStore):
+    s, o, r = store.relation_rows()
+    ids = np.array(store.ids, dtype=object)
+    names = np.array(store.relation_names, dtype=object)
+    return zip(ids[s].tolist(), ids[o].tolist(), names[r].tolist(), store.relation_probs[s, o, r].tolist())
+
+
 class RelationEstimator(abc.ABC):
     
     def __init__(self, image: np.ndarray) -> None:
@@ -156,10 +180,10 @@ def _sigmoid(z):
 
 class SymbolicRelationEstimator(RelationEstimator):
 
-    def __init__(self, image: np.ndarray) -> None:
+    def __init__(self, image: np.ndarray, depth: np.ndarray | None = None) -> None:
         super().__init__(image)
         # a depth np array with same resolution as image, 0 means close, 1 means most far
-        self.depth = Toolbox[Config.base_config["depth_model"]].forward(self.image)
+        self.depth = depth if depth is not None else Toolbox[Config.base_config["depth_model"]].forward(self.image)
         self.image_height = self.image.shape[0]
         self.image_width = self.image.shape[1]
         
@@ -183,6 +207,60 @@ class SymbolicRelationEstimator(RelationEstimator):
 
         return a_to_b, b_to_a
     
+    def generate_geometry_relation_tensor(self, entities: list[Entity]) -> np.ndarray:
+        # vectorized version of `generate_geometry_relations` for all entity pairs.
+        # returns the (N, N, len(GEOMETRY_RELATIONS)) tensor for "subject i -> object j", NaN for i == j.
+        ALPHA = 5
+        n = len(entities)
+        for entity in entities:
+            if entity.mask is None:
+                entity.mask = N.util.try_until_success(
+                    Toolbox["sam"].forward, self.image, entity.bbox, False, max_trials=5,
+                    exception_callback=lambda _: clean_cache()
+                )
+        masks = np.stack([entity.mask for entity in entities]).reshape(n, -1).astype(np.float32)
+        bboxes = np.array([entity.bbox for entity in entities], dtype=np.float64).reshape(n, 4)
+
+        # the depth of object as the average depth of the mask
+        mask_areas = masks.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            depths = masks @ self.depth.reshape(-1).astype(np.float32) / mask_areas
+
+        prob_is = N.evaluation.iou_2d(torch.tensor(bboxes), torch.tensor(bboxes)).numpy()
+
+        centers = np.stack([
+            (bboxes[:, 0] + bboxes[:, 2]) / 2 / self.image_width,
+            (bboxes[:, 1] + bboxes[:, 3]) / 2 / self.image_height
+        ], axis=1)
+        centers_with_depth = np.concatenate([centers, depths[:, None]], axis=1)
+        distance = np.linalg.norm(centers_with_depth[:, None] - centers_with_depth[None, :], axis=-1) / np.sqrt(3)
+        prob_next_to = np.exp(-ALPHA * distance) * (1 - prob_is)
+
+        # intersection[i, j] is the overlapped mask area of entity i and j
+        intersection = masks @ masks.T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            prob_contains = np.where(mask_areas[None, :] > 0, intersection / mask_areas[None, :], 0)
+            prob_inside = np.where(mask_areas[:, None] > 0, intersection / mask_areas[:, None], 0)
+
+        dx = centers[None, :, 0] - centers[:, None, 0]  # center_b - center_a
+        dy = centers[None, :, 1] - centers[:, None, 1]
+        dd = depths[None, :] - depths[:, None]
+
+        probs = np.stack([
+            prob_is,
+            prob_next_to,
+            prob_contains,
+            prob_inside,
+            _sigmoid(ALPHA * dx),  # left of
+            _sigmoid(-ALPHA * dx),  # right of
+            _sigmoid(-ALPHA * dy),  # above of
+            _sigmoid(ALPHA * dy),  # below of
+            _sigmoid(ALPHA * dd),  # front of
+            _sigmoid(-ALPHA * dd),  # behind of
+        ], axis=-1).astype(np.float64)
+        probs[np.arange(n), np.arange(n)] = np.nan
+        return probs
+
     def _generate_a_to_b_relation(self, entity_a: Entity, entity_b: Entity, mask_a: np.ndarray, mask_b: np.ndarray, depth_a: float, depth_b: float) -> list[tuple[str, float]]:
         ALPHA = 5
 
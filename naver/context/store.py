@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from typing import Iterator
+
+import numpy as np
+
+from .entity import Entity
+
+
+class ContextStore:
+    """The columnar storage of the entities, relations and attributes in the logic context.
+
+    Entity i is described by row i of the arrays. The relation probability of "subject i -> object j" for
+    relation name r is `relation_probs[i, j, r]` and the attribute probability of entity i for attribute a
+    is `attribute_probs[i, a]`. NaN means the value is not generated.
+    """
+
+    def __init__(self) -> None:
+        # entities
+        self.categories: list[str] = []  # interned category table
+        self._category_index: dict[str, int] = {}
+        self.category_ids = np.zeros(0, dtype=np.int32)
+        self.nums = np.zeros(0, dtype=np.int32)
+        self.bboxes = np.zeros((0, 4), dtype=np.int64)
+        self.confidences = np.zeros(0, dtype=np.float64)
+        self.ids: list[str] = []
+        self.entities: list[Entity] = []  # entity views, which also hold the lazily generated masks
+        self._id_index: dict[str, int] = {}
+
+        # relations, the relation names are added in batches (e.g. all geometry relations),
+        # and the facts are serialized batch by batch to keep the generation order.
+        self.relation_names: list[str] = []
+        self._relation_index: dict[str, int] = {}
+        self.relation_batches: list[np.ndarray] = []
+        self.relation_probs = np.full((0, 0, 0), np.nan)
+
+        # attributes
+        self.attribute_names: list[str] = []
+        self._attribute_index: dict[str, int] = {}
+        self.attribute_probs = np.full((0, 0), np.nan)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_entities(cls, entities: list[Entity]) -> ContextStore:
+        store = cls()
+        store.entities = list(entities)
+        store.ids = [entity.id for entity in entities]
+        store._id_index = {entity_id: i for i, entity_id in enumerate(store.ids)}
+        store.category_ids = np.array([store.intern_category(entity.category) for entity in entities], dtype=np.int32)
+        store.nums = np.array([entity.num for entity in entities], dtype=np.int32)
+        store.bboxes = np.array([entity.bbox for entity in entities], dtype=np.int64).reshape(-1, 4)
+        store.confidences = np.array([entity.bbox_confidence for entity in entities], dtype=np.float64)
+        store.relation_probs = np.full((len(entities), len(entities), 0), np.nan)
+        store.attribute_probs = np.full((len(entities), 0), np.nan)
+        return store
+
+    def intern_category(self, category: str) -> int:
+        index = self._category_index.get(category)
+        if index is None:
+            index = self._category_index[category] = len(self.categories)
+            self.categories.append(category)
+        return index
+
+    def index_of(self, entity_id: str) -> int:
+        return self._id_index[entity_id]
+
+    @property
+    def entity_categories(self) -> np.ndarray:
+        # the category of each entity
+        return np.array(self.categories, dtype=object)[self.category_ids] if len(self) > 0 else np.zeros(0, dtype=object)
+
+    # ------------ relations ------------
+    def add_relation_names(self, relation_names: list[str]) -> np.ndarray:
+        new_names = [name for name in dict.fromkeys(relation_names) if name not in self._relation_index]
+        if len(new_names) > 0:
+            for name in new_names:
+                self._relation_index[name] = len(self.relation_names)
+                self.relation_names.append(name)
+            n = len(self)
+            self.relation_probs = np.concatenate([self.relation_probs, np.full((n, n, len(new_names)), np.nan)], axis=2)
+            self.relation_batches.append(np.array([self._relation_index[name] for name in new_names], dtype=np.int64))
+        return np.array([self._relation_index[name] for name in relation_names], dtype=np.int64)
+
+    def set_relation_tensor(self, relation_names: list[str], probs: np.ndarray) -> None:
+        # probs is (N, N, len(relation_names))
+        columns = self.add_relation_names(relation_names)
+        self.relation_probs[:, :, columns] = probs
+
+    def set_relation(self, subject_index: int, object_index: int, relation_name: list[tuple[str, float]]) -> None:
+        columns = self.add_relation_names([name for name, _ in relation_name])
+        self.relation_probs[subject_index, object_index, columns] = [prob for _, prob in relation_name]
+
+    def has_relation(self, relation_name: str) -> bool:
+        # the relation is generated for all entity pairs
+        column = self._relation_index.get(relation_name)
+        if column is None:
+            return False
+        off_diagonal = ~np.eye(len(self), dtype=bool)
+        return not np.isnan(self.relation_probs[:, :, column][off_diagonal]).any()
+
+    def relation_rows(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The (subject, object, relation) indices of all generated relation facts.
+
+        The order is the same as the generation order: batch by batch, and for each entity pair (i, j) with i < j,
+        the relations of i -> j followed by the relations of j -> i.
+        """
+        s, o, r, _ = self._relation_rows()
+        return s, o, r
+
+    def _relation_rows(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        i, j = np.triu_indices(len(self), 1)
+        subjects = np.stack([i, j], axis=1).ravel()
+        objects = np.stack([j, i], axis=1).ravel()
+        rows = [(np.zeros(0, dtype=np.int64),) * 4]
+        for batch, columns in enumerate(self.relation_batches):
+            s = np.repeat(subjects, len(columns))
+            o = np.repeat(objects, len(columns))
+            r = np.tile(columns, len(subjects))
+            valid = ~np.isnan(self.relation_probs[s, o, r])
+            rows.append((s[valid], o[valid], r[valid], np.full(valid.sum(), batch, dtype=np.int64)))
+        s, o, r, b = map(np.concatenate, zip(*rows))
+        return s, o, r, b
+
+    def relation_groups(self) -> Iterator[tuple[int, int, list[tuple[str, float]]]]:
+        # the relation facts grouped by the (subject, object) pair of each batch, same as the `Relation` objects
+        s, o, r, b = self._relation_rows()
+        if len(s) == 0:
+            return
+        probs = self.relation_probs[s, o, r].tolist()
+        boundaries = np.flatnonzero((s[1:] != s[:-1]) | (o[1:] != o[:-1]) | (b[1:] != b[:-1])) + 1
+        starts = [0, *boundaries.tolist()]
+        ends = [*boundaries.tolist(), len(s)]
+        r = r.tolist()
+        for start, end in zip(starts, ends):
+            yield int(s[start]), int(o[start]), [(self.relation_names[r[k]], probs[k]) for k in range(start, end)]
+
+    # ------------ attributes ------------
+    def set_attribute(self, entity_index: int, attribute_name: str, prob: float) -> None:
+        column = self._attribute_index.get(attribute_name)
+        if column is None:
+            column = self._attribute_index[attribute_name] = len(self.attribute_names)
+            self.attribute_names.append(attribute_name)
+            self.attribute_probs = np.concatenate([self.attribute_probs, np.full((len(self), 1), np.nan)], axis=1)
+        self.attribute_probs[entity_index, column] = prob
+
+    def has_attribute(self, attribute_name: str) -> bool:
+        # the attribute is generated for all entities
+        column = self._attribute_index.get(attribute_name)
+        return column is not None and not np.isnan(self.attribute_probs[:, column]).any()
+
+    def attribute_rows(self) -> tuple[np.ndarray, np.ndarray]:
+        # the (entity, attribute) indices of all generated attribute facts, ordered by attribute
+        a, e = np.nonzero(~np.isnan(self.attribute_probs.T))
+        return e, a
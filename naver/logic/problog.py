@@ -1,13 +1,21 @@
 import logging
+import uuid
+from pathlib import Path
+from typing import AsyncIterator
+
 import tensorneko_util as N
 
-from hydra_vl4ai.agent.llm import llm, llm_with_message
 from hydra_vl4ai.util.config import Config
 from hydra_vl4ai.util.console import logger
+from problog.logic import Term
 from problog.program import PrologString
 from problog import get_evaluatable
 
 from ._base import BaseLogicModel
+from .prompt_encoding import encode_context
+from .template_cache import get_logic_template_cache, query_signature
+from ..utils.llm_memo import llm, llm_with_message
+from ..utils.llm_stream import llm_stream_with_message
 from ..context.entity import Entity
 from ..context.relation import GEOMETRY_RELATIONS, Relation
 from ..context.context import Context
@@ -17,19 +25,30 @@ logging.getLogger("problog").setLevel(logging.WARN)
 
 class ProbLogModel(BaseLogicModel):
 
-    def __init__(self) -> None:
+    def __init__(self, trace_folder: str | None = None) -> None:
         super().__init__()
+        # the executed programs are only written to disk if the trace folder is given
+        self.trace_folder = trace_folder if trace_folder is not None else Config.base_config.get("problog_trace_folder")
+        # the number of candidate programs requested in one generation, the candidates are evaluated together
+        self.num_candidates = Config.base_config.get("logic_num_candidates", 1)
 
     def context_to_problog(self, context: Context) -> str:
         # convert context to problog language
-        problog_rels = "\n".join(map(Entity.to_problog_rel, context.entities.values())) + "\n"
-        problog_rels += "\n".join(map(Relation.to_problog_rel, context.relations))
+        problog_rels = "\n".join(Entity.to_problog_rels(context.store)) + "\n"
+        problog_rels += "\n".join(Relation.to_problog_rels(context.store))
         context_facts = f"""{Entity.to_problog_type()}
 {Relation.to_problog_type()}
 
 {problog_rels}"""
         return context_facts
-        
+
+    def context_to_prompt(self, context: Context) -> str:
+        # the (possibly compacted) context facts shown to the LLM, configured by `logic_prompt_*`
+        mode = Config.base_config.get("logic_prompt_mode", "full")
+        if mode == "full":
+            return self.context_to_problog(context)
+        return encode_context(context.store, mode, Config.base_config.get("logic_prompt_relation_threshold"),
+                              Config.base_config.get("logic_prompt_relation_top_k"))
 
     async def generate(self, context: Context, query: str, interested_entities: list[str], 
                        overwrite_feedback: str | None = None, previous_response: str | None = None) -> tuple[str, str]:
@@ -37,11 +56,21 @@ class ProbLogModel(BaseLogicModel):
         
         # generate prompt
         assert (previous_response is None) == (overwrite_feedback is None), "Both previous_response and overwrite_feedback should be None or not None."
+        template_cache = get_logic_template_cache()
+        signature = query_signature(query, interested_entities) if template_cache is not None else None
         if previous_response is None:
-            prompt = gen_prompt_problog_query(context_facts, query, interested_entities)
+            # reuse the rule generated for a query with the same signature
+            if template_cache is not None and (target_rule := template_cache.get(signature)) is not None:
+                logger.debug(f"ProbLog Code Template: \n{target_rule}")
+                return f"```problog\n{target_rule}\n```", context_facts
+            prompt = gen_prompt_problog_query(self.context_to_prompt(context), query, interested_entities, self.num_candidates)
             response = await llm(Config.base_config["llm_code_model"], prompt)
+            if template_cache is not None and response is not None:
+                template_cache.put(signature, extract_problog_code(response))
         else:
-            previous_prompt = gen_prompt_problog_query(context_facts, query, interested_entities)
+            if template_cache is not None:
+                template_cache.invalidate(signature)
+            previous_prompt = gen_prompt_problog_query(self.context_to_prompt(context), query, interested_entities, self.num_candidates)
             response = await llm_with_message(Config.base_config["llm_code_model"], 
                 [
                     {"role": "user", "content": previous_prompt}, 
@@ -55,15 +84,77 @@ class ProbLogModel(BaseLogicModel):
         
         return response, context_facts
 
-    def execute(self, code: str) -> dict[str, float]:
+    async def generate_stream(self, context: Context, query: str, interested_entities: list[str],
+                              overwrite_feedback: str | None = None, previous_response: str | None = None) -> AsyncIterator[str]:
+        # streaming variant of `generate`, yields the response text as it arrives
+        assert (previous_response is None) == (overwrite_feedback is None), "Both previous_response and overwrite_feedback should be None or not None."
+        template_cache = get_logic_template_cache()
+        signature = query_signature(query, interested_entities) if template_cache is not None else None
+        prompt = gen_prompt_problog_query(self.context_to_prompt(context), query, interested_entities, self.num_candidates)
+        if previous_response is None:
+            if template_cache is not None and (target_rule := template_cache.get(signature)) is not None:
+                logger.debug(f"ProbLog Code Template: \n{target_rule}")
+                yield f"```problog\n{target_rule}\n```"
+                return
+            messages = [{"role": "user", "content": prompt}]
+        else:
+            if template_cache is not None:
+                template_cache.invalidate(signature)
+            messages = [
+                {"role": "user", "content": prompt},
+                {"role": "assistant", "content": previous_response},
+                {"role": "user", "content": overwrite_feedback}
+            ]
+
+        chunks = []
+        async for delta in llm_stream_with_message(Config.base_config["llm_code_model"], messages):
+            chunks.append(delta)
+            yield delta
+        response = "".join(chunks)
+        logger.debug(f"ProbLog Code Generator: \n{response}")
+        if previous_response is None and template_cache is not None and response:
+            template_cache.put(signature, extract_problog_code(response))
+
+    def execute(self, code: str, trace_name: str | None = None) -> dict[str, float]:
         code = f"{code}\nquery(target(ID))."
+        self._trace(code, trace_name)
         model = PrologString(code)
-        N.io.write.text("main_demo.pl", code)
         result = get_evaluatable().create_from(model).evaluate()
-        return dict([(str(k.args[0]).strip('"'), v) for k, v in result.items() if v > 0])
+        return _to_targets(result)
+
+    def _trace(self, code: str, trace_name: str | None) -> None:
+        if self.trace_folder is None:
+            return
+        path = Path(self.trace_folder) / f"{trace_name or uuid.uuid4().hex}.pl"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        N.io.write.text(str(path), code)
+
+
+def extract_problog_code(response: str) -> str:
+    # match the code within the response ```problog ... ```
+    try:
+        return response.split("```problog")[1].split("```")[0].strip()
+    except IndexError:
+        return response
+
+
+def extract_problog_codes(response: str) -> list[str]:
+    # all candidate codes within the ```problog ... ``` blocks of the response, in order
+    codes = [block.split("```")[0].strip() for block in response.split("```problog")[1:]]
+    codes = [*dict.fromkeys(code for code in codes if code)]
+    return codes if len(codes) > 0 else [response]
+
+
+def _to_targets(result: dict[Term, float]) -> dict[str, float]:
+    return dict([(str(k.args[0]).strip('"'), v) for k, v in result.items() if v > 0])
 
 
-def gen_prompt_problog_query(problog_code: str, query: str, interested_entities: list[str]) -> str:
+def gen_prompt_problog_query(problog_code: str, query: str, interested_entities: list[str], num_candidates: int = 1) -> str:
+    if num_candidates > 1:
+        output_instruction = (f"Your output should be {num_candidates} different candidate ProbLog codes, each in a separate "
+                              "```problog block, ordered from the most likely to the least likely.")
+    else:
+        output_instruction = "Your output should be the ProbLog code."
     prompt = f"""You're an AI assistant designed to generate the ProbLog code (a logic programming language similar to Prolog). 
 
 You need to generate a new rule "target" that will be used to query the target objects in the image based on given text prompt.
@@ -105,7 +196,7 @@ Complete the following ProbLog code:
 {problog_code}
 ```
 
-Your output should be the ProbLog code.
+{output_instruction}
 
 find the target "{query}"
 Your answer: """
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import re
+
+# the complete attribute(X, "name") and relation(X, Y, "name") atoms in the streamed code
+_PREDICATE_PATTERN = re.compile(r'\b(attribute)\(\s*[^,()"]+,\s*"([^"]+)"\s*\)|\b(relation)\(\s*[^,()"]+,\s*[^,()"]+,\s*"([^"]+)"\s*\)')
+
+
+class ProbLogStreamParser:
+    """Incremental parser of the streamed code generation response.
+
+    `feed` returns the events found in the new text:
+    - ("attribute", name) and ("relation", name) for each new predicate literal in a ```problog block.
+    - ("code", code) when a ```problog block is closed.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.codes: list[str] = []
+        self._predicates: set[tuple[str, str]] = set()
+
+    def feed(self, delta: str) -> list[tuple[str, str]]:
+        self.text += delta
+        events = []
+        blocks = self.text.split("```problog")[1:]
+        for i, block in enumerate(blocks):
+            closed = "```" in block
+            code = block.split("```")[0]
+            for match in _PREDICATE_PATTERN.finditer(code):
+                predicate = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+                if predicate not in self._predicates:
+                    self._predicates.add(predicate)
+                    events.append(predicate)
+            if closed and i >= len(self.codes):
+                self.codes.append(code.strip())
+                events.append(("code", self.codes[-1]))
+        return events
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from typing import Literal
+
+import numpy as np
+
+from ..context.entity import Entity
+from ..context.relation import Relation
+from ..context.store import ContextStore
+
+PromptMode = Literal["full", "filtered", "table", "summary"]
+PROMPT_MODES: tuple[PromptMode, ...] = ("full", "filtered", "table", "summary")
+
+
+def select_relation_rows(
+    store: ContextStore,
+    threshold: float | None = None,
+    top_k: int | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """The (subject, object, relation, prob) of the relation facts kept in the prompt, in the generation order.
+
+    The facts below the probability `threshold` are dropped, then only the `top_k` most probable relations
+    of each ordered entity pair are kept.
+    """
+    s, o, r = store.relation_rows()
+    p = store.relation_probs[s, o, r]
+    keep = np.ones(len(s), dtype=bool) if threshold is None else p >= threshold
+    if top_k is not None and keep.any():
+        index = np.flatnonzero(keep)
+        # sort by pair, then by descending probability, and rank the facts within each pair
+        order = index[np.lexsort((-p[index], o[index], s[index]))]
+        new_pair = np.r_[True, (s[order][1:] != s[order][:-1]) | (o[order][1:] != o[order][:-1])]
+        group_start = np.maximum.accumulate(np.where(new_pair, np.arange(len(order)), 0))
+        rank = np.arange(len(order)) - group_start
+        keep = np.zeros(len(s), dtype=bool)
+        keep[order[rank < top_k]] = True
+    return s[keep], o[keep], r[keep], p[keep]
+
+
+def encode_context(
+    store: ContextStore,
+    mode: PromptMode = "full",
+    relation_threshold: float | None = None,
+    relation_top_k: int | None = None
+) -> str:
+    """Encode the context facts for the code generation prompt.
+
+    - full: all entity and relation facts in ProbLog, the same as `ProbLogModel.context_to_problog`.
+    - filtered: the ProbLog facts with the relations filtered by `relation_threshold` and `relation_top_k`.
+    - table: the entities and the filtered relations of each pair as one table row in ProbLog comments.
+    - summary: the entity ids of each category and the relation names, without the relation facts.
+
+    The facts used in the reasoning are not affected, only the prompt is compacted.
+    """
+    header = f"{Entity.to_problog_type()}\n{Relation.to_problog_type()}\n\n"
+    match mode:
+        case "full":
+            facts = "\n".join(Entity.to_problog_rels(store)) + "\n" + "\n".join(Relation.to_problog_rels(store))
+        case "filtered":
+            facts = "\n".join([*Entity.to_problog_rels(store), *_filtered_problog_rels(store, relation_threshold, relation_top_k)])
+        case "table":
+            facts = _table(store, relation_threshold, relation_top_k)
+        case "summary":
+            facts = _summary(store)
+        case _:
+            raise ValueError(f"Unknown prompt mode {mode}, should be one of {PROMPT_MODES}.")
+    return header + facts
+
+
+def _filtered_problog_rels(store: ContextStore, threshold: float | None, top_k: int | None) -> list[str]:
+    s, o, r, p = select_relation_rows(store, threshold, top_k)
+    ids = np.array(store.ids, dtype=object)
+    names = np.array(store.relation_names, dtype=object)
+    return [f"""{prob:.2f}::relation("{subject_id}", "{object_id}", "{rel}")."""
+            for subject_id, object_id, rel, prob in zip(ids[s].tolist(), ids[o].tolist(), names[r].tolist(), p.tolist())]
+
+
+def _table(store: ContextStore, threshold: float | None, top_k: int | None) -> str:
+    lines = ["% entities: ID | category | x1 y1 x2 y2 | confidence"]
+    for entity_id, category, (x1, y1, x2, y2), conf in zip(
+        store.ids, store.entity_categories.tolist(), store.bboxes.tolist(), store.confidences.tolist()
+    ):
+        lines.append(f"% {entity_id} | {category} | {x1} {y1} {x2} {y2} | {conf:.2f}")
+
+    s, o, r, p = select_relation_rows(store, threshold, top_k)
+    if len(s) > 0:
+        lines.append("% relations: subject | object | relation_name:probability, ...")
+        pairs: dict[tuple[int, int], list[str]] = {}
+        for subject, obj, rel, prob in zip(s.tolist(), o.tolist(), r.tolist(), p.tolist()):
+            pairs.setdefault((subject, obj), []).append(f"{store.relation_names[rel]}:{prob:.2f}")
+        for (subject, obj), relations in pairs.items():
+            lines.append(f"% {store.ids[subject]} | {store.ids[obj]} | {', '.join(relations)}")
+    return "\n".join(lines)
+
+
+def _summary(store: ContextStore) -> str:
+    lines = ["% categories: category | number of entities | entity IDs"]
+    for category_id, category in enumerate(store.categories):
+        ids = [store.ids[i] for i in np.flatnonzero(store.category_ids == category_id)]
+        if len(ids) > 0:
+            lines.append(f"% {category} | {len(ids)} | {', '.join(ids)}")
+    if len(store.relation_names) > 0:
+        lines.append(f"% relation facts are given for every pair of entities with relation_name in {store.relation_names}")
+    if len(store.attribute_names) > 0:
+        lines.append(f"% attribute facts are given for attributes {store.attribute_names}")
+    return "\n".join(lines)
@@ -1,4 +1,8 @@
+import threading
+from collections import OrderedDict
+
 import scallopy
+from hydra_vl4ai.util.config import Config
 
 from ._base import BaseLogicModel
 from ..context.entity import Entity
@@ -8,13 +12,17 @@ from ..context.context import Context
 
 class ScallopModel(BaseLogicModel):
 
-    def __init__(self) -> None:
+    def __init__(self, cache_size: int | None = None) -> None:
         super().__init__()
+        # the number of contexts with the facts run for reuse, 0 means no caching
+        self.cache_size = cache_size if cache_size is not None else Config.base_config.get("scallop_facts_cache_size", 0)
+        self._facts_cache: OrderedDict[str, scallopy.ScallopContext] = OrderedDict()
+        self._facts_lock = threading.Lock()
 
     def context_to_scallop(self, context: Context) -> str:
         # convert context to scallop language
-        scallop_rels = "\n".join(map(Entity.to_scallop_rel, context.entities.values())) + "\n"
-        scallop_rels += "\n".join(map(Relation.to_scallop_rel, context.relations))
+        scallop_rels = "\n".join(Entity.to_scallop_rels(context.store)) + "\n"
+        scallop_rels += "\n".join(Relation.to_scallop_rels(context.store))
         context_facts = f"""{Entity.to_scallop_type()}
 {Relation.to_scallop_type()}
 
@@ -32,6 +40,32 @@ class ScallopModel(BaseLogicModel):
         except Exception as e:
             import pdb; pdb.set_trace()
         ctx.run()
-        result = list(ctx.relation("target"))
-        result_dict = {entity[0]: confidence for confidence, entity in result if confidence > 0.}
-        return result_dict
+        return _to_targets(ctx)
+
+    def execute_with_facts(self, context_facts: str, target_rule: str) -> dict[str, float]:
+        # same as `execute(f"{context_facts}\n{target_rule}")`, but the facts are compiled and run once, and each
+        # target rule is evaluated incrementally on a clone of the context with the facts
+        if self.cache_size <= 0:
+            return self.execute(f"{context_facts}\n{target_rule}")
+
+        # the candidates are executed in threads, so the cached contexts are only cloned under the lock
+        with self._facts_lock:
+            facts_ctx = self._facts_cache.get(context_facts)
+            if facts_ctx is None:
+                facts_ctx = scallopy.ScallopContext("topkproofs")
+                facts_ctx.add_program(context_facts)
+                facts_ctx.run()
+                self._facts_cache[context_facts] = facts_ctx
+                while len(self._facts_cache) > self.cache_size:
+                    self._facts_cache.popitem(last=False)
+            else:
+                self._facts_cache.move_to_end(context_facts)
+            ctx = facts_ctx.clone()
+        ctx.add_program(target_rule)
+        ctx.run()
+        return _to_targets(ctx)
+
+
+def _to_targets(ctx: scallopy.ScallopContext) -> dict[str, float]:
+    result = list(ctx.relation("target"))
+    return {entity[0]: confidence for confidence, entity in result if confidence > 0.}
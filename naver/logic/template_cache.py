@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from hydra_vl4ai.util.config import Config
+from hydra_vl4ai.util.console import logger
+
+from ..agent.logic_reasoning.problog2scallop import parse_problog_program
+from ..context.relation import GEOMETRY_RELATIONS
+from ..utils.misc import COLORS
+
+# the words replaced by attribute slots
+ATTRIBUTE_WORDS = frozenset([
+    *COLORS.keys(), "brown", "pink", "purple", "gray", "gold", "silver", "beige", "tan", "striped", "plaid",
+    "dark", "light",
+])
+
+# the words dropped from the query signature, the other words (e.g. spatial words) are kept as they are
+FILLER_WORDS = frozenset(["a", "an", "the", "on", "in", "at", "of", "to", "is", "that", "who", "which", "one"])
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_STRING_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+@dataclass(frozen=True)
+class QuerySignature:
+    key: tuple[str, ...]  # e.g. ("<category0>", "left") for both "person left" and "man on left"
+    categories: tuple[str, ...]  # the values of the category slots
+    attributes: tuple[str, ...]  # the values of the attribute slots
+
+    def slots(self) -> dict[str, str]:
+        slots = {f"<category{i}>": category for i, category in enumerate(self.categories)}
+        slots.update({f"<attribute{i}>": attribute for i, attribute in enumerate(self.attributes)})
+        return slots
+
+
+def query_signature(query: str, interested_entities: list[str]) -> QuerySignature:
+    text = " ".join(_WORD_PATTERN.findall(query.lower()))
+    # replace the entity categories mentioned in the query by slots, longest first for "hot dog" over "dog"
+    categories = []
+    for category in sorted(set(interested_entities), key=len, reverse=True):
+        pattern = re.compile(rf"\b{re.escape(category.lower())}\b")
+        if pattern.search(text) is not None:
+            text = pattern.sub(lambda _, index=len(categories): f" \0{index} ", text)
+            categories.append(category)
+
+    key = []
+    attributes = []
+    category_order: dict[int, int] = {}
+    for word in text.split():
+        if word.startswith("\0"):
+            # the category slots are numbered by the appearance order in the query
+            index = category_order.setdefault(int(word[1:]), len(category_order))
+            key.append(f"<category{index}>")
+        elif word in ATTRIBUTE_WORDS:
+            key.append(f"<attribute{len(attributes)}>")
+            attributes.append(word)
+        elif word not in FILLER_WORDS:
+            key.append(word)
+    ordered_categories = [""] * len(category_order)
+    for original, index in category_order.items():
+        ordered_categories[index] = categories[original]
+    return QuerySignature(tuple(key), tuple(ordered_categories), tuple(attributes))
+
+
+def abstract_rule(rule: str, signature: QuerySignature) -> str | None:
+    """Replace the category and attribute literals in the rule by the slots of the query signature.
+
+    Returns None if the rule uses a string literal which is neither a slot value nor a relation name,
+    because such a rule cannot be reused for other queries.
+    """
+    try:
+        parse_problog_program(rule)
+    except ValueError:
+        return None
+    values = {value.lower(): slot for slot, value in signature.slots().items()}
+    if len(values) != len(signature.categories) + len(signature.attributes):
+        # the same word fills two slots, it is ambiguous which one the literal refers to
+        return None
+
+    reusable = True
+
+    def replace(match: re.Match) -> str:
+        nonlocal reusable
+        literal = match.group(1)
+        if literal.lower() in values:
+            return f'"{values[literal.lower()]}"'
+        if literal not in GEOMETRY_RELATIONS:
+            reusable = False
+        return match.group()
+
+    template = _STRING_PATTERN.sub(replace, rule)
+    return template if reusable else None
+
+
+def instantiate_rule(template: str, signature: QuerySignature) -> str:
+    slots = signature.slots()
+    return _STRING_PATTERN.sub(lambda match: f'"{slots.get(match.group(1), match.group(1))}"', template)
+
+
+class LogicTemplateCache:
+    """In-memory LRU cache of the generated target rules, abstracted over the category and attribute literals.
+
+    The rules are indexed by the query signature, so "person left" and "man on left" share the same template.
+    """
+
+    def __init__(self, max_size: int = 1024) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._templates: OrderedDict[tuple[str, ...], str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, signature: QuerySignature) -> str | None:
+        with self._lock:
+            template = self._templates.get(signature.key)
+            if template is None:
+                self.misses += 1
+                return None
+            self._templates.move_to_end(signature.key)
+            self.hits += 1
+        return instantiate_rule(template, signature)
+
+    def put(self, signature: QuerySignature, rule: str) -> bool:
+        template = abstract_rule(rule, signature)
+        if template is None:
+            return False
+        with self._lock:
+            self._templates[signature.key] = template
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        logger.debug(f"Logic Template Cached: {signature.key} -> {template}")
+        return True
+
+    def invalidate(self, signature: QuerySignature) -> None:
+        # the template failed the reasoning of a query, so it is generated again by the LLM next time
+        with self._lock:
+            self._templates.pop(signature.key, None)
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    @property
+    def stats(self) -> str:
+        return f"Template Hits: {self.hits}, Template Misses: {self.misses}, Templates: {len(self)}"
+
+
+_template_cache: LogicTemplateCache | None = None
+_template_cache_lock = threading.Lock()
+
+
+def get_logic_template_cache() -> LogicTemplateCache | None:
+    # the template cache is enabled by setting `logic_template_cache_size` in the base config
+    global _template_cache
+    max_size = Config.base_config.get("logic_template_cache_size")
+    if not max_size:
+        return None
+    with _template_cache_lock:
+        if _template_cache is None:
+            _template_cache = LogicTemplateCache(max_size)
+    return _template_cache
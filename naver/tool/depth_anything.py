@@ -1,25 +1,78 @@
-import torch
+import threading
+from concurrent.futures import Future
+
 import numpy as np
 from hydra_vl4ai.tool import module_registry, BaseModel
 import torch
+import torch.nn.functional as F
 from transformers import pipeline
 from torchvision.transforms import functional as T
 
+from ..utils.accounting import track_gpu_time
+
 
 @module_registry.register("depth_anything_v2")
 class DepthAnythingV2(BaseModel):
+    max_batch_size = 8
+
     def __init__(self, gpu_number=0):
         super().__init__(gpu_number)
         # Model options: MiDaS_small, DPT_Hybrid, DPT_Large
         self.pipe = pipeline(task="depth-estimation", model="depth-anything/Depth-Anything-V2-Large-hf", device=f"cuda:{gpu_number}")
+        self.model = self.pipe.model
+        self.processor = self.pipe.image_processor
+        # the images of the concurrent calls, run together in the next batch
+        self._pending: list[tuple[torch.Tensor | np.ndarray, Future]] = []
+        self._pending_lock = threading.Lock()
+        self._run_lock = threading.Lock()
 
     @torch.no_grad()
-    def forward(self, image: torch.Tensor):
+    @track_gpu_time("depth_anything_v2")
+    def forward(self, image: torch.Tensor | np.ndarray) -> np.ndarray:
         """Estimate depth map"""
-        image = T.to_pil_image(image)
-        prediction = np.array(self.pipe(image)["depth"])
-        return 1 - prediction / 255
-    
+        future = Future()
+        with self._pending_lock:
+            self._pending.append((image, future))
+        # the caller getting the model runs all pending images in one batch, the others wait for their results
+        with self._run_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if len(batch) > 0:
+                try:
+                    depths = self.forward_batch([image for image, _ in batch])
+                except BaseException as e:
+                    for _, pending in batch:
+                        pending.set_exception(e)
+                else:
+                    for (_, pending), depth in zip(batch, depths):
+                        pending.set_result(depth)
+        return future.result()
+
+    @torch.no_grad()
+    @track_gpu_time("depth_anything_v2")
+    def forward_batch(self, images: list[torch.Tensor | np.ndarray]) -> list[np.ndarray]:
+        """Estimate the float32 depth maps of the images, 0 means close and 1 means most far."""
+        images = [T.to_pil_image(image) for image in images]
+        pixel_values = [self.processor(images=image, return_tensors="pt")["pixel_values"] for image in images]
+        # the processor keeps the aspect ratio, so the images resized to the same shape are batched together
+        groups: dict[tuple[int, ...], list[int]] = {}
+        for i, values in enumerate(pixel_values):
+            groups.setdefault(tuple(values.shape[-2:]), []).append(i)
+
+        depths: list[np.ndarray | None] = [None] * len(images)
+        for indices in groups.values():
+            for start in range(0, len(indices), self.max_batch_size):
+                chunk = indices[start:start + self.max_batch_size]
+                inputs = torch.cat([pixel_values[i] for i in chunk]).to(self.model.device, self.model.dtype)
+                predicted_depth = self.model(pixel_values=inputs).predicted_depth
+                for i, prediction in zip(chunk, predicted_depth):
+                    # the same normalization as the pipeline output, without the 8-bit quantization
+                    prediction = F.interpolate(prediction[None, None].float(), size=images[i].size[::-1],
+                                               mode="bicubic", align_corners=False)[0, 0]
+                    prediction = (prediction / prediction.max()).clamp(0, 1)
+                    depths[i] = (1 - prediction).cpu().numpy().astype(np.float32)
+        return depths
+
     @classmethod
     def prepare(cls):
         """Download the model"""
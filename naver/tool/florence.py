@@ -1,7 +1,6 @@
 import numpy as np
 import torch
 
-from hydra_vl4ai.util.config import Config
 from hydra_vl4ai.util.console import logger
 from hydra_vl4ai.util.misc import get_root_folder
 from hydra_vl4ai.tool._base import BaseModel, module_registry
@@ -9,6 +8,9 @@ import tensorneko_util as N
 from PIL import Image
 from torchvision.ops import box_convert
 from transformers import AutoProcessor, AutoModelForCausalLM
+
+from ..utils.accounting import track_gpu_time
+from ..utils.config_overlay import get_config
         
 
 @module_registry.register("florence2")
@@ -25,34 +27,43 @@ class Florence2(BaseModel):
         self.task_prompt = '<OPEN_VOCABULARY_DETECTION>'
         
     @torch.no_grad()
+    @track_gpu_time("florence2")
     def forward(self, input_image, grounding_caption, box_threshold=None, text_threshold=0.25):
-        if box_threshold is None:
-            box_threshold = Config.base_config["florence2_threshold"]
-        input_image = np.asarray(input_image.permute(1,2,0)*255, dtype=np.uint8)
+        return self.forward_batch([input_image], grounding_caption, box_threshold, text_threshold)[0]
 
-        img_pil = Image.fromarray(input_image)
-        re_width, re_height = img_pil.size
+    @torch.no_grad()
+    @track_gpu_time("florence2")
+    def forward_batch(self, input_images, grounding_caption, box_threshold=None, text_threshold=0.25):
+        # the images are detected with the same caption, so the prompts have the same length and need no padding
+        if box_threshold is None:
+            box_threshold = get_config("florence2_threshold")
+        img_pils = [Image.fromarray(np.asarray(input_image.permute(1,2,0)*255, dtype=np.uint8)) for input_image in input_images]
 
         prompt = self.task_prompt + grounding_caption
 
-        inputs = self.processor(text=prompt, images=img_pil, return_tensors="pt").to(self.device, self.torch_dtype)
+        inputs = self.processor(text=[prompt] * len(img_pils), images=img_pils, return_tensors="pt").to(self.device, self.torch_dtype)
         generated_ids = self.model.generate(
             input_ids=inputs["input_ids"],
             pixel_values=inputs["pixel_values"],
             max_new_tokens=1024,
             num_beams=3
         )
-        generated_text = self.processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
-        parsed_answer = self.processor.post_process_generation(generated_text, task=self.task_prompt, image_size=(re_width, re_height))
-
-        # transfer boxes to sam-format 
-        transfered_boxes = np.array(parsed_answer[self.task_prompt]["bboxes"])
-        transfered_boxes = transfered_boxes.reshape(transfered_boxes.shape[0], 4)[:,[0,3,2,1]]
-        transfered_boxes[:,1] = re_height - transfered_boxes[:,1]
-        transfered_boxes[:,3] = re_height - transfered_boxes[:,3]
-        
-        confidences = torch.ones(len(transfered_boxes))  # confidence is not provided by the model
-        return np.concatenate([transfered_boxes, confidences[:, None].numpy()], axis=1)
+        generated_texts = self.processor.batch_decode(generated_ids, skip_special_tokens=False)
+
+        results = []
+        for img_pil, generated_text in zip(img_pils, generated_texts):
+            re_width, re_height = img_pil.size
+            parsed_answer = self.processor.post_process_generation(generated_text, task=self.task_prompt, image_size=(re_width, re_height))
+
+            # transfer boxes to sam-format 
+            transfered_boxes = np.array(parsed_answer[self.task_prompt]["bboxes"])
+            transfered_boxes = transfered_boxes.reshape(transfered_boxes.shape[0], 4)[:,[0,3,2,1]]
+            transfered_boxes[:,1] = re_height - transfered_boxes[:,1]
+            transfered_boxes[:,3] = re_height - transfered_boxes[:,3]
+
+            confidences = torch.ones(len(transfered_boxes))  # confidence is not provided by the model
+            results.append(np.concatenate([transfered_boxes, confidences[:, None].numpy()], axis=1))
+        return results
     
     @classmethod
     def prepare(cls):
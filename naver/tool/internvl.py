@@ -9,6 +9,8 @@ from huggingface_hub import snapshot_download
 from hydra_vl4ai.util.misc import get_root_folder
 from hydra_vl4ai.tool._base import BaseModel, module_registry
 
+from ..utils.accounting import track_gpu_time
+
 
 IMAGENET_MEAN = (0.485, 0.456, 0.406)
 IMAGENET_STD = (0.229, 0.224, 0.225)
@@ -34,11 +36,13 @@ class InternVL2(BaseModel):
         self.tokenizer = AutoTokenizer.from_pretrained(path, trust_remote_code=True, use_fast=False)
         self.generation_config = dict(max_new_tokens=1024, do_sample=False)
 
+    @track_gpu_time("internvl2")
     def forward(self, input_image, query, *_, **__):
         pixel_values = load_image(input_image).to(torch.bfloat16).cuda(self.dev)
         return self.chat(self.tokenizer, pixel_values, query, self.generation_config)
     
     @torch.no_grad()
+    @track_gpu_time("internvl2")
     def forward_next_word_prediction(self, input_image, query, alternatives: list[str]):
         pixel_values = load_image(input_image).to(torch.bfloat16).cuda(self.dev)
         return self.get_next_word_prediction(self.tokenizer, pixel_values, query, self.generation_config, alternatives)
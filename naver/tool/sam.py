@@ -1,3 +1,8 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
 import numpy as np
 from hydra_vl4ai.util.misc import get_root_folder
 from hydra_vl4ai.tool import module_registry, BaseModel
@@ -5,6 +10,8 @@ from segment_anything import sam_model_registry, SamPredictor
 import torch
 import tensorneko_util as N
 
+from ..utils.accounting import track_gpu_time
+
 
 @module_registry.register("sam")
 class Sam(BaseModel):
@@ -16,8 +23,73 @@ class Sam(BaseModel):
             self.prepare()
         self.model = sam_model_registry["vit_h"](checkpoint=str(path))
         self.model.eval().to(self.dev)
+        # the image embeddings of the recent images without a session, shared by all boxes prompted on the same image
+        self._predictors: OrderedDict[tuple, SamPredictor] = OrderedDict()
+        self._predictors_size = 4
+        # the predictors attached to the image arrays of the sessions, by the array identity
+        self._attached: dict[int, SamPredictor] = {}
+        self._lock = threading.Lock()
+
+    @torch.no_grad()
+    @track_gpu_time("sam")
+    def new_predictor(self, image: np.ndarray) -> SamPredictor:
+        predictor = SamPredictor(self.model)
+        predictor.set_image(image)
+        return predictor
+
+    @torch.no_grad()
+    def set_image(self, image: np.ndarray) -> SamPredictor:
+        key = _image_key(image)
+        with self._lock:
+            predictor = self._predictors.get(key)
+            if predictor is None:
+                predictor = self.new_predictor(image)
+                self._predictors[key] = predictor
+                while len(self._predictors) > self._predictors_size:
+                    self._predictors.popitem(last=False)
+            else:
+                self._predictors.move_to_end(key)
+        return predictor
+
+    def attach(self, image: np.ndarray, predictor: SamPredictor) -> None:
+        # the masks of this image array use the predictor without hashing the image, until the array is released.
+        # so the predictor of a session is never evicted by the other images in flight
+        # no lock here, the finalizer can run in any thread during the garbage collection
+        key = id(image)
+        self._attached[key] = predictor
+        weakref.finalize(image, self._attached.pop, key, None)
+
+    def predictor(self, image: np.ndarray) -> SamPredictor:
+        predictor = self._attached.get(id(image))
+        return predictor if predictor is not None else self.set_image(image)
 
     @torch.no_grad()
+    @track_gpu_time("sam")
+    def embed_batch(self, images: list[np.ndarray]) -> list[dict]:
+        # the image embeddings of several images in one encoder batch, as set by `SamPredictor.set_image`
+        predictor = SamPredictor(self.model)
+        inputs, input_sizes = [], []
+        for image in images:
+            input_image = predictor.transform.apply_image(image)
+            input_image = torch.as_tensor(input_image, device=self.dev).permute(2, 0, 1).contiguous()[None]
+            inputs.append(self.model.preprocess(input_image))
+            input_sizes.append(tuple(input_image.shape[-2:]))
+        features = self.model.image_encoder(torch.cat(inputs))
+        return [{"features": features[i:i + 1], "original_size": image.shape[:2], "input_size": input_size}
+                for i, (image, input_size) in enumerate(zip(images, input_sizes))]
+
+    @torch.no_grad()
+    def predictor_from_embedding(self, embedding: dict) -> SamPredictor:
+        # the predictor of a precomputed embedding of `embed_batch`, without running the encoder
+        predictor = SamPredictor(self.model)
+        predictor.features = torch.as_tensor(embedding["features"], device=self.dev, dtype=torch.float32)
+        predictor.original_size = tuple(int(size) for size in embedding["original_size"])
+        predictor.input_size = tuple(int(size) for size in embedding["input_size"])
+        predictor.is_image_set = True
+        return predictor
+
+    @torch.no_grad()
+    @track_gpu_time("sam")
     def forward(self, image: np.ndarray, bbox, use_image_patch_coord: bool = True) -> np.ndarray:
         left, lower, right, upper = bbox[:4]
         x0 = left
@@ -30,8 +102,7 @@ class Sam(BaseModel):
             y1 = upper
         bbox = [x0, y0, x1, y1]
 
-        predictor = SamPredictor(self.model)
-        predictor.set_image(image)
+        predictor = self.predictor(image)
         masks, scores, _ = predictor.predict(
             box=np.array(bbox)
         )
@@ -43,3 +114,8 @@ class Sam(BaseModel):
         path = get_root_folder() / "pretrained_models" / "sam"
         if not (path / "sam_vit_h_4b8939.pth").exists():
             N.util.download_file("https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth", str(path))
+
+
+def _image_key(image: np.ndarray) -> tuple:
+    image = np.ascontiguousarray(image)
+    return image.shape, image.dtype.str, hashlib.blake2b(image.data, digest_size=16).hexdigest()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+
+from hydra_vl4ai.agent.llm import Cost
+
+from .profiling import profiler
+
+
+@dataclass
+class Usage:
+    """The cost, tokens, API latency and GPU time used by one request (e.g. one `Naver.run`)."""
+    cost: float = 0.
+    input_tokens: int = 0
+    output_tokens: int = 0
+    llm_calls: int = 0
+    llm_latency: float = 0.  # seconds waiting for the LLM APIs
+    gpu_time: float = 0.  # seconds in the GPU tools
+    gpu_calls: dict[str, int] = field(default_factory=dict)
+    memo_hits: int = 0  # the LLM responses served by the memo
+    memo_misses: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add_tokens(self, cost: float, input_tokens: int, output_tokens: int) -> None:
+        with self._lock:
+            self.cost += cost
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def add_llm_call(self, latency: float) -> None:
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_latency += latency
+
+    def add_memo_lookup(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.memo_hits += 1
+            else:
+                self.memo_misses += 1
+
+    def add_gpu_call(self, tool: str, latency: float) -> None:
+        with self._lock:
+            self.gpu_time += latency
+            self.gpu_calls[tool] = self.gpu_calls.get(tool, 0) + 1
+
+    def to_dict(self) -> dict:
+        return {
+            "cost": self.cost,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "llm_calls": self.llm_calls,
+            "llm_latency": self.llm_latency,
+            "gpu_time": self.gpu_time,
+            "gpu_calls": dict(self.gpu_calls),
+            "memo_hits": self.memo_hits,
+            "memo_misses": self.memo_misses,
+        }
+
+    def __str__(self) -> str:
+        return (f"Cost: {self.cost:.5f}, Input Tokens: {self.input_tokens}, Output Tokens: {self.output_tokens}, "
+                f"LLM Calls: {self.llm_calls}, LLM Latency: {self.llm_latency:.2f}s, GPU Time: {self.gpu_time:.2f}s, "
+                f"Memo Hits: {self.memo_hits}, Memo Misses: {self.memo_misses}")
+
+
+# the usage of the current request. the asyncio tasks and `asyncio.to_thread` copy the context,
+# so all LLM and tool calls made for the request are recorded into the same object.
+_current_usage: ContextVar[Usage | None] = ContextVar("naver_usage", default=None)
+_in_gpu_call: ContextVar[bool] = ContextVar("naver_in_gpu_call", default=False)
+
+
+def current_usage() -> Usage | None:
+    return _current_usage.get()
+
+
+@contextmanager
+def track_usage() -> Iterator[Usage]:
+    _install_cost_hook()
+    usage = Usage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+@contextmanager
+def track_llm_call() -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        if (usage := _current_usage.get()) is not None:
+            usage.add_llm_call(end - start)
+        if profiler.enabled:
+            profiler.record("llm", "llm", start, end)
+
+
+def track_gpu_time(tool: str) -> Callable:
+    # decorator for the forward methods of the GPU tools, the nested tool calls are counted once
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            usage = _current_usage.get()
+            if _in_gpu_call.get() or (usage is None and not profiler.enabled):
+                return fn(*args, **kwargs)
+            token = _in_gpu_call.set(True)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _in_gpu_call.reset(token)
+                end = time.perf_counter()
+                if usage is not None:
+                    usage.add_gpu_call(tool, end - start)
+                if profiler.enabled:
+                    profiler.record(tool, "tool", start, end, {"gpu_time": end - start})
+        return wrapper
+    return decorator
+
+
+_cost_hook_lock = threading.Lock()
+
+
+def _install_cost_hook() -> None:
+    # hydra accumulates the tokens in the process-global `Cost`, which is updated synchronously right after
+    # each API response in the calling task, so the increments are also recorded into the current usage.
+    with _cost_hook_lock:
+        if getattr(Cost, "_naver_hooked", False):
+            return
+        add = Cost.add
+
+        def add_with_usage(response, model_name):
+            cost, input_tokens, output_tokens = Cost.cost, Cost.input_tokens, Cost.output_tokens
+            add(response, model_name)
+            if (usage := _current_usage.get()) is not None:
+                usage.add_tokens(Cost.cost - cost, Cost.input_tokens - input_tokens, Cost.output_tokens - output_tokens)
+
+        Cost.add = add_with_usage
+        Cost._naver_hooked = True
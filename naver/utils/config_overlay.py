@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+from hydra_vl4ai.util.config import Config
+
+_MISSING = object()
+
+# the request-scoped overrides of the base config. the asyncio tasks and `asyncio.to_thread` copy the context,
+# so an override is seen by all calls made within the `config_overlay` block, and by nothing else.
+_overlay: ContextVar[dict[str, Any]] = ContextVar("naver_config_overlay", default={})
+
+
+def get_config(key: str, default: Any = _MISSING) -> Any:
+    # read the base config with the request-scoped overrides applied, use it instead of `Config.base_config[key]`
+    # for the values which may be overridden per call
+    overlay = _overlay.get()
+    if key in overlay:
+        return overlay[key]
+    if default is _MISSING:
+        return Config.base_config[key]
+    return Config.base_config.get(key, default)
+
+
+@contextmanager
+def config_overlay(**overrides: Any) -> Iterator[None]:
+    """Override the base config values for the calls within the block, without modifying the global config.
+
+    For example, `with config_overlay(florence2_threshold=0.1): image_patch.find([...])`.
+    """
+    token = _overlay.set({**_overlay.get(), **overrides})
+    try:
+        yield
+    finally:
+        _overlay.reset(token)
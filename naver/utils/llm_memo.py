@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Literal
+
+from hydra_vl4ai.agent.llm import llm_with_message as _llm_with_message
+from hydra_vl4ai.util.config import Config
+from hydra_vl4ai.util.console import logger
+
+from .accounting import current_usage, track_llm_call
+
+
+class LLMMemo:
+    """Persistent SQLite memoization of the LLM responses, keyed by the model and the normalized messages.
+
+    The database runs in WAL mode, so multiple agents (threads or processes) can read and write it concurrently.
+    """
+
+    def __init__(self, path: str, ttl: float | None = None, max_entries: int | None = None) -> None:
+        self.path = path
+        self.ttl = ttl  # seconds, None means never expire
+        self.max_entries = max_entries  # None means no size limit
+        # the lookups of the process, the lookups of each request are recorded in its usage
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS llm_memo (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_memo_accessed_at ON llm_memo (accessed_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, sqlite connections cannot be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30., isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @staticmethod
+    def make_key(model_spec: str, messages: list[dict[str, str]], format: str = "") -> str:
+        normalized = [{"role": message["role"].strip().lower(), "content": message["content"].strip()} for message in messages]
+        payload = json.dumps([model_spec, format, normalized], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute("SELECT response, created_at FROM llm_memo WHERE key = ?", (key,)).fetchone()
+        if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+            conn.execute("DELETE FROM llm_memo WHERE key = ?", (key,))
+            row = None
+        if row is not None:
+            conn.execute("UPDATE llm_memo SET accessed_at = ? WHERE key = ?", (now, key))
+        self._record_lookup(row is not None)
+        return row[0] if row is not None else None
+
+    def _record_lookup(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if (usage := current_usage()) is not None:
+            usage.add_memo_lookup(hit)
+
+    def put(self, key: str, model_spec: str, response: str) -> None:
+        now = time.time()
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO llm_memo (key, model, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                     (key, model_spec, response, now, now))
+        if self.ttl is not None:
+            conn.execute("DELETE FROM llm_memo WHERE created_at < ?", (now - self.ttl,))
+        if self.max_entries is not None:
+            # evict the least recently used entries
+            conn.execute("""DELETE FROM llm_memo WHERE key IN (
+                SELECT key FROM llm_memo ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""", (self.max_entries,))
+
+    @property
+    def stats(self) -> str:
+        with self._stats_lock:
+            return f"Memo Hits: {self.hits}, Memo Misses: {self.misses}"
+
+
+_memo: LLMMemo | None = None
+_memo_lock = threading.Lock()
+
+
+def get_llm_memo() -> LLMMemo | None:
+    # the memo is enabled by setting `llm_memo_path` in the base config
+    global _memo
+    path = Config.base_config.get("llm_memo_path")
+    if path is None:
+        return None
+    with _memo_lock:
+        if _memo is None or _memo.path != path:
+            _memo = LLMMemo(path, Config.base_config.get("llm_memo_ttl"), Config.base_config.get("llm_memo_max_entries"))
+            logger.debug(f"LLM memo is enabled at {path}")
+    return _memo
+
+
+async def llm(model_spec: str, prompt: str, format: Literal["", "json"] = "") -> str | None:
+    return await llm_with_message(model_spec, [{"role": "user", "content": prompt}], format)
+
+
+async def llm_with_message(model_spec: str, messages: list[dict[str, str]], format: Literal["", "json"] = "") -> str | None:
+    memo = get_llm_memo()
+    if memo is None:
+        with track_llm_call():
+            return await _llm_with_message(model_spec, messages, format)
+
+    key = LLMMemo.make_key(model_spec, messages, format)
+    response = memo.get(key)
+    if response is not None:
+        return response
+    # the messages may be modified by the LLM client, so the key is computed before the call
+    with track_llm_call():
+        response = await _llm_with_message(model_spec, messages, format)
+    if response is not None:
+        memo.put(key, model_spec, response)
+    return response
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+from typing import AsyncIterator
+
+from openai import NOT_GIVEN
+
+from hydra_vl4ai.agent import llm as _llm
+from hydra_vl4ai.agent.llm import Cost, parse_model_name
+from hydra_vl4ai.util.console import logger
+
+from .accounting import track_llm_call
+from .llm_memo import LLMMemo, get_llm_memo
+
+
+async def llm_stream_with_message(model_spec: str, messages: list[dict[str, str]]) -> AsyncIterator[str]:
+    """Stream the LLM response as text deltas.
+
+    The OpenAI compatible APIs (openai and vllm) are streamed, the other APIs yield the full response at once.
+    The memoized responses are also yielded at once, and the streamed responses are memoized when complete.
+    """
+    api_type, model_name = parse_model_name(model_spec)
+    client = {"openai": _llm.openai_client, "vllm": _llm.vllm_client}.get(api_type)
+    memo = get_llm_memo()
+    key = LLMMemo.make_key(model_spec, messages) if memo is not None else None
+    if memo is not None and (response := memo.get(key)) is not None:
+        yield response
+        return
+
+    if client is None:
+        with track_llm_call():
+            response = await _llm.llm_with_message(model_spec, messages)
+        if response is not None:
+            if memo is not None:
+                memo.put(key, model_spec, response)
+            yield response
+        return
+
+    chunks = []
+    with track_llm_call():
+        async with _llm._semaphore:
+            stream = await _open_stream(client, api_type, model_name, messages)
+            if stream is None:
+                # the retries are exhausted, the same as the non-streaming call
+                return
+            async for chunk in stream:
+                if chunk.usage is not None and api_type == "openai":
+                    Cost.add(chunk, model_name)
+                if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunks[-1]
+    response = "".join(chunks)
+    logger.debug(f"Streamed Response: {response}")
+    if memo is not None and response:
+        memo.put(key, model_spec, response)
+
+
+@_llm.handle_openai_exceptions
+async def _open_stream(client, api_type: str, model_name: str, messages: list[dict[str, str]]):
+    # the same retry of the transient API errors as the non-streaming calls, before any delta is yielded
+    return await client.chat.completions.create(
+        model=model_name, messages=messages, stream=True,
+        stream_options={"include_usage": True} if api_type == "openai" else NOT_GIVEN
+    )
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+
+class Profiler:
+    """Records the spans of the automaton states, tool calls and LLM calls.
+
+    The spans are exported as Chrome trace JSON (viewable in Perfetto or chrome://tracing), where each request
+    is a process track, and summarized as latency statistics per span name.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._events: list[dict] = []
+        self._track_names: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._track_ids = itertools.count(1)
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def new_track(self, name: str) -> int:
+        track = next(self._track_ids)
+        with self._lock:
+            self._track_names[track] = name
+        return track
+
+    def record(self, name: str, category: str, start: float, end: float, args: dict | None = None) -> None:
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self._start) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": _current_track.get(),
+            "tid": threading.get_ident(),
+            "args": args or {},
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def export_chrome_trace(self, path: str | Path) -> None:
+        with self._lock:
+            metadata = [{"name": "process_name", "ph": "M", "pid": track, "args": {"name": name}}
+                        for track, name in self._track_names.items()]
+            events = metadata + list(self._events)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self) -> list[dict]:
+        # latency statistics (seconds) and a log2 histogram (milliseconds) for each (category, name)
+        with self._lock:
+            events = list(self._events)
+        groups: dict[tuple[str, str], list[dict]] = {}
+        for event in events:
+            groups.setdefault((event["cat"], event["name"]), []).append(event)
+        rows = []
+        for (category, name), group in sorted(groups.items()):
+            durations = np.array([event["dur"] for event in group]) / 1e6
+            gpu_times = [event["args"]["gpu_time"] for event in group if "gpu_time" in event["args"]]
+            buckets = np.floor(np.log2(np.maximum(durations * 1000, 1))).astype(int)
+            rows.append({
+                "category": category,
+                "name": name,
+                "count": len(durations),
+                "total": float(durations.sum()),
+                "mean": float(durations.mean()),
+                "p50": float(np.percentile(durations, 50)),
+                "p95": float(np.percentile(durations, 95)),
+                "max": float(durations.max()),
+                "gpu_time": float(sum(gpu_times)),
+                "histogram_ms": {f"<{2 ** (b + 1)}": int(c) for b, c in zip(*np.unique(buckets, return_counts=True))},
+            })
+        return rows
+
+    def format_summary(self) -> str:
+        lines = [f"{'category':<8} {'name':<24} {'count':>6} {'total(s)':>9} {'mean(s)':>8} {'p50(s)':>8} {'p95(s)':>8} {'max(s)':>8} {'gpu(s)':>8}"]
+        for row in self.summary():
+            lines.append(f"{row['category']:<8} {row['name']:<24} {row['count']:>6} {row['total']:>9.2f} {row['mean']:>8.3f} "
+                         f"{row['p50']:>8.3f} {row['p95']:>8.3f} {row['max']:>8.3f} {row['gpu_time']:>8.2f}")
+        return "\n".join(lines)
+
+
+profiler = Profiler()
+
+# the trace track (request) of the current context, inherited by the asyncio tasks and `asyncio.to_thread`
+_current_track: ContextVar[int] = ContextVar("naver_trace_track", default=0)
+
+
+@contextmanager
+def trace_track(name: str) -> Iterator[None]:
+    # put the spans within the block on a new track, e.g. one track for each `Naver.run`
+    if not profiler.enabled:
+        yield
+        return
+    token = _current_track.set(profiler.new_track(name))
+    try:
+        yield
+    finally:
+        _current_track.reset(token)
+
+
+@contextmanager
+def profile_span(name: str, category: str, **args) -> Iterator[None]:
+    """Record the wall time of the block. The GPU time and the tool calls within the block are added to the span
+    if the block runs in a request tracked by `track_usage`."""
+    if not profiler.enabled:
+        yield
+        return
+    from .accounting import current_usage
+    usage = current_usage()
+    gpu_time, gpu_calls = (usage.gpu_time, dict(usage.gpu_calls)) if usage is not None else (0., {})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        if usage is not None:
+            args["gpu_time"] = usage.gpu_time - gpu_time
+            args["tool_calls"] = {tool: count - gpu_calls.get(tool, 0) for tool, count in usage.gpu_calls.items()
+                                  if count > gpu_calls.get(tool, 0)}
+        profiler.record(name, category, start, end, args)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+# the result fields stored as columns, so the evaluation can query them directly. the full record is kept as json
+RESULT_COLUMNS = ("iou", "wall_time", "cost", "input_tokens", "output_tokens", "llm_calls", "llm_latency", "gpu_time")
+
+
+class ResultStore:
+    """Crash-safe SQLite store of the evaluation results, keyed by `datum_id`.
+
+    The completed data are looked up by the primary key, the results are written in batched transactions, and
+    the database runs in WAL mode, so multiple processes can write the same store concurrently.
+    """
+
+    def __init__(self, path: str | Path, batch_size: int = 1) -> None:
+        self.path = str(path)
+        self.batch_size = batch_size
+        self._pending: list[dict] = []
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30., isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # the committed transactions survive a power loss
+        self._conn.execute("PRAGMA synchronous=FULL")
+        columns = ", ".join(f"{column} REAL" for column in RESULT_COLUMNS)
+        # no type for datum_id, so the int and str ids of the datasets are both kept as is
+        self._conn.execute(f"""CREATE TABLE IF NOT EXISTS results (
+            datum_id PRIMARY KEY,
+            idx INTEGER,
+            success INTEGER NOT NULL,
+            {columns},
+            record TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_idx ON results (idx)")
+
+    def __contains__(self, datum_id: Any) -> bool:
+        with self._lock:
+            if any(record["datum_id"] == datum_id for record in self._pending):
+                return True
+            return self._conn.execute("SELECT 1 FROM results WHERE datum_id = ?", (datum_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] + len(self._pending)
+
+    def completed(self) -> set:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT datum_id FROM results")} | \
+                {record["datum_id"] for record in self._pending}
+
+    def add(self, record: dict, index: int | None = None) -> None:
+        # `index` is the position in the dataset, used to export the results in the dataset order
+        with self._lock:
+            self._pending.append({**record, "_idx": index})
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if len(self._pending) == 0:
+            return
+        now = time.time()
+        rows = []
+        for pending in self._pending:
+            record = {key: value for key, value in pending.items() if key != "_idx"}
+            rows.append((record["datum_id"], pending["_idx"], int(record.get("result") is not None),
+                         *[record.get(column) for column in RESULT_COLUMNS], json.dumps(record), now))
+        placeholders = ", ".join("?" * (len(RESULT_COLUMNS) + 5))
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(f"INSERT OR REPLACE INTO results VALUES ({placeholders})", rows)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._pending.clear()
+
+    def __iter__(self) -> Iterator[dict]:
+        # the results in the dataset order
+        for _, record in self.items():
+            yield record
+
+    def items(self) -> Iterator[tuple[int | None, dict]]:
+        # the dataset indices and the results
+        self.flush()
+        for index, record in self._conn.execute("SELECT idx, record FROM results ORDER BY idx, rowid").fetchall():
+            yield index, json.loads(record)
+
+    def import_jsonl(self, path: str | Path) -> int:
+        # import the results of the jsonl files written by the previous versions, the truncated lines are skipped
+        count = 0
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.add(record)
+                count += 1
+        self.flush()
+        return count
+
+    def export_jsonl(self, path: str | Path) -> None:
+        tmp_path = Path(f"{path}.tmp")
+        with open(tmp_path, "w") as f:
+            for record in self:
+                f.write(json.dumps(record) + "\n")
+        tmp_path.replace(path)
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self) -> ResultStore:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
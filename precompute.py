@@ -0,0 +1,129 @@
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+parser = argparse.ArgumentParser(description="Precompute the image-level perception artifacts of a dataset in GPU batches. "
+                                             "Set `perception_artifact_path` in the base config to use them in `main.py`.")
+parser.add_argument("--data_root", type=str, required=True)
+parser.add_argument("--base_config", type=str, required=True)
+parser.add_argument("--model_config", type=str, required=True)
+parser.add_argument("--output", type=str, default=None, help="The artifact store, default to `perception_artifact_path` in the base config.")
+parser.add_argument("--batch_size", type=int, default=8)
+parser.add_argument("--categories", type=str, nargs="*", default=None,
+                    help="The categories detected for every image. By default, the COCO categories and common object words mentioned in the queries of each image.")
+parser.add_argument("--top_categories", type=int, default=None, help="Only detect the most frequent categories of the dataset.")
+parser.add_argument("--skip", type=str, nargs="*", default=[], choices=["depth", "sam", "detections", "caption"])
+args = parser.parse_args()
+
+from hydra_vl4ai.util.config import Config
+Config.base_config_path = args.base_config
+Config.model_config_path = args.model_config
+
+from hydra_vl4ai.execution.toolbox import Toolbox
+from hydra_vl4ai.util.console import logger
+from rich.progress import track
+import exp_datasets
+from naver import ImageSession
+from naver.agent.artifact_store import ArtifactStore
+from naver.agent.smb import NaverStateMemoryBank
+from hydra_vl4ai.execution.image_patch import ImagePatch
+
+COCO_CATEGORIES = [
+    "person", "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat", "traffic light",
+    "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog", "horse", "sheep", "cow", "elephant",
+    "bear", "zebra", "giraffe", "backpack", "umbrella", "handbag", "tie", "suitcase", "frisbee", "skis", "snowboard",
+    "sports ball", "kite", "baseball bat", "baseball glove", "skateboard", "surfboard", "tennis racket", "bottle",
+    "wine glass", "cup", "fork", "knife", "spoon", "bowl", "banana", "apple", "sandwich", "orange", "broccoli",
+    "carrot", "hot dog", "pizza", "donut", "cake", "chair", "couch", "potted plant", "bed", "dining table", "toilet",
+    "tv", "laptop", "mouse", "remote", "keyboard", "cell phone", "microwave", "oven", "toaster", "sink",
+    "refrigerator", "book", "clock", "vase", "scissors", "teddy bear", "hair drier", "toothbrush",
+]
+# the common words of the queries for the COCO objects, detected as they are, since the extracted categories
+# are usually the words in the query
+COMMON_CATEGORIES = ["man", "woman", "guy", "lady", "boy", "girl", "kid", "child", "player", "shirt", "sofa",
+                     "table", "phone", "animal", "plate", "glass"]
+
+
+def mentioned_categories(queries: list[str]) -> list[str]:
+    text = " " + " ".join(re.findall(r"[a-z]+", " ".join(queries).lower())) + " "
+    return sorted(category for category in COCO_CATEGORIES + COMMON_CATEGORIES if re.search(rf" {category}s? ", text))
+
+
+def batched(items: list, batch_size: int):
+    iterator = iter(items)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def precompute_batch(store: ArtifactStore, keys: list[str], sessions: list[ImageSession], categories: list[list[str]]) -> None:
+    artifacts = [{} for _ in sessions]
+    threshold = round(Config.base_config["florence2_threshold"], 6)
+
+    if "depth" not in args.skip:
+        depths = Toolbox[Config.base_config["depth_model"]].forward_batch([session.image_array for session in sessions])
+        for artifact, depth in zip(artifacts, depths):
+            artifact["depth"] = depth
+
+    if "sam" not in args.skip:
+        for artifact, embedding in zip(artifacts, Toolbox["sam"].embed_batch([session.image_array for session in sessions])):
+            artifact["sam_embedding"] = {**embedding, "features": embedding["features"].float().cpu().numpy()}
+
+    if "detections" not in args.skip:
+        # the images mentioning the same category are detected in one batch, with the same prompt as `ImagePatch.find`
+        for category in sorted(set(chain.from_iterable(categories))):
+            indices = [i for i, image_categories in enumerate(categories) if category in image_categories]
+            prompt = "people" if category == "person" else category
+            coordinates = Toolbox[Config.base_config["grounding_model"]].forward_batch(
+                [sessions[i].image_tensor for i in indices], prompt, threshold)
+            for i, image_coordinates in zip(indices, coordinates):
+                artifacts[i][("detections", category, threshold)] = image_coordinates
+
+    if "caption" not in args.skip:
+        for artifact, session in zip(artifacts, sessions):
+            image_patch = ImagePatch(session.image_tensor, state_memory_bank=NaverStateMemoryBank())
+            artifact["caption"] = session.caption(image_patch)
+
+    for key, artifact in zip(keys, artifacts):
+        store.save(key, artifact)
+
+
+def main():
+    Toolbox.init(["naver.tool"])
+    dataset = exp_datasets.build_dataset(Config.base_config["dataset"], args.data_root)
+    store = ArtifactStore(args.output or Config.base_config["perception_artifact_path"])
+
+    # the queries of each image, in the dataset order
+    image_queries: dict[str, list[str]] = {}
+    for i in range(len(dataset)):
+        image_path, _, query, _ = dataset[i]
+        image_queries.setdefault(image_path, []).append(query)
+
+    image_categories = {image_path: args.categories if args.categories is not None else mentioned_categories(queries)
+                        for image_path, queries in image_queries.items()}
+    if args.top_categories is not None:
+        frequent = {category for category, _ in Counter(chain.from_iterable(image_categories.values())).most_common(args.top_categories)}
+        image_categories = {image_path: [c for c in categories if c in frequent] for image_path, categories in image_categories.items()}
+
+    with ThreadPoolExecutor(8) as executor:
+        keys = dict(zip(image_queries, executor.map(ArtifactStore.key, image_queries)))
+        image_paths = [image_path for image_path in image_queries if keys[image_path] not in store]
+        logger.info(f"Precomputing {len(image_paths)}/{len(image_queries)} images to {store.root}")
+
+        batches = list(batched(image_paths, args.batch_size))
+        # the next batch is decoded while the current batch is running on the GPUs
+        next_sessions = executor.submit(list, map(ImageSession, batches[0])) if batches else None
+        for i, batch in enumerate(track(batches, description="Precomputing")):
+            sessions = next_sessions.result()
+            if i + 1 < len(batches):
+                next_sessions = executor.submit(list, map(ImageSession, batches[i + 1]))
+            precompute_batch(store, [keys[image_path] for image_path in batch], sessions,
+                             [image_categories[image_path] for image_path in batch])
+
+
+if __name__ == "__main__":
+    main()
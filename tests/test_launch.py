@@ -0,0 +1,27 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from naver.utils.result_store import ResultStore
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_merge_shard_results(tmp_path):
+    with ResultStore(tmp_path / "result.naver_refcoco.shard0of2.sqlite") as store:
+        store.add({"datum_id": 1, "result": None}, index=1)
+        store.add({"datum_id": 2, "result": [0, 0, 1, 1]}, index=2)
+    with ResultStore(tmp_path / "result.naver_refcoco.shard1of2.sqlite") as store:
+        # the retried datum of a resumed run
+        store.add({"datum_id": 1, "result": [1, 1, 2, 2]}, index=1)
+        store.add({"datum_id": 0, "result": [2, 2, 3, 3]}, index=0)
+    # the jsonl of a shard is ignored when its store exists
+    (tmp_path / "result.naver_refcoco.shard1of2.jsonl").write_text(json.dumps({"datum_id": 9, "result": None}) + "\n")
+
+    subprocess.run([sys.executable, "launch.py", "--merge_only", "--result_folder", str(tmp_path)], cwd=ROOT, check=True)
+
+    lines = (tmp_path / "result.naver_refcoco.jsonl").read_text().splitlines()
+    results = [json.loads(line) for line in lines]
+    assert [result["datum_id"] for result in results] == [0, 1, 2]
+    assert results[1]["result"] == [1, 1, 2, 2]
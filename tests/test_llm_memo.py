@@ -0,0 +1,54 @@
+from naver.utils import llm_memo
+from naver.utils.accounting import track_usage
+from naver.utils.llm_memo import LLMMemo
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_key_normalizes_messages():
+    key = LLMMemo.make_key("gpt-4o", [{"role": "User", "content": " find the dog \n"}])
+    assert key == LLMMemo.make_key("gpt-4o", [{"role": "user", "content": "find the dog"}])
+    assert key != LLMMemo.make_key("gpt-4o", [{"role": "user", "content": "find the dog"}], "json")
+    assert key != LLMMemo.make_key("gpt-4o-mini", [{"role": "user", "content": "find the dog"}])
+
+
+def test_lookups_are_recorded_in_the_request_usage(tmp_path):
+    memo = LLMMemo(str(tmp_path / "memo.sqlite"))
+    with track_usage() as usage:
+        assert memo.get("a") is None
+        memo.put("a", "gpt-4o", "response")
+        assert memo.get("a") == "response"
+    assert (usage.memo_hits, usage.memo_misses) == (1, 1)
+    assert (memo.hits, memo.misses) == (1, 1)
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_memo.time, "time", clock)
+    memo = LLMMemo(str(tmp_path / "memo.sqlite"), ttl=10.)
+    memo.put("a", "gpt-4o", "response")
+    clock.now += 5
+    assert memo.get("a") == "response"
+    clock.now += 10
+    assert memo.get("a") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_memo.time, "time", clock)
+    memo = LLMMemo(str(tmp_path / "memo.sqlite"), max_entries=2)
+    for key in ("a", "b"):
+        clock.now += 1
+        memo.put(key, "gpt-4o", key)
+    clock.now += 1
+    assert memo.get("a") == "a"
+    clock.now += 1
+    memo.put("c", "gpt-4o", "c")
+    assert memo.get("b") is None
+    assert memo.get("a") == "a" and memo.get("c") == "c"
@@ -0,0 +1,33 @@
+import pytest
+
+from naver.agent.logic_reasoning.problog2scallop import parse_problog_program, translate_problog_program_to_scallop
+
+
+def test_translate_rule():
+    code = 'target(ID) :- entity(ID, "person", _, _, _, _), relation(ID, _, "left of").'
+    assert translate_problog_program_to_scallop(code) == \
+        'rel target(ID) = entity(ID, "person", _, _, _, _) and relation_(ID, _, "left of")'
+
+
+def test_single_quoted_atoms_are_strings():
+    code = "target(ID) :- entity(ID, 'dog', _, _, _, _), attribute(ID, 'red')."
+    program = parse_problog_program(code)
+    assert program.to_scallop() == 'rel target(ID) = entity(ID, "dog", _, _, _, _) and attribute(ID, "red")'
+    assert program.string_arguments("attribute", 1) == {"red"}
+
+
+def test_arithmetic():
+    code = 'target(ID) :- entity(ID, "person", X, _, _, _), Y is X + 1, Y - 2 >= -3 * (X + 1).'
+    assert translate_problog_program_to_scallop(code) == \
+        'rel target(ID) = entity(ID, "person", X, _, _, _) and Y == X + 1 and Y - 2 >= -3 * (X + 1)'
+
+
+def test_negation_and_directive():
+    code = 'target(ID) :- entity(ID, "cat", _, _, _, _), \\+ relation(ID, _, "near").\nquery(target(ID)).'
+    assert translate_problog_program_to_scallop(code) == \
+        'rel target(ID) = entity(ID, "cat", _, _, _, _) and ~relation_(ID, _, "near")'
+
+
+def test_unsupported_operator():
+    with pytest.raises(ValueError, match="unsupported operator 'mod'"):
+        parse_problog_program('target(ID) :- entity(ID, "cat", X, _, _, _), X mod 2.')
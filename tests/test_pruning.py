@@ -0,0 +1,13 @@
+import numpy as np
+
+from naver.context.pruning import prune_entities
+
+
+def test_prune_duplicates_with_zero_area_box():
+    bboxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [5, 5, 5, 20]])
+    keep, merged_bboxes, report = prune_entities(["cat", "cat", "cat"], bboxes, np.array([0.9, 0.8, 0.7]),
+                                                 image_area=400., duplicate_iou=0.5)
+    # the first two boxes are merged, the zero-area box is kept on its own
+    assert keep.tolist() == [0, 2]
+    assert merged_bboxes[1].tolist() == [5, 5, 5, 20]
+    assert report.duplicates == 1
@@ -0,0 +1,31 @@
+import json
+
+from naver.utils.result_store import ResultStore
+
+
+def test_results_are_resumed_and_exported_in_dataset_order(tmp_path):
+    path = tmp_path / "result.sqlite"
+    with ResultStore(path, batch_size=2) as store:
+        store.add({"datum_id": 7, "result": [0, 0, 1, 1], "iou": 0.5}, index=1)
+        # the pending result is visible before the batch is written
+        assert 7 in store
+        store.add({"datum_id": "a", "result": None, "iou": 0.}, index=0)
+        store.add({"datum_id": 7, "result": [0, 0, 2, 2], "iou": 0.9}, index=1)
+
+    with ResultStore(path) as store:
+        assert len(store) == 2
+        assert store.completed() == {7, "a"}
+        assert [record["datum_id"] for record in store] == ["a", 7]
+        assert store._conn.execute("SELECT success, iou FROM results WHERE datum_id = 7").fetchone() == (1, 0.9)
+        store.export_jsonl(tmp_path / "result.jsonl")
+
+    lines = (tmp_path / "result.jsonl").read_text().splitlines()
+    assert [json.loads(line)["datum_id"] for line in lines] == ["a", 7]
+
+
+def test_import_jsonl_skips_truncated_lines(tmp_path):
+    jsonl_path = tmp_path / "result.jsonl"
+    jsonl_path.write_text(json.dumps({"datum_id": 1, "result": None}) + "\n" + '{"datum_id": 2, "res')
+    with ResultStore(tmp_path / "result.sqlite") as store:
+        assert store.import_jsonl(jsonl_path) == 1
+        assert 1 in store and 2 not in store
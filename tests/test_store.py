@@ -0,0 +1,53 @@
+import numpy as np
+
+from naver.context.entity import Entity
+from naver.context.relation import GEOMETRY_RELATIONS, SymbolicRelationEstimator
+from naver.context.store import ContextStore
+
+
+def _entities(image_shape: tuple[int, int]) -> list[Entity]:
+    bboxes = [[2, 3, 20, 15], [10, 8, 30, 28], [25, 1, 38, 9], [5, 18, 12, 29]]
+    entities = []
+    for num, bbox in enumerate(bboxes):
+        entity = Entity(num, "cat" if num < 2 else "dog", bbox, 0.9 - num * 0.1)
+        entity.mask = np.zeros(image_shape, dtype=bool)
+        entity.mask[bbox[1]:bbox[3], bbox[0]:bbox[2]] = True
+        entities.append(entity)
+    return entities
+
+
+def test_geometry_relation_tensor_matches_pairwise_relations():
+    rng = np.random.default_rng(0)
+    image = np.zeros((32, 40, 3), dtype=np.uint8)
+    estimator = SymbolicRelationEstimator(image, depth=rng.random((32, 40)))
+    entities = _entities(image.shape[:2])
+
+    probs = estimator.generate_geometry_relation_tensor(entities)
+    assert probs.shape == (len(entities), len(entities), len(GEOMETRY_RELATIONS))
+    assert np.isnan(probs[np.arange(len(entities)), np.arange(len(entities))]).all()
+    for i in range(len(entities)):
+        for j in range(i + 1, len(entities)):
+            a_to_b, b_to_a = estimator.generate_geometry_relations(entities[i], entities[j])
+            assert [name for name, _ in a_to_b] == GEOMETRY_RELATIONS
+            np.testing.assert_allclose(probs[i, j], [prob for _, prob in a_to_b], rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(probs[j, i], [prob for _, prob in b_to_a], rtol=1e-5, atol=1e-6)
+
+
+def test_store_relation_groups_keep_pairwise_order():
+    entities = _entities((32, 40))
+    n = len(entities)
+    probs = np.arange(n * n * len(GEOMETRY_RELATIONS), dtype=np.float64).reshape(n, n, -1)
+
+    tensor_store = ContextStore.from_entities(entities)
+    tensor_store.set_relation_tensor(GEOMETRY_RELATIONS, probs)
+    pairwise_store = ContextStore.from_entities(entities)
+    for i in range(n):
+        for j in range(i + 1, n):
+            pairwise_store.set_relation(i, j, list(zip(GEOMETRY_RELATIONS, probs[i, j].tolist())))
+            pairwise_store.set_relation(j, i, list(zip(GEOMETRY_RELATIONS, probs[j, i].tolist())))
+
+    expected = [(i, j) for a in range(n) for b in range(a + 1, n) for i, j in ((a, b), (b, a))]
+    groups = list(tensor_store.relation_groups())
+    assert [(s, o) for s, o, _ in groups] == expected
+    assert groups == list(pairwise_store.relation_groups())
+    assert all(tensor_store.has_relation(name) for name in GEOMETRY_RELATIONS)
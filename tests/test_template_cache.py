@@ -0,0 +1,36 @@
+from naver.logic.template_cache import LogicTemplateCache, query_signature
+
+RULE = 'target(ID) :- entity(ID, "person", _, _, _, _), attribute(ID, "red"), relation(ID, Y, "left of").'
+
+
+def test_paraphrased_queries_share_the_signature():
+    person = query_signature("The person in red on the left", ["person"])
+    man = query_signature("man in blue left", ["man", "car"])
+    assert person.key == man.key == ("<category0>", "<attribute0>", "left")
+    assert (man.categories, man.attributes) == (("man",), ("blue",))
+
+
+def test_template_is_instantiated_for_another_query():
+    cache = LogicTemplateCache(max_size=1)
+    assert cache.put(query_signature("person in red left", ["person"]), RULE)
+    rule = cache.get(query_signature("man in blue left", ["man"]))
+    assert rule == 'target(ID) :- entity(ID, "man", _, _, _, _), attribute(ID, "blue"), relation(ID, Y, "left of").'
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_rule_with_unknown_literal_is_not_cached():
+    cache = LogicTemplateCache()
+    signature = query_signature("person left", ["person"])
+    assert not cache.put(signature, 'target(ID) :- entity(ID, "dog", _, _, _, _).')
+    assert cache.get(signature) is None and cache.misses == 1
+
+
+def test_templates_are_evicted_and_invalidated():
+    cache = LogicTemplateCache(max_size=1)
+    left = query_signature("person left", ["person"])
+    right = query_signature("person right", ["person"])
+    cache.put(left, 'target(ID) :- entity(ID, "person", _, _, _, _).')
+    cache.put(right, 'target(ID) :- entity(ID, "person", _, _, _, _).')
+    assert len(cache) == 1 and cache.get(left) is None
+    cache.invalidate(right)
+    assert cache.get(right) is None